@@ -0,0 +1,433 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from databse_manager import INTERNAL_TABLE_PREFIX, DatabaseManager
+from query_errors import QueryPipelineError
+
+
+AGGREGATE_TABLE_PREFIX = f"{INTERNAL_TABLE_PREFIX}agg_"
+CATALOG_TABLE = f"{INTERNAL_TABLE_PREFIX}aggregates"
+# Triggers on each source table that retire its summaries when its rows change
+STALE_TRIGGER_PREFIX = f"{INTERNAL_TABLE_PREFIX}aggstale_"
+STALE_TRIGGER_EVENTS = ("INSERT", "UPDATE", "DELETE")
+# A shape must appear this many times in memory before it is materialized
+MIN_HITS = int(os.getenv("AGGREGATE_MIN_HITS", "2"))
+# Tables smaller than this are fast enough to aggregate directly
+MIN_SOURCE_ROWS = int(os.getenv("AGGREGATE_MIN_ROWS", "50000"))
+MAX_SUMMARY_TABLES = int(os.getenv("AGGREGATE_MAX_TABLES", "20"))
+# Summaries with more groups than this fraction of the source rows are not worth keeping
+MAX_GROUP_RATIO = 0.1
+
+SUPPORTED_AGGREGATES = (exp.Avg, exp.Sum, exp.Count, exp.Min, exp.Max)
+# Measure key for COUNT(*)
+STAR = "*"
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _stale_triggers(table: str) -> List[str]:
+    digest = hashlib.sha1(table.encode()).hexdigest()[:10]
+    return [f"{STALE_TRIGGER_PREFIX}{digest}_{event.lower()}" for event in STALE_TRIGGER_EVENTS]
+
+
+def _measure_key(aggregate: exp.Expression) -> str:
+    """Canonical SQL of an aggregate's argument, without table qualifiers."""
+    if isinstance(aggregate.this, exp.Star):
+        return STAR
+    argument = aggregate.this.copy().transform(
+        lambda node: exp.Column(this=node.this.copy()) if isinstance(node, exp.Column) else node
+    )
+    return argument.sql(dialect="sqlite")
+
+
+class AggregateShape:
+    """A single-table GROUP BY query reduced to what a summary table must hold to answer it."""
+
+    def __init__(self, table: str, group_columns: List[str], measures: List[str], filter_columns: List[str] = ()):
+        self.table = table
+        # A summary must group by the query's group columns and any column its WHERE filters on
+        self.group_columns = tuple(sorted(set(group_columns) | set(filter_columns)))
+        self.measures = sorted(set(measures) - {STAR})
+
+    @property
+    def key(self) -> Tuple[str, Tuple[str, ...]]:
+        return self.table, self.group_columns
+
+    @classmethod
+    def from_tree(cls, tree: exp.Expression) -> Optional["AggregateShape"]:
+        """
+        Analyze a parsed query; returns None unless it can be answered from a summary table.
+
+        Supported: one plain table, GROUP BY plain columns, AVG/SUM/COUNT/MIN/MAX
+        (not DISTINCT), WHERE on plain columns, and HAVING/ORDER BY that only use
+        group columns, aggregates or output aliases.
+        """
+        if not isinstance(tree, exp.Select) or tree.args.get("with") or tree.args.get("joins"):
+            return None
+        if tree.args.get("distinct") or tree.find(exp.Window) or len(list(tree.find_all(exp.Select))) > 1:
+            return None
+        source = tree.find(exp.From)
+        group = tree.args.get("group")
+        if source is None or group is None or not isinstance(source.this, exp.Table) or source.this.db:
+            return None
+        if not group.expressions or not all(isinstance(column, exp.Column) for column in group.expressions):
+            return None
+
+        group_columns = {column.name for column in group.expressions}
+        aliases = {select.alias: select.this for select in tree.expressions if isinstance(select, exp.Alias)}
+        for name in group_columns:
+            # GROUP BY an output alias groups by an expression, not the column
+            aliased = aliases.get(name)
+            if aliased is not None and not (isinstance(aliased, exp.Column) and aliased.name == name):
+                return None
+
+        measures = []
+        for aggregate in tree.find_all(exp.AggFunc):
+            if not isinstance(aggregate, SUPPORTED_AGGREGATES) or aggregate.expressions:
+                return None
+            if isinstance(aggregate.this, exp.Distinct) or aggregate.this.find(exp.AggFunc):
+                return None
+            measures.append(_measure_key(aggregate))
+
+        for star in tree.find_all(exp.Star):
+            if not isinstance(star.parent, exp.Count):
+                return None
+        filter_columns = set()
+        for column in tree.find_all(exp.Column):
+            if column.find_ancestor(exp.AggFunc) or column.name in group_columns:
+                continue
+            if column.find_ancestor(exp.Where):
+                filter_columns.add(column.name)
+                continue
+            # ORDER BY and HAVING may refer to output columns by alias
+            if column.name in aliases and not column.table and column.find_ancestor(exp.Order, exp.Having):
+                continue
+            return None
+
+        return cls(source.this.name, list(group_columns), measures, list(filter_columns))
+
+    @classmethod
+    def from_sql(cls, sql: str) -> Optional["AggregateShape"]:
+        try:
+            return cls.from_tree(sqlglot.parse_one(sql, dialect="sqlite"))
+        except Exception:
+            return None
+
+
+class SummaryTable:
+    """Catalog entry for one materialized summary table."""
+
+    def __init__(self, name: str, source_table: str, group_columns: List[str], measures: List[str],
+                 group_count: int, source_max_rowid: Optional[int], hits: int = 0):
+        self.name = name
+        self.source_table = source_table
+        self.group_columns = list(group_columns)
+        self.measures = list(measures)
+        self.group_count = group_count
+        self.source_max_rowid = source_max_rowid
+        self.hits = hits
+
+    def covers(self, shape: AggregateShape) -> bool:
+        """Whether this summary holds every group column and measure the shape needs."""
+        return (
+            self.source_table == shape.table
+            and set(shape.group_columns) <= set(self.group_columns)
+            and set(shape.measures) <= set(self.measures)
+        )
+
+    def column(self, measure: str, statistic: str) -> exp.Column:
+        return exp.column(f"m{self.measures.index(measure)}_{statistic}")
+
+
+class AggregateCache:
+    """
+    Summary tables for frequently asked GROUP BY shapes, kept inside the database itself.
+
+    Shapes are mined from the database's conversation memory. A summary stores
+    per-group COUNT(*) and SUM/COUNT/MIN/MAX of each measure, which is enough to
+    answer AVG/SUM/COUNT/MIN/MAX at the same or any coarser grouping. Validated
+    queries are rewritten to read the summary instead of scanning the source table.
+
+    Each source table gets INSERT/UPDATE/DELETE triggers that delete its rows
+    from the catalog, so a summary is never used after its source changes,
+    whoever changed it.
+    """
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+        self._catalog: Optional[List[SummaryTable]] = None
+        self._sync_lock = threading.Lock()
+
+    def _connect_for_build(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_manager.db_path, isolation_level=None, timeout=30)
+
+    @property
+    def catalog(self) -> List[SummaryTable]:
+        """Materialized summaries, loaded from the database on first use."""
+        if self._catalog is None:
+            self._catalog = self._load_catalog()
+        return self._catalog
+
+    def _load_catalog(self) -> List[SummaryTable]:
+        try:
+            rows = self.db_manager.execute_query(
+                f"SELECT name, source_table, group_columns, measures, group_count, source_max_rowid, hits "
+                f"FROM {CATALOG_TABLE}"
+            )
+        except QueryPipelineError:
+            # No summaries have been built for this database yet
+            return []
+        return [
+            SummaryTable(row["name"], row["source_table"], json.loads(row["group_columns"]),
+                         json.loads(row["measures"]), row["group_count"], row["source_max_rowid"], row["hits"])
+            for row in rows
+        ]
+
+    @staticmethod
+    def mine(memory_file: str) -> Tuple[Counter, Dict[Tuple, AggregateShape]]:
+        """
+        Count GROUP BY shapes in a memory file.
+
+        Shapes grouping the same table by the same columns are merged, with
+        their measures unioned.
+
+        Returns:
+            (hits per shape key, merged shape per key)
+        """
+        if not os.path.exists(memory_file):
+            return Counter(), {}
+        try:
+            with open(memory_file, "r") as f:
+                entries = json.load(f)
+        except (IOError, json.JSONDecodeError):
+            return Counter(), {}
+
+        hits: Counter = Counter()
+        shapes: Dict[Tuple, AggregateShape] = {}
+        for entry in entries:
+            shape = AggregateShape.from_sql(entry.get("sql") or "")
+            if shape is None:
+                continue
+            hits[shape.key] += 1
+            if shape.key in shapes:
+                shape = AggregateShape(shape.table, list(shape.group_columns),
+                                       shapes[shape.key].measures + shape.measures)
+            shapes[shape.key] = shape
+        return hits, shapes
+
+    def sync(self, memory_file: str) -> List[str]:
+        """
+        Materialize frequent shapes from memory that no summary covers yet.
+
+        Returns immediately (with no changes) if another sync is running.
+
+        Returns:
+            Names of the summary tables created
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return []
+        try:
+            hits, shapes = self.mine(memory_file)
+            created = []
+            for key, count in hits.most_common():
+                if count < MIN_HITS or len(self.catalog) >= MAX_SUMMARY_TABLES:
+                    break
+                shape = shapes[key]
+                if any(summary.covers(shape) for summary in self.catalog):
+                    continue
+                summary = self._materialize(shape, count)
+                if summary is not None:
+                    created.append(summary.name)
+                    self._catalog = self._load_catalog()
+            return created
+        finally:
+            self._sync_lock.release()
+
+    def sync_in_background(self, memory_file: str) -> None:
+        threading.Thread(target=self.sync, args=(memory_file,), daemon=True, name="nlsql-aggregates").start()
+
+    def refresh(self, memory_file: Optional[str] = None, tables: Optional[List[str]] = None) -> List[str]:
+        """
+        Drop summary tables and rebuild them from memory, after the source data changed.
+
+        Args:
+            memory_file: Memory to mine for shapes (nothing is rebuilt if None)
+            tables: Only drop the summaries of these source tables (all of them if None)
+
+        Returns:
+            Names of the summary tables rebuilt
+        """
+        with self._sync_lock:
+            conn = self._connect_for_build()
+            try:
+                if tables is None:
+                    internal = conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type='table' AND (name LIKE ? OR name = ?)",
+                        (f"{AGGREGATE_TABLE_PREFIX}%", CATALOG_TABLE)
+                    ).fetchall()
+                    # The triggers delete from the catalog, so they must go with it
+                    triggers = conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE ?",
+                        (f"{STALE_TRIGGER_PREFIX}%",)
+                    ).fetchall()
+                else:
+                    catalog = self._load_catalog()
+                    internal = [(summary.name,) for summary in catalog if summary.source_table in tables]
+                    # Summaries whose source changed were already unlisted by its triggers
+                    listed = {summary.name for summary in catalog}
+                    internal += [
+                        (name,) for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                        if name.startswith(AGGREGATE_TABLE_PREFIX) and name not in listed
+                    ]
+                conn.execute("BEGIN")
+                if tables is None:
+                    for (name,) in triggers:
+                        conn.execute(f"DROP TRIGGER IF EXISTS {_quote(name)}")
+                for (name,) in internal:
+                    conn.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+                    if tables is not None:
+                        conn.execute(f"DELETE FROM {CATALOG_TABLE} WHERE name = ?", (name,))
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            self._catalog = None if tables is not None else []
+        return self.sync(memory_file) if memory_file else []
+
+    def _materialize(self, shape: AggregateShape, hits: int) -> Optional[SummaryTable]:
+        """Build one summary table, unless the source is too small or the summary too large."""
+        digest = hashlib.sha1(json.dumps([shape.table, shape.group_columns]).encode()).hexdigest()[:10]
+        name = f"{AGGREGATE_TABLE_PREFIX}{digest}"
+        source = _quote(shape.table)
+        groups = ", ".join(_quote(column) for column in shape.group_columns)
+        selects = [groups, "COUNT(*) AS n_rows"]
+        for i, measure in enumerate(shape.measures):
+            selects += [f"SUM({measure}) AS m{i}_sum", f"COUNT({measure}) AS m{i}_cnt",
+                        f"MIN({measure}) AS m{i}_min", f"MAX({measure}) AS m{i}_max"]
+
+        conn = self._connect_for_build()
+        try:
+            source_rows, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {source}").fetchone()
+            if source_rows < MIN_SOURCE_ROWS:
+                return None
+
+            conn.execute("BEGIN")
+            conn.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+            conn.execute(f"CREATE TABLE {_quote(name)} AS SELECT {', '.join(selects)} FROM {source} GROUP BY {groups}")
+            group_count = conn.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0]
+            if group_count > source_rows * MAX_GROUP_RATIO:
+                conn.execute("ROLLBACK")
+                return None
+
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (name TEXT PRIMARY KEY, source_table TEXT, "
+                f"group_columns TEXT, measures TEXT, group_count INTEGER, source_max_rowid INTEGER, "
+                f"hits INTEGER, built_at REAL)"
+            )
+            table_literal = "'" + shape.table.replace("'", "''") + "'"
+            for trigger, event in zip(_stale_triggers(shape.table), STALE_TRIGGER_EVENTS):
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {_quote(trigger)} AFTER {event} ON {source} "
+                    f"BEGIN DELETE FROM {CATALOG_TABLE} WHERE source_table = {table_literal}; END"
+                )
+            conn.execute(
+                f"INSERT OR REPLACE INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, shape.table, json.dumps(shape.group_columns), json.dumps(shape.measures),
+                 group_count, max_rowid, hits, time.time())
+            )
+            conn.execute("COMMIT")
+            return SummaryTable(name, shape.table, list(shape.group_columns), shape.measures,
+                                group_count, max_rowid, hits)
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return None
+        finally:
+            conn.close()
+
+    def _is_current(self, summary: SummaryTable) -> bool:
+        """
+        Whether a summary still matches its source table.
+
+        Any insert, update or delete on the source removes the summary from the
+        catalog through its triggers; a source table that was dropped and
+        recreated has lost its triggers, so it counts as changed too.
+        """
+        triggers = _stale_triggers(summary.source_table)
+        try:
+            rows = self.db_manager.execute_query(
+                f"SELECT EXISTS (SELECT 1 FROM {CATALOG_TABLE} WHERE name = ?) AS listed, "
+                f"(SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? "
+                f"AND name IN ({', '.join('?' for _ in triggers)})) AS triggers",
+                params=(summary.name, summary.source_table, *triggers)
+            )
+        except QueryPipelineError:
+            return False
+        return bool(rows[0]["listed"]) and rows[0]["triggers"] == len(triggers)
+
+    @staticmethod
+    def _summary_expression(aggregate: exp.Expression, summary: SummaryTable) -> exp.Expression:
+        """Re-express an aggregate over the source as an aggregate over the summary."""
+        measure = _measure_key(aggregate)
+        if isinstance(aggregate, exp.Count):
+            return exp.Sum(this=exp.column("n_rows") if measure == STAR else summary.column(measure, "cnt"))
+        if isinstance(aggregate, exp.Sum):
+            return exp.Sum(this=summary.column(measure, "sum"))
+        if isinstance(aggregate, exp.Min):
+            return exp.Min(this=summary.column(measure, "min"))
+        if isinstance(aggregate, exp.Max):
+            return exp.Max(this=summary.column(measure, "max"))
+        # AVG = total / non-NULL count; NULL when every value is NULL, as with AVG
+        return exp.Div(
+            this=exp.cast(exp.Sum(this=summary.column(measure, "sum")), "REAL"),
+            expression=exp.Sum(this=summary.column(measure, "cnt"))
+        )
+
+    def rewrite(self, sql: str) -> Optional[str]:
+        """
+        Rewrite a validated query to read from a summary table, if one covers it.
+
+        Output column names are preserved, so results are indistinguishable
+        from running the original query.
+
+        Returns:
+            The rewritten SQL, or None if no current summary applies
+        """
+        if not self.catalog:
+            return None
+        try:
+            tree = sqlglot.parse_one(sql, dialect="sqlite")
+        except Exception:
+            return None
+        shape = AggregateShape.from_tree(tree)
+        if shape is None:
+            return None
+        candidates = sorted((summary for summary in self.catalog if summary.covers(shape)),
+                            key=lambda summary: summary.group_count)
+        summary = next((candidate for candidate in candidates if self._is_current(candidate)), None)
+        if summary is None:
+            return None
+
+        try:
+            column_names = self.db_manager.column_names(sql)
+        except QueryPipelineError:
+            return None
+
+        for aggregate in list(tree.find_all(*SUPPORTED_AGGREGATES)):
+            aggregate.replace(self._summary_expression(aggregate, summary))
+        source = tree.find(exp.From).this
+        source.replace(exp.alias_(exp.to_table(summary.name), source.alias_or_name, table=True))
+        for select, name in zip(tree.expressions, column_names):
+            if not isinstance(select, (exp.Alias, exp.Column)):
+                select.replace(exp.alias_(select, name, quoted=True))
+        return tree.sql(dialect="sqlite")
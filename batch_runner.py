@@ -0,0 +1,187 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from query_service import QueryService
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for duplicate detection (case and whitespace insensitive)."""
+    return " ".join(question.split()).casefold()
+
+
+def load_batch_items(input_path: str, default_database: Optional[str] = None) -> List[Dict]:
+    """
+    Load questions from a CSV or JSONL file.
+
+    Each item needs a 'question' and a 'database' (falls back to default_database).
+
+    Args:
+        input_path: Path to a .csv file with a header row, or a .jsonl file
+        default_database: Database used for items that do not name one
+
+    Returns:
+        List of {"index", "question", "database"} dictionaries in file order
+    """
+    if input_path.endswith(".jsonl"):
+        with open(input_path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(input_path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    items = []
+    for index, row in enumerate(rows):
+        question = (row.get("question") or "").strip()
+        database = (row.get("database") or default_database or "").strip()
+        if not question or not database:
+            raise ValueError(f"Row {index + 1}: 'question' and 'database' are required")
+        items.append({"index": index, "question": question, "database": database})
+    return items
+
+
+class BatchResultWriter:
+    """Thread-safe, incremental writer for batch results (JSONL or CSV)."""
+
+    CSV_FIELDS = [
+        "index", "question", "database", "ok", "deduplicated", "row_count",
+        "sql", "summary", "error_stage", "error", "wall_ms", "timings_ms"
+    ]
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.is_csv = output_path.endswith(".csv")
+        self._lock = threading.Lock()
+        self._file = open(output_path, "w", encoding="utf-8", newline="")
+        self._csv_writer = None
+        if self.is_csv:
+            self._csv_writer = csv.DictWriter(self._file, fieldnames=self.CSV_FIELDS)
+            self._csv_writer.writeheader()
+            self._file.flush()
+
+    def write(self, record: Dict) -> None:
+        """Append one record and flush it to disk."""
+        with self._lock:
+            if self.is_csv:
+                error = record.get("error") or {}
+                self._csv_writer.writerow({
+                    "index": record["index"],
+                    "question": record["question"],
+                    "database": record["database"],
+                    "ok": record["ok"],
+                    "deduplicated": record["deduplicated"],
+                    "row_count": record["row_count"],
+                    "sql": record["sql"],
+                    "summary": record["summary"],
+                    "error_stage": error.get("stage"),
+                    "error": error.get("message"),
+                    "wall_ms": record["wall_ms"],
+                    "timings_ms": json.dumps(record["timings_ms"])
+                })
+            else:
+                self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class BatchRunner:
+    """Answers a file of questions with bounded parallelism across LLM calls and database reads."""
+
+    def __init__(
+        self,
+        db_dir: str = "db",
+        llm_concurrency: int = 4,
+        db_concurrency: int = 4,
+        summarize: bool = True,
+        include_rows: bool = True
+    ):
+        self.service = QueryService(db_dir, llm_concurrency=llm_concurrency, db_concurrency=db_concurrency)
+        # Enough workers to keep both the LLM and database slots busy
+        self.max_workers = llm_concurrency + db_concurrency
+        self.summarize = summarize
+        self.include_rows = include_rows
+
+    @staticmethod
+    def deduplicate(items: List[Dict]) -> Dict[Tuple[str, str], List[Dict]]:
+        """Group items that ask the same question of the same database, preserving order."""
+        groups: Dict[Tuple[str, str], List[Dict]] = {}
+        for item in items:
+            key = (item["database"], normalize_question(item["question"]))
+            groups.setdefault(key, []).append(item)
+        return groups
+
+    def _answer(self, item: Dict) -> Dict:
+        """Run one unique question and build its output record."""
+        started = time.perf_counter()
+        # Canned report questions are answered without conversation memory
+        outcome = self.service.ask(
+            item["question"],
+            item["database"],
+            context="",
+            summarize=self.summarize,
+            remember=False
+        )
+        record = outcome.to_dict()
+        if not self.include_rows:
+            record.pop("result")
+        record["wall_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return record
+
+    def run(self, items: List[Dict], output_path: str) -> Dict:
+        """
+        Answer all items, writing one record per input item as results arrive.
+
+        Args:
+            items: Items from load_batch_items()
+            output_path: Destination .jsonl or .csv file
+
+        Returns:
+            Run statistics: total, unique, succeeded, failed and elapsed_ms
+        """
+        groups = self.deduplicate(items)
+        stats = {"total": len(items), "unique": len(groups), "succeeded": 0, "failed": 0}
+        started = time.perf_counter()
+
+        writer = BatchResultWriter(output_path)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="nlsql-batch") as executor:
+                futures = {executor.submit(self._answer, group[0]): group for group in groups.values()}
+                for future in as_completed(futures):
+                    record = future.result()
+                    for position, item in enumerate(futures[future]):
+                        writer.write({
+                            **record,
+                            "index": item["index"],
+                            "question": item["question"],
+                            "deduplicated": position > 0
+                        })
+                        stats["succeeded" if record["ok"] else "failed"] += 1
+        finally:
+            writer.close()
+
+        stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return stats
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    default_database: Optional[str] = None,
+    db_dir: str = "db",
+    llm_concurrency: int = 4,
+    db_concurrency: int = 4,
+    summarize: bool = True,
+    include_rows: bool = True
+) -> Dict:
+    """Load a question file and answer it with a BatchRunner."""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file not found: {input_path}")
+    items = load_batch_items(input_path, default_database)
+    runner = BatchRunner(db_dir, llm_concurrency, db_concurrency, summarize, include_rows)
+    return runner.run(items, output_path)
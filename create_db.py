@@ -1,11 +1,18 @@
 import csv
 import os
 import sqlite3
+from typing import Dict, Optional
+
+from aggregate_cache import AggregateCache
+from csv_refresh import invalidate_derived, refresh_table_from_csv
+from databse_manager import DatabaseManager
+from memory_management import MemoryManager
+from query_engines import ENGINE_MODE, ColumnarMirror
+from sample_cache import SampleCache
+from value_index import ValueIndex
 
 db_dir = 'db'
 
-# Create the db directory if it doesn't exist
-os.makedirs(db_dir, exist_ok=True)
 def create_db_from_csv(csv_file: str, db_name: str, table_name: str):
     """
     Create a SQLite database from a CSV file.
@@ -15,14 +22,16 @@ def create_db_from_csv(csv_file: str, db_name: str, table_name: str):
         db_name: Name for the database (without .db extension)
         table_name: Name for the table to create
     """
+    os.makedirs(db_dir, exist_ok=True)
     # Connect to SQLite database inside db directory
     db_path = os.path.join(db_dir, f'{db_name}.db')
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     print(f"Database created at: {db_path}")
+    existed = cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()
 
-    # Read CSV file (csv_file should be the full path)
-    with open(csv_file, 'r') as f:
+    # Read CSV file (csv_file should be the full path); utf-8-sig drops a leading byte order mark
+    with open(csv_file, 'r', encoding='utf-8-sig', newline='') as f:
         reader = csv.reader(f)
         
         # Get headers from first row
@@ -50,4 +59,45 @@ def create_db_from_csv(csv_file: str, db_name: str, table_name: str):
     for row in cursor.fetchall():
         print(row)
 
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+    # Precompute the column value index used to ground literals in generated SQL
+    ValueIndex.build_and_save(db_path)
+    # Summary tables no longer match the data; rebuild them for the shapes in memory
+    AggregateCache(DatabaseManager(db_path)).refresh(MemoryManager.get_memory_file_for_db(f'{db_name}.db'))
+    # Samples for approximate answers are built at import, while the data is fresh in the page cache
+    SampleCache(DatabaseManager(db_path)).refresh()
+    if ENGINE_MODE != "sqlite":
+        # A freshly created table holds exactly the CSV, so the columnar mirror loads it from there
+        ColumnarMirror(db_path).build(csv_sources=None if existed else {table_name: csv_file})
+
+
+def refresh_db_from_csv(
+    csv_file: str,
+    db_name: str,
+    table_name: str,
+    key_column: Optional[str] = None,
+    delete_missing: bool = False
+) -> Dict:
+    """
+    Refresh a table created by create_db_from_csv() from an updated CSV, applying only the changes.
+
+    Args:
+        csv_file: Full path to the updated CSV file
+        db_name: Name of the database (without .db extension)
+        table_name: Table the CSV was imported into
+        key_column: Column identifying a row; rows are matched by content hash if None
+        delete_missing: Also delete rows that are no longer in the CSV
+
+    Returns:
+        Report with inserted/updated/deleted/unchanged counts and the caches rebuilt
+    """
+    db_path = os.path.join(db_dir, f'{db_name}.db')
+    report = refresh_table_from_csv(db_path, csv_file, table_name, key_column, delete_missing)
+    print(f"Inserted {report['inserted']}, updated {report['updated']}, deleted {report['deleted']} rows "
+          f"({report['unchanged']} unchanged)")
+
+    # Only what was derived from the changed table is rebuilt, and only if something changed
+    if report['inserted'] or report['updated'] or report['deleted']:
+        report['rebuilt'] = invalidate_derived(db_path, f'{db_name}.db', [table_name])
+    return report
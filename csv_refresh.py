@@ -0,0 +1,350 @@
+import csv
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from aggregate_cache import AggregateCache
+from databse_manager import INTERNAL_TABLE_PREFIX, DatabaseManager
+from memory_management import MemoryManager
+from query_engines import ColumnarMirror
+from query_errors import UploadError
+from sample_cache import SampleCache
+from value_index import ValueIndex
+
+
+LEDGER_TABLE_PREFIX = f"{INTERNAL_TABLE_PREFIX}ledger_"
+CATALOG_TABLE = f"{INTERNAL_TABLE_PREFIX}ledgers"
+# Rows hashed, staged or written per executemany batch
+REFRESH_BATCH_ROWS = 10000
+# Excel and other tools prefix UTF-8 CSVs with a byte order mark
+BOM = "\ufeff"
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def row_digest(values) -> str:
+    """Content hash of a row, with values compared as text (CSV imports store TEXT)."""
+    normalized = tuple(None if value is None else str(value) for value in values)
+    return hashlib.blake2b(repr(normalized).encode(), digest_size=16).hexdigest()
+
+
+def read_csv_rows(csv_file: str) -> Tuple[List[str], Iterator[List[str]]]:
+    """
+    Open a CSV for import.
+
+    Returns:
+        (header with any byte order mark removed, iterator over the data rows)
+    """
+    f = open(csv_file, "r", encoding="utf-8-sig", newline="")
+    reader = csv.reader(f)
+    try:
+        headers = next(reader)
+    except StopIteration:
+        f.close()
+        raise UploadError(f"CSV file is empty: {csv_file}")
+
+    def rows() -> Iterator[List[str]]:
+        with f:
+            yield from reader
+
+    return headers, rows()
+
+
+class RowLedger:
+    """
+    Identity and content hash of every row of a table, kept in an internal table.
+
+    Rows are identified by a key column, or by their content hash when there
+    is none. The ledger is what lets a refresh find the new, changed and
+    missing rows of a CSV without rehashing the table; it is rebuilt from
+    the table whenever the table was changed behind its back.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, table: str, columns: List[str], key_column: Optional[str]):
+        self.conn = conn
+        self.table = table
+        self.columns = columns
+        self.key_column = key_column
+        self.name = f"{LEDGER_TABLE_PREFIX}{hashlib.sha1(table.encode()).hexdigest()[:10]}"
+        self._key_position = columns.index(key_column) if key_column else None
+
+    def identify(self, values) -> Tuple[str, str]:
+        """(identity, digest) of a row given in table column order."""
+        digest = row_digest(values)
+        if self._key_position is None:
+            return digest, digest
+        key = values[self._key_position]
+        return ("" if key is None else str(key)), digest
+
+    def _table_state(self) -> Tuple[int, Optional[int]]:
+        return self.conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {_quote(self.table)}").fetchone()
+
+    def is_current(self) -> bool:
+        """Whether the ledger exists, uses the same key and matches the table's rows."""
+        try:
+            row = self.conn.execute(
+                f"SELECT key_column, source_rows, source_max_rowid FROM {CATALOG_TABLE} WHERE table_name = ?",
+                (self.table,)
+            ).fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None and row[0] == self.key_column and tuple(row[1:]) == self._table_state()
+
+    def rebuild(self) -> None:
+        """Hash every row of the table into a fresh ledger (once, or after outside changes)."""
+        self.conn.execute(f"DROP TABLE IF EXISTS {_quote(self.name)}")
+        self.conn.execute(f"CREATE TABLE {_quote(self.name)} (row_id INTEGER PRIMARY KEY, ident TEXT, digest TEXT)")
+        cursor = self.conn.execute(f"SELECT rowid, * FROM {_quote(self.table)}")
+        while True:
+            rows = cursor.fetchmany(REFRESH_BATCH_ROWS)
+            if not rows:
+                break
+            self.conn.executemany(
+                f"INSERT INTO {_quote(self.name)} VALUES (?, ?, ?)",
+                [(row[0], *self.identify(row[1:])) for row in rows]
+            )
+        self.conn.execute(f"CREATE INDEX {_quote(self.name + '_ident')} ON {_quote(self.name)} (ident)")
+        self.save_state()
+
+    def save_state(self) -> None:
+        """Record the table state the ledger matches (inside the caller's transaction)."""
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (table_name TEXT PRIMARY KEY, ledger TEXT, "
+            f"key_column TEXT, source_rows INTEGER, source_max_rowid INTEGER, updated_at REAL)"
+        )
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+            (self.table, self.name, self.key_column, *self._table_state(), time.time())
+        )
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+    if not columns:
+        raise UploadError(f"Table not found: {table}")
+    return columns
+
+
+def _column_order(headers: List[str], columns: List[str]) -> List[int]:
+    """Position in the CSV of each table column, matching names as the CSV spells them."""
+    # Tables imported before the BOM was stripped have it glued to their first column
+    positions = {header.lstrip(BOM): position for position, header in enumerate(headers)}
+    missing = [column for column in columns if column.lstrip(BOM) not in positions]
+    extra = sorted(set(positions) - {column.lstrip(BOM) for column in columns})
+    if missing or extra:
+        raise UploadError(
+            f"CSV columns do not match the table: missing {missing or 'none'}, unexpected {extra or 'none'}"
+        )
+    return [positions[column.lstrip(BOM)] for column in columns]
+
+
+def refresh_table_from_csv(
+    db_path: str,
+    csv_file: str,
+    table_name: str,
+    key_column: Optional[str] = None,
+    delete_missing: bool = False
+) -> Dict:
+    """
+    Apply only the difference between a CSV and the table previously imported from it.
+
+    With a key column, CSV rows whose key is new are inserted and rows whose
+    key exists with different values are updated in place (the last
+    occurrence of a key in the CSV wins). Without one, rows are matched by
+    content hash: rows not already present (as many times as the CSV has
+    them) are appended. The delta is applied in batched executemany calls
+    inside one transaction, so readers never see half a refresh.
+
+    Args:
+        db_path: Database holding the table
+        csv_file: Updated CSV with the same columns (in any order)
+        table_name: Table to refresh
+        key_column: Column identifying a row (e.g., 'Case_ID'); rows are hashed if None
+        delete_missing: Also delete rows that are no longer in the CSV
+
+    Returns:
+        Report with inserted, updated, deleted and unchanged row counts and timings
+
+    Raises:
+        UploadError: If the table or key column is missing or the CSV's columns differ.
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    try:
+        columns = _table_columns(conn, table_name)
+        if key_column is not None:
+            matches = [column for column in columns if column.lstrip(BOM) == key_column.lstrip(BOM)]
+            if not matches:
+                raise UploadError(f"Key column {key_column} is not a column of {table_name}")
+            key_column = matches[0]
+        headers, rows = read_csv_rows(csv_file)
+        order = _column_order(headers, columns)
+        ledger = RowLedger(conn, table_name, columns, key_column)
+        table, ledger_table = _quote(table_name), _quote(ledger.name)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not ledger.is_current():
+                ledger.rebuild()
+            ledger_ms = (time.perf_counter() - started) * 1000
+
+            # Pass 1: stage each CSV row's identity and digest; the values stay in the file
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS _incoming (ident TEXT PRIMARY KEY, digest TEXT, n INTEGER)")
+            conn.execute("DELETE FROM _incoming")
+            if key_column is None:
+                stage_sql = "INSERT INTO _incoming VALUES (?, ?, 1) ON CONFLICT(ident) DO UPDATE SET n = n + 1"
+            else:
+                stage_sql = "INSERT INTO _incoming VALUES (?, ?, 1) ON CONFLICT(ident) DO UPDATE SET digest = excluded.digest"
+            rows_before = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            csv_rows = 0
+            batch = []
+            for row in rows:
+                if not row:
+                    continue
+                if len(row) != len(headers):
+                    raise UploadError(f"CSV row {csv_rows + 2} has {len(row)} fields, expected {len(headers)}")
+                batch.append(ledger.identify([row[position] for position in order]))
+                csv_rows += 1
+                if len(batch) >= REFRESH_BATCH_ROWS:
+                    conn.executemany(stage_sql, batch)
+                    batch = []
+            conn.executemany(stage_sql, batch)
+
+            # The delta, computed in SQL against the ledger
+            if key_column is None:
+                wanted = {ident: missing for ident, missing in conn.execute(
+                    f"SELECT i.ident, i.n - COUNT(l.row_id) FROM _incoming i "
+                    f"LEFT JOIN {ledger_table} l ON l.ident = i.ident GROUP BY i.ident HAVING i.n > COUNT(l.row_id)"
+                )}
+                updates: Dict[str, List[int]] = {}
+            else:
+                wanted = {ident: 1 for (ident,) in conn.execute(
+                    f"SELECT i.ident FROM _incoming i LEFT JOIN {ledger_table} l ON l.ident = i.ident "
+                    f"WHERE l.row_id IS NULL"
+                )}
+                updates = {}
+                for ident, row_id in conn.execute(
+                    f"SELECT i.ident, l.row_id FROM _incoming i JOIN {ledger_table} l ON l.ident = i.ident "
+                    f"WHERE l.digest <> i.digest"
+                ):
+                    updates.setdefault(ident, []).append(row_id)
+
+            deletes: List[int] = []
+            if delete_missing and key_column is None:
+                # Identical rows beyond the number of copies the CSV still has, newest first
+                for ident, surplus in conn.execute(
+                    f"SELECT l.ident, COUNT(*) - COALESCE(MAX(i.n), 0) FROM {ledger_table} l "
+                    f"LEFT JOIN _incoming i ON i.ident = l.ident GROUP BY l.ident "
+                    f"HAVING COUNT(*) > COALESCE(MAX(i.n), 0)"
+                ).fetchall():
+                    deletes.extend(row_id for (row_id,) in conn.execute(
+                        f"SELECT row_id FROM {ledger_table} WHERE ident = ? ORDER BY row_id DESC LIMIT ?",
+                        (ident, surplus)
+                    ))
+            elif delete_missing:
+                deletes = [row_id for (row_id,) in conn.execute(
+                    f"SELECT l.row_id FROM {ledger_table} l LEFT JOIN _incoming i ON i.ident = l.ident "
+                    f"WHERE i.ident IS NULL"
+                )]
+
+            # Pass 2: read the values of just the rows that change
+            inserts: List[Tuple] = []
+            changed: List[Tuple] = []
+            if wanted or updates:
+                _, rows = read_csv_rows(csv_file)
+                latest: Dict[str, Tuple] = {}
+                key_position = order[columns.index(key_column)] if key_column is not None else None
+                for row in filter(None, rows):
+                    if key_position is not None:
+                        # Only the changed keys' rows are worth hashing
+                        if row[key_position] in wanted or row[key_position] in updates:
+                            values = tuple(row[position] for position in order)
+                            latest[row[key_position]] = (values, ledger.identify(values)[1])
+                        continue
+                    values = tuple(row[position] for position in order)
+                    ident, digest = ledger.identify(values)
+                    if wanted.get(ident, 0) > 0:
+                        wanted[ident] -= 1
+                        inserts.append((ident, digest, values))
+                for ident, (values, digest) in latest.items():
+                    if ident in wanted:
+                        inserts.append((ident, digest, values))
+                    else:
+                        changed.extend((row_id, digest, values) for row_id in updates[ident])
+
+            # Apply the delta in batches; new rows get consecutive rowids so the ledger can point at them
+            next_rowid = (conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0) + 1
+            placeholders = ", ".join("?" for _ in range(len(columns) + 1))
+            column_list = ", ".join(_quote(column) for column in columns)
+            assignments = ", ".join(f"{_quote(column)} = ?" for column in columns)
+            for start in range(0, max(len(inserts), len(changed), len(deletes)), REFRESH_BATCH_ROWS):
+                chunk = inserts[start:start + REFRESH_BATCH_ROWS]
+                row_ids = range(next_rowid + start, next_rowid + start + len(chunk))
+                conn.executemany(
+                    f"INSERT INTO {table} (rowid, {column_list}) VALUES ({placeholders})",
+                    [(row_id, *values) for row_id, (_, _, values) in zip(row_ids, chunk)]
+                )
+                conn.executemany(
+                    f"INSERT INTO {ledger_table} VALUES (?, ?, ?)",
+                    [(row_id, ident, digest) for row_id, (ident, digest, _) in zip(row_ids, chunk)]
+                )
+                chunk = changed[start:start + REFRESH_BATCH_ROWS]
+                conn.executemany(f"UPDATE {table} SET {assignments} WHERE rowid = ?",
+                                 [(*values, row_id) for row_id, _, values in chunk])
+                conn.executemany(f"UPDATE {ledger_table} SET digest = ? WHERE row_id = ?",
+                                 [(digest, row_id) for row_id, digest, _ in chunk])
+                chunk = deletes[start:start + REFRESH_BATCH_ROWS]
+                conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", [(row_id,) for row_id in chunk])
+                conn.executemany(f"DELETE FROM {ledger_table} WHERE row_id = ?", [(row_id,) for row_id in chunk])
+            ledger.save_state()
+            conn.execute("DELETE FROM _incoming")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        raise UploadError(f"Error refreshing {table_name} from CSV: {e}") from e
+    finally:
+        conn.close()
+
+    return {
+        "table": table_name,
+        "csv_rows": csv_rows,
+        "inserted": len(inserts),
+        "updated": len(changed),
+        "deleted": len(deletes),
+        "unchanged": rows_before - len(changed) - len(deletes),
+        "timings_ms": {
+            "ledger": round(ledger_ms, 2),
+            "total": round((time.perf_counter() - started) * 1000, 2)
+        },
+    }
+
+
+def invalidate_derived(db_path: str, db_name: str, tables: List[str]) -> Dict:
+    """
+    Rebuild what was derived from tables whose rows changed, and nothing else.
+
+    In-place updates and deletes leave MAX(rowid) alone, so the caches that
+    detect staleness by it would not notice them: the changed tables' samples
+    are rebuilt, their columns are rescanned into the value index and an
+    existing columnar mirror is rebuilt. Their summary tables, already retired
+    by their triggers, are rebuilt too. The schema is unchanged.
+
+    Returns:
+        What was rebuilt, per cache
+    """
+    db_manager = DatabaseManager(db_path)
+    rebuilt = {
+        "summary_tables": AggregateCache(db_manager).refresh(MemoryManager.get_memory_file_for_db(db_name), tables),
+        "samples": SampleCache(db_manager).refresh(tables),
+        "value_index": sorted(ValueIndex.build_and_save(db_path, db_name, tables=tables).columns),
+    }
+    mirror = ColumnarMirror(db_path, db_name)
+    if os.path.exists(mirror.path):
+        rebuilt["columnar"] = mirror.build()
+    return rebuilt
@@ -1,26 +1,30 @@
 import os
 import streamlit as st
-from typing import List, Dict, Optional
-from create_db import create_db_from_csv
+from typing import Callable, List, Dict, Optional
+from create_db import create_db_from_csv, refresh_db_from_csv
+from query_errors import UploadError
+from upload_pipeline import UploadJob, UploadManager
 
 class CustomDatabase:
     """Lets user upload and manage a custom SQLite database."""
     
-    def __init__(self, upload_dir: str = "inputs"):
+    def __init__(self, upload_dir: str = "inputs", db_dir: str = "db", on_registered: Optional[Callable[[str], None]] = None):
         self.upload_dir = upload_dir
-        self.db_path = "./db"
         os.makedirs(self.upload_dir, exist_ok=True)
         self.db_path: Optional[str] = None
+        # Uploaded databases are checked, analyzed and indexed in the background before they appear in db_dir
+        self.uploads = UploadManager(db_dir, on_registered=on_registered)
     
-    def upload_database(self, uploaded_file) -> Optional[str]:
-        """Handle database file upload and save it to the upload directory."""
+    def upload_database(self, uploaded_file, overwrite: bool = False) -> Optional[UploadJob]:
+        """Stage an uploaded database file and prepare it in the background, replacing one of the same name only if overwrite."""
         if uploaded_file is not None:
-            file_path = os.path.join(self.upload_dir, uploaded_file.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            self.db_path = file_path
-            st.success(f"Database uploaded to: {file_path}")
-            return file_path
+            try:
+                job = self.uploads.submit(uploaded_file.name, uploaded_file.getbuffer(), overwrite)
+            except UploadError as e:
+                st.error(e.message)
+                return None
+            st.info(f"Checking and indexing {job.db_name}...")
+            return job
         else:
             st.error("No file uploaded.")
             return None
@@ -41,4 +45,30 @@ class CustomDatabase:
             return db_path
         else:
             st.error("No CSV file uploaded.")
-            return None
\ No newline at end of file
+            return None
+
+    def refresh_database(
+        self,
+        uploaded_csv,
+        db_name: str,
+        table_name: str,
+        key_column: Optional[str] = None,
+        delete_missing: bool = False
+    ) -> Optional[Dict]:
+        """Apply an updated CSV to a database created from an earlier version of it."""
+        if uploaded_csv is None:
+            st.error("No CSV file uploaded.")
+            return None
+        csv_path = os.path.join(self.upload_dir, uploaded_csv.name)
+        with open(csv_path, "wb") as f:
+            f.write(uploaded_csv.getbuffer())
+        try:
+            report = refresh_db_from_csv(csv_path, db_name, table_name, key_column or None, delete_missing)
+        except UploadError as e:
+            st.error(e.message)
+            return None
+        st.success(
+            f"Refreshed {table_name}: {report['inserted']} inserted, {report['updated']} updated, "
+            f"{report['deleted']} deleted, {report['unchanged']} unchanged"
+        )
+        return report
\ No newline at end of file
@@ -1,24 +1,118 @@
 import os
+import re
 import sqlite3
-import streamlit as st
+import threading
 from typing import List, Dict, Optional
+from query_errors import DatabaseNotFoundError, ExecutionError, QueryPipelineError, SchemaError
+
+
+# Federations are named by joining their member database names with this separator
+FEDERATION_SEPARATOR = "+"
+# Main database of a federated connection; members are ATTACHed to it
+FEDERATED_DB_PATH = ":memory:"
+# Tables maintained by the application itself (summary tables, samples); hidden from the schema
+INTERNAL_TABLE_PREFIX = "_nlsql_"
+
+
+def federation_name(db_names: List[str]) -> str:
+    """Name a set of databases queried together (e.g., 'air_pollution.db+soil_pollution.db')."""
+    return FEDERATION_SEPARATOR.join(sorted(set(db_names)))
+
+
+def federation_members(db_name: str) -> List[str]:
+    """Split a federation name into its member databases ([db_name] for a single database)."""
+    return db_name.split(FEDERATION_SEPARATOR)
+
+
+def is_federation(db_name: str) -> bool:
+    """Whether a database name refers to several ATTACHed databases."""
+    return FEDERATION_SEPARATOR in db_name
+
+
+def database_alias(db_name: str) -> str:
+    """Schema alias a database is ATTACHed under (e.g., 'soil_pollution.db' -> 'soil_pollution')."""
+    base_name = db_name.replace('.db', '').replace('.sqlite', '').replace('.sqlite3', '')
+    return re.sub(r"\W", "_", base_name)
+
+
+def is_internal_table(table_name: str) -> bool:
+    """Whether a table is maintained by the application rather than holding user data."""
+    return table_name.startswith(INTERNAL_TABLE_PREFIX)
+
+
+def data_fingerprint(db_path: str) -> Dict[str, List]:
+    """
+    Cheap fingerprint of a database's user tables: each table's definition and highest rowid.
+    
+    Unlike the file's mtime, it ignores writes to internal tables, so building
+    summary tables does not invalidate caches derived from the data.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        fingerprint = {}
+        for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type='table'").fetchall():
+            if is_internal_table(name) or name.startswith("sqlite_"):
+                continue
+            try:
+                max_rowid = conn.execute(f'SELECT MAX(rowid) FROM "{name}"').fetchone()[0]
+            except sqlite3.Error:
+                # WITHOUT ROWID tables
+                max_rowid = None
+            fingerprint[name] = [sql, max_rowid]
+        return fingerprint
+    finally:
+        conn.close()
+
+
+def connect_database(db_path: str, attached: Optional[Dict[str, str]] = None, read_only: bool = False) -> sqlite3.Connection:
+    """
+    Open a SQLite connection, ATTACHing any federated databases read-only.
+    
+    Args:
+        db_path: Main database file (FEDERATED_DB_PATH for a federation)
+        attached: Mapping of schema alias -> database file to ATTACH
+        read_only: Open the main database read-only
+    
+    The main database must already exist; it is never created as an empty file.
+    """
+    if db_path == FEDERATED_DB_PATH:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(f"file:{db_path}?mode={'ro' if read_only else 'rw'}", uri=True, check_same_thread=False)
+    for alias, path in (attached or {}).items():
+        conn.execute(f'ATTACH DATABASE ? AS "{alias}"', (f"file:{path}?mode=ro",))
+    return conn
 
 
 class DatabaseManager:
     """Manages SQLite database operations."""
     
-    def __init__(self, db_path: str = "db/soil_pollution.db"):
+    def __init__(self, db_path: str = "db/soil_pollution.db", attached: Optional[Dict[str, str]] = None):
         self.db_path = db_path
         self.db_dir = "db"
-        self._ensure_db_exists()
+        # Schema alias -> database file for federated (cross-database) queries
+        self.attached: Dict[str, str] = dict(attached or {})
+        self._local = threading.local()
+        if self.attached:
+            self.db_path = FEDERATED_DB_PATH
     
-    def _ensure_db_exists(self) -> None:
-        """Ensure database directory exists."""
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        
-        # Create sample table if database doesn't exist
-        if not os.path.exists(self.db_path):
-            self._create_sample_database()
+    @classmethod
+    def for_database(cls, db_name: str, db_dir: str = "db") -> "DatabaseManager":
+        """Build a manager for a database or federation name inside db_dir."""
+        if is_federation(db_name):
+            attached = {
+                database_alias(member): os.path.join(db_dir, member)
+                for member in federation_members(db_name)
+            }
+            return cls(attached=attached)
+        return cls(os.path.join(db_dir, db_name))
+    
+    @property
+    def current_database(self) -> str:
+        """Name of the current database, or its federation name."""
+        if self.attached:
+            return federation_name([os.path.basename(path) for path in self.attached.values()])
+        return os.path.basename(self.db_path)
     
     def get_available_databases(self) -> List[str]:
         """Get list of available database files in the db directory."""
@@ -32,61 +126,181 @@ class DatabaseManager:
         return sorted(db_files)
     
     def switch_database(self, db_name: str) -> bool:
-        """Switch to a different database."""
+        """Switch to a different database (or a federation of databases)."""
+        if is_federation(db_name):
+            return self.attach_databases(federation_members(db_name))
         new_path = os.path.join(self.db_dir, db_name)
         if os.path.exists(new_path):
             self.db_path = new_path
+            self.attached = {}
             return True
         return False
     
+    def attach_databases(self, db_names: List[str]) -> bool:
+        """
+        Federate several databases so one connection can join across them.
+        
+        Each database is ATTACHed read-only under its alias (see database_alias),
+        so tables are addressed as alias.table.
+        """
+        paths = {database_alias(name): os.path.join(self.db_dir, name) for name in db_names}
+        if not all(os.path.exists(path) for path in paths.values()):
+            return False
+        self.attached = paths
+        self.db_path = FEDERATED_DB_PATH
+        return True
+    
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Return this thread's connection to the current database.
+        
+        Connections are reused across queries made from the same thread and
+        reopened when the database is switched.
+        
+        Raises:
+            DatabaseNotFoundError: If the database file does not exist.
+        """
+        key = (self.db_path, tuple(sorted(self.attached.items())))
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.key == key:
+            return conn
+        if conn is not None:
+            conn.close()
+        if not self.attached and not os.path.exists(self.db_path):
+            raise DatabaseNotFoundError(f"Database not found: {os.path.basename(self.db_path)}")
+        conn = connect_database(self.db_path, self.attached)
+        conn.row_factory = sqlite3.Row
+        self._local.conn = conn
+        self._local.key = key
+        return conn
     
-    def execute_query(self, sql_query: str) -> Optional[List[Dict]]:
-        """Execute SQL query and return results as list of dictionaries."""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            rows = cursor.fetchall()
+    def close(self) -> None:
+        """Close this thread's cached connection, if any."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
             conn.close()
+            self._local.conn = None
+    
+    def execute_query(self, sql_query: str, max_rows: Optional[int] = None, params: tuple = ()) -> List[Dict]:
+        """
+        Execute SQL query and return results as list of dictionaries.
+        
+        Args:
+            sql_query: SQL to run
+            max_rows: Stop after this many rows (fetch everything if None)
+            params: Parameters bound to the query's placeholders
+        
+        Raises:
+            DatabaseNotFoundError: If the database file does not exist.
+            ExecutionError: If the query fails to run.
+        """
+        try:
+            cursor = self._connect().cursor()
+            try:
+                cursor.execute(sql_query, params)
+                rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows)
+            finally:
+                cursor.close()
             
             # Convert to list of dictionaries
             result = [dict(row) for row in rows]
             return result
+        except QueryPipelineError:
+            raise
         except sqlite3.Error as e:
-            st.error(f"Database error: {e}")
-            return None
+            raise ExecutionError(f"Database error: {e}", sql=sql_query) from e
         except Exception as e:
-            st.error(f"Unexpected error: {e}")
-            return None
+            raise ExecutionError(f"Unexpected error: {e}", sql=sql_query) from e
+    
+    @staticmethod
+    def _as_subquery(sql_query: str) -> str:
+        """
+        Wrap a SELECT so it can be paged or counted from an outer query.
+        
+        Trailing semicolons and comments are cut off, and the closing parenthesis
+        goes on its own line, so a trailing `-- comment` cannot swallow it.
+        """
+        # Imported here so opening the app does not load sqlglot
+        from sqlglot.dialects.sqlite import SQLite
+        from sqlglot.tokens import TokenType
+        
+        try:
+            tokens = SQLite().tokenize(sql_query)
+        except Exception:
+            tokens = []
+        while tokens and tokens[-1].token_type == TokenType.SEMICOLON:
+            tokens.pop()
+        body = sql_query[:tokens[-1].end + 1] if tokens else sql_query.strip().rstrip(';')
+        return f"({body}\n)"
+    
+    def fetch_page(self, sql_query: str, offset: int, limit: int) -> List[Dict]:
+        """Fetch rows [offset, offset + limit) of a query's result."""
+        paged_sql = f"SELECT * FROM {self._as_subquery(sql_query)} LIMIT ? OFFSET ?"
+        return self.execute_query(paged_sql, params=(limit, offset))
     
-    def get_schema(self) -> Optional[Dict]:
-        """Get database schema information to assist in SQL query generation."""
+    def count_rows(self, sql_query: str) -> int:
+        """Count the rows a query returns without fetching them."""
+        count_sql = f"SELECT COUNT(*) AS row_count FROM {self._as_subquery(sql_query)}"
+        return self.execute_query(count_sql)[0]["row_count"]
+    
+    def column_names(self, sql_query: str) -> List[str]:
+        """
+        Get the column names a query returns without running it.
+        
+        Raises:
+            ExecutionError: If the query cannot be prepared.
+        """
+        probe_sql = f"SELECT * FROM {self._as_subquery(sql_query)} LIMIT 0"
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self._connect().execute(probe_sql)
+            try:
+                return [description[0] for description in cursor.description]
+            finally:
+                cursor.close()
+        except sqlite3.Error as e:
+            raise ExecutionError(f"Database error: {e}", sql=sql_query) from e
+    
+    def get_schema(self) -> Dict:
+        """
+        Get database schema information to assist in SQL query generation.
+        
+        Raises:
+            DatabaseNotFoundError: If the database file does not exist.
+            SchemaError: If the schema cannot be read.
+        """
+        try:
+            cursor = self._connect().cursor()
             
-            # Get table names
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
+            # Federated catalogs namespace each table by its database alias
+            namespaces = list(self.attached) if self.attached else [None]
             
             schema = {}
-            for table in tables:
-                table_name = table[0]
-                cursor.execute(f"PRAGMA table_info({table_name});")
-                columns = cursor.fetchall()
+            for namespace in namespaces:
+                prefix = f'"{namespace}".' if namespace else ""
                 
-                schema[table_name] = [
-                    {
-                        "name": col[1],
-                        "datatype": col[2],
-                        "description": f"{col[1]} column"
-                    }
-                    for col in columns
-                ]
+                # Get table names
+                cursor.execute(f"SELECT name FROM {prefix}sqlite_master WHERE type='table';")
+                tables = cursor.fetchall()
+                
+                for table in tables:
+                    table_name = table[0]
+                    # SQLite's own tables (e.g., sqlite_stat1 from ANALYZE) hold no user data either
+                    if table_name.startswith("sqlite_") or is_internal_table(table_name):
+                        continue
+                    cursor.execute(f'PRAGMA {prefix}table_info("{table_name}");')
+                    columns = cursor.fetchall()
+                    
+                    qualified_name = f"{namespace}.{table_name}" if namespace else table_name
+                    schema[qualified_name] = [
+                        {
+                            "name": col[1],
+                            "datatype": col[2],
+                            "description": f"{col[1]} column"
+                        }
+                        for col in columns
+                    ]
             
-            conn.close()
+            cursor.close()
             return schema
         except sqlite3.Error as e:
-            st.error(f"Error retrieving schema: {e}")
-            return None
\ No newline at end of file
+            raise SchemaError(f"Error retrieving schema: {e}") from e
\ No newline at end of file
@@ -1,15 +1,6 @@
-import google.generativeai as genai
-import os
-import streamlit as st
-from dotenv import load_dotenv
 from typing import Optional
-
-
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-
-if api_key:
-    genai.configure(api_key=api_key)
+from gemini_class import GeminiAssistant, load_genai
+from query_errors import ConfigurationError, GenerationError
 
 
 class QueryExplainer:
@@ -27,12 +18,18 @@ class QueryExplainer:
             
         Returns:
             A human-readable explanation of the query
+            
+        Raises:
+            GenerationError: If Gemini fails to explain the query
         """
         if not sql_query:
             return "No query to explain."
         
+        if not GeminiAssistant.is_configured():
+            raise ConfigurationError("Please configure your GEMINI_API_KEY in the .env file")
+        
         try:
-            model = genai.GenerativeModel(self.model_name)
+            model = load_genai().GenerativeModel(self.model_name)
             
             prompt = f"""You are a helpful assistant that explains SQL queries in plain English.
 Explain the following SQL query in simple, easy-to-understand terms.
@@ -49,5 +46,4 @@ Explanation:"""
             response = model.generate_content(prompt)
             return response.text.strip()
         except Exception as e:
-            st.error(f"Error explaining query: {e}")
-            return "Unable to generate explanation."
\ No newline at end of file
+            raise GenerationError(f"Error explaining query: {e}") from e
\ No newline at end of file
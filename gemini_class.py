@@ -1,23 +1,54 @@
+import datetime
+import hashlib
 import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
-import google.generativeai as genai
-import streamlit as st
-from typing import List, Dict, Optional
-from prompt_manager import PromptManager
+from typing import List, Dict, Optional, Tuple
+from prompt_manager import PROMPT_TOKEN_BUDGET, PromptManager, SplitPrompt, trim_steps
+from query_errors import ConfigurationError, GenerationError, SummaryError
 
 
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
 
-if api_key:
-    genai.configure(api_key=api_key)
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def load_genai():
+    """
+    Import and configure the Gemini SDK on first use.
+    
+    google.generativeai (and the gRPC stack behind it) takes a few hundred
+    milliseconds to import, so it is deferred until the first model call
+    instead of slowing down every process that merely imports this module.
+    """
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            if api_key:
+                genai.configure(api_key=api_key)
+            _genai = genai
+        return _genai
+
+# Cache stable prompt prefixes provider-side (set GEMINI_CONTEXT_CACHE=0 to disable)
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# Gemini rejects explicit caches below this size, so smaller prefixes are sent inline
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+# (model, prefix hash) -> (CachedContent or None if caching failed, local expiry time)
+_context_caches: Dict[Tuple[str, str], Tuple[Optional[object], float]] = {}
+# Guards the two dicts; creating a cache (a network call) only holds that prefix's own lock
+_context_cache_lock = threading.Lock()
+_context_cache_key_locks: Dict[Tuple[str, str], threading.Lock] = {}
 
 class GeminiAssistant:
     """Handles Gemini AI interactions such as SQL generation and result summarization."""
-    if not api_key:
-            st.error("⚠️ Please configure your GOOGLE_API_KEY in the .env file")
-            
+    
     def __init__(self, model_name: str = "gemini-2.5-flash"):
         self.model_name = model_name
         self.prompt_manager = PromptManager()
@@ -29,75 +60,185 @@ class GeminiAssistant:
             self.prompt_manager.load_prompts_for_db(db_name)
             self.current_db = db_name
     
-    def build_sql_prompt(self, schema: Dict, user_question: str, context: str = "") -> str:
+    @staticmethod
+    def describe_schema(schema: Dict, compact: bool = False) -> str:
+        """
+        Render a schema as the column descriptions section of the SQL prompt.
+        
+        Args:
+            schema: Tables to describe
+            compact: Omit column descriptions, keeping only names and types
+        """
+        column_descriptions = ""
+        if any("." in table_name for table_name in schema):
+            column_descriptions += "Tables come from several attached databases; always reference them as database.table.\n"
+        for table_name, columns in schema.items():
+            column_descriptions += f"\nTable: {table_name}\nColumns:\n"
+            for col in columns:
+                if compact:
+                    column_descriptions += f"- {col['name']} ({col['datatype']})\n"
+                else:
+                    column_descriptions += f"- {col['name']} ({col['datatype']}): {col['description']}\n"
+        return column_descriptions
+    
+    def build_sql_prompt(self, schema: Dict, user_question: str, context: str = "", token_budget: Optional[int] = None) -> SplitPrompt:
         """
             Build prompt for SQL generation.
             Args:
                 schema (Dict): Database schema information.
                 user_question (str): User's natural language question.
                 context (str): Recent interaction context.
+                token_budget (int): Estimated token limit (PROMPT_TOKEN_BUDGET if None, 0 for none).
             Returns:
-                str: Formatted prompt for Gemini AI.
+                SplitPrompt: Formatted prompt for Gemini AI, split into a stable
+                prefix (instructions and schema) and a suffix (context and question).
         """
+        budget = PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
         
-        # Build column descriptions
-        column_descriptions = ""
-        for table_name, columns in schema.items():
-            column_descriptions += f"\nTable: {table_name}\nColumns:\n"
-            for col in columns:
-                column_descriptions += f"- {col['name']} ({col['datatype']}): {col['description']}\n"
+        # Trim context, then schema, in a fixed order until the estimate fits
+        prompt = None
+        for tables, compact, trimmed_context in trim_steps(schema, user_question, context):
+            view = schema if len(tables) == len(schema) else {name: schema[name] for name in tables}
+            
+            # Template with the schema already rendered in (cached per database and schema)
+            sql_template = self.prompt_manager.get_schema_bound_sql_template(
+                schema,
+                lambda: self.describe_schema(view, compact),
+                variant=f"{int(compact)}:{','.join(tables) if view is not schema else ''}"
+            )
+            
+            # Only the per-request parts are filled in here
+            prompt = sql_template.render_split(
+                context=trimmed_context,
+                user_question=user_question
+            )
+            if not budget or prompt.tokens <= budget:
+                break
         
-        # Get the SQL prompt template from prompt manager
-        sql_template = self.prompt_manager.get_sql_prompt()
+        return prompt
+    
+    @staticmethod
+    def is_configured() -> bool:
+        """Whether a Gemini API key is available."""
+        return bool(api_key)
+    
+    @staticmethod
+    def _require_api_key() -> None:
+        """Raise a ConfigurationError if no API key is configured."""
+        if not api_key:
+            raise ConfigurationError("Please configure your GEMINI_API_KEY in the .env file")
+    
+    def _cached_prefix_model(self, prompt: str):
+        """
+        Model bound to a provider-side cache of the prompt's stable prefix, if one can be used.
         
-        # Format the prompt with the actual values
-        prompt = sql_template.format(
-            column_descriptions=column_descriptions,
-            context=context,
-            user_question=user_question
-        )
+        Caches are created once per prefix and recreated shortly before they
+        expire. If the model or account does not support explicit caching,
+        the prefix is remembered as uncacheable and sent inline until the TTL passes.
+        """
+        if not CONTEXT_CACHE_ENABLED or not isinstance(prompt, SplitPrompt):
+            return None
+        if prompt.prefix_tokens < MIN_CACHED_PREFIX_TOKENS:
+            return None
         
-        return prompt.strip()
+        key = (self.model_name, hashlib.sha1(prompt.prefix.encode()).hexdigest())
+        with _context_cache_lock:
+            cached, expires_at = _context_caches.get(key, (None, 0.0))
+            key_lock = _context_cache_key_locks.setdefault(key, threading.Lock())
+        if expires_at <= time.time():
+            # Only callers of the same prefix wait for its cache; other prefixes and databases do not
+            with key_lock:
+                with _context_cache_lock:
+                    cached, expires_at = _context_caches.get(key, (None, 0.0))
+                if expires_at <= time.time():
+                    cached = self._create_context_cache(prompt.prefix)
+                    self._store_context_cache(key, cached)
+        
+        if cached is None:
+            return None
+        return load_genai().GenerativeModel.from_cached_content(cached_content=cached)
     
-    def generate_sql(self, prompt: str) -> Optional[str]:
+    def _create_context_cache(self, prefix: str) -> Optional[object]:
+        """Create a provider-side cache of a prompt prefix, or None if caching is unavailable."""
+        try:
+            load_genai()
+            from google.generativeai import caching
+            return caching.CachedContent.create(
+                model=f"models/{self.model_name}",
+                contents=[prefix],
+                ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL)
+            )
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _store_context_cache(key: Tuple[str, str], cached: Optional[object]) -> None:
+        """Remember a cache (or that caching failed) and forget entries that have expired."""
+        now = time.time()
+        with _context_cache_lock:
+            for expired in [other for other, (_, expires_at) in _context_caches.items() if expires_at <= now]:
+                del _context_caches[expired]
+                lock = _context_cache_key_locks.get(expired)
+                if expired != key and lock is not None and not lock.locked():
+                    del _context_cache_key_locks[expired]
+            # Renew a minute early so a cache never expires mid-request
+            _context_caches[key] = (cached, now + max(CONTEXT_CACHE_TTL - 60, 60))
+    
+    def generate_sql(self, prompt: str, temperature: Optional[float] = None) -> str:
         """
         Generate SQL query from prompt.
         Args:
-            prompt (str): Prompt for SQL generation.
+            prompt (str): Prompt for SQL generation; a SplitPrompt's prefix may be served from the context cache.
+            temperature (float): Sampling temperature (the model's default if None).
         Returns:
-            Optional[str]: Generated SQL query or None if error occurs.
+            str: Generated SQL query.
+        Raises:
+            GenerationError: If Gemini fails or returns an empty query.
         """
+        self._require_api_key()
+        generation_config = None if temperature is None else {"temperature": temperature}
         try:
-            model = genai.GenerativeModel(self.model_name)
-            response = model.generate_content(prompt)
+            cached_model = self._cached_prefix_model(prompt)
+            if cached_model is not None:
+                # The instructions and schema are already cached provider-side
+                response = cached_model.generate_content(prompt.suffix, generation_config=generation_config)
+            else:
+                model = load_genai().GenerativeModel(self.model_name)
+                response = model.generate_content(str(prompt), generation_config=generation_config)
             sql = response.text.strip()
             
             # Clean up markdown formatting
             if sql.startswith("```"):
                 sql = sql.strip("```").replace("sql", "").strip()
-            
-            return sql
         except Exception as e:
-            st.error(f"Error generating SQL: {e}")
-            return None
+            raise GenerationError(f"Error generating SQL: {e}") from e
+        
+        if not sql:
+            raise GenerationError("Failed to generate SQL query")
+        return sql
     
     def generate_summary(self, user_question: str, result: List[Dict], context: str = "") -> str:
-        """Generate natural language summary of results."""
+        """
+        Generate natural language summary of results.
+        Raises:
+            SummaryError: If Gemini fails to summarize the result.
+        """
         if not result:
             return "No data available for this question."
         
+        self._require_api_key()
         try:
-            model = genai.GenerativeModel(self.model_name)
+            model = load_genai().GenerativeModel(self.model_name)
             
             # Limit result preview
             preview_rows = result[:10]
             data_preview = "\n".join([json.dumps(row) for row in preview_rows])
             
-            # Get the summary prompt template from prompt manager
-            summary_template = self.prompt_manager.get_summary_prompt()
+            # Get the compiled summary prompt template from prompt manager
+            summary_template = self.prompt_manager.get_summary_template()
             
-            # Format the prompt with the actual values
-            prompt = summary_template.format(
+            # Fill in the actual values
+            prompt = summary_template.render(
                 user_question=user_question,
                 context=context,
                 data_preview=data_preview
@@ -106,5 +247,4 @@ class GeminiAssistant:
             response = model.generate_content(prompt)
             return response.text.strip()
         except Exception as e:
-            st.error(f"Error generating summary: {e}")
-            return "Unable to generate summary."
+            raise SummaryError(f"Error generating summary: {e}") from e
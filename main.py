@@ -1,12 +1,13 @@
-import pandas as pd
+import os
 import streamlit as st
-from custom_db import CustomDatabase
-from databse_manager import DatabaseManager
+from databse_manager import federation_members, federation_name
 from datetime import datetime
-from explain_query import QueryExplainer
+from typing import Dict
 from gemini_class import GeminiAssistant
-from memory_management import MemoryManager
-from sql_validation import SQLValidator
+from query_errors import QueryPipelineError, ValidationError
+from query_jobs import QueryJob, QueryJobManager
+from result_export import EXPORT_FORMATS, export_path_for, export_query
+from result_view import DEFAULT_PAGE_SIZE, ResultView
 
 st.set_page_config(
     page_title="NL-SQL Query System",
@@ -15,23 +16,78 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+JOB_STAGE_LABELS = {
+    None: "⏳ Waiting for a free worker...",
+    "generation": "🤔 Generating SQL query...",
+    "validation": "🛡️ Validating SQL query...",
+    "execution": "⚡ Executing query...",
+    "summary": "💬 Summarizing results...",
+}
+
+UPLOAD_STAGE_LABELS = {
+    None: "⏳ Waiting to prepare upload...",
+    "integrity": "🩺 Checking database integrity...",
+    "aggregates": "🧮 Rebuilding summary tables...",
+    "optimize": "📈 Analyzing tables...",
+    "samples": "🎲 Sampling large tables...",
+    "value_index": "🔎 Indexing column values...",
+    "columnar": "🦆 Building the columnar mirror...",
+    "register": "📂 Registering database...",
+    "warm": "🔥 Loading schema...",
+}
+
+
+EXPORT_DIR = "exports"
+
+
+@st.cache_resource
+def get_job_manager() -> QueryJobManager:
+    """Process-wide job manager shared by every browser session."""
+    return QueryJobManager()
+
+
+def get_components(db_name: str):
+    """
+    Schema, memory and database manager of a database, shared by every session
+    and by the query workers (None if the database does not exist).
+    """
+    try:
+        return get_job_manager().service.components(db_name)
+    except QueryPipelineError:
+        return None
+
+
+# Components below hold no per-session state, so they are built once per process
+# (on first use) and shared by every browser session instead of rebuilt per session.
+@st.cache_resource
+def get_query_explainer():
+    """Query explainer, imported and built the first time a query is explained."""
+    from explain_query import QueryExplainer
+    return QueryExplainer()
+
+
+@st.cache_resource
+def get_custom_db():
+    """Upload/creation handler, imported and built the first time a database is added."""
+    from custom_db import CustomDatabase
+    service = get_job_manager().service
+
+    def warm(db_name: str) -> None:
+        # Replaced files must not be served from stale components; then pre-build the new ones
+        service.invalidate()
+        service.components(db_name)
+
+    return CustomDatabase(db_dir=service.db_dir, on_registered=warm)
+
 
 def initialize_session_state():
     """Initialize Streamlit session state variables."""
-    if 'memory_manager' not in st.session_state:
-        st.session_state.memory_manager = MemoryManager()
-    if 'db_manager' not in st.session_state:
-        st.session_state.db_manager = DatabaseManager()
-    if 'assistant' not in st.session_state:
-        st.session_state.assistant = GeminiAssistant()
     if 'query_history' not in st.session_state:
         st.session_state.query_history = []
-    if 'custom_db' not in st.session_state:
-        st.session_state.custom_db = CustomDatabase()
     if 'selected_db' not in st.session_state:
         st.session_state.selected_db = 'soil_pollution.db'
-    if 'query_explainer' not in st.session_state:
-        st.session_state.query_explainer = QueryExplainer()
+    if 'federated_dbs' not in st.session_state:
+        st.session_state.federated_dbs = []
     if 'last_sql_query' not in st.session_state:
         st.session_state.last_sql_query = None
     if 'last_result' not in st.session_state:
@@ -42,6 +98,240 @@ def initialize_session_state():
         st.session_state.last_question = None
     if 'query_explanation' not in st.session_state:
         st.session_state.query_explanation = None
+    if 'active_job_id' not in st.session_state:
+        st.session_state.active_job_id = None
+    if 'result_view' not in st.session_state:
+        st.session_state.result_view = None
+    if 'result_page' not in st.session_state:
+        st.session_state.result_page = 0
+    if 'result_export' not in st.session_state:
+        st.session_state.result_export = None
+    if 'upload_job_id' not in st.session_state:
+        st.session_state.upload_job_id = None
+    if 'last_approximation' not in st.session_state:
+        st.session_state.last_approximation = None
+
+
+@st.fragment(run_every=1)
+def render_job_status(job_id: str):
+    """Poll a background job and trigger a full rerun once it finishes."""
+    job = get_job_manager().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.info(JOB_STAGE_LABELS.get(job.stage, "⏳ Working..."))
+
+
+@st.fragment(run_every=1)
+def render_upload_status(job_id: str):
+    """Poll a background upload and trigger a full rerun once it is registered (or fails)."""
+    job = get_custom_db().uploads.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.info(UPLOAD_STAGE_LABELS.get(job.stage, "⏳ Preparing upload..."))
+
+
+def show_upload_result(job_id: str):
+    """Report a finished upload once and forget it."""
+    job = get_custom_db().uploads.get(job_id)
+    if job is not None and not job.done:
+        return
+    st.session_state.upload_job_id = None
+    if job is None:
+        return
+    if job.error:
+        st.error(job.error.message)
+    else:
+        st.success(f"Database {job.db_name} is ready ({job.report.get('tables', 0)} tables, "
+                   f"{job.report.get('indexed_columns', 0)} indexed columns)")
+
+
+def get_active_database() -> str:
+    """Selected database, or its federation with any extra databases attached for cross-database queries."""
+    extra_dbs = [db for db in st.session_state.federated_dbs if db != st.session_state.selected_db]
+    if extra_dbs:
+        return federation_name([st.session_state.selected_db, *extra_dbs])
+    return st.session_state.selected_db
+
+
+def change_result_page(step: int):
+    """Move the result grid forward or backward by one page."""
+    st.session_state.result_page = max(0, st.session_state.result_page + step)
+
+
+def render_result_page(view: ResultView):
+    """Render the current page of a cached result view with pagination controls."""
+    page = st.session_state.result_page
+    df = view.get_page(page)
+    st.dataframe(df, use_container_width=True, width="stretch")
+    
+    first_row = page * view.page_size + 1
+    last_row = page * view.page_size + len(df)
+    has_next = view.has_next_page(page)
+    total = f"{view.total_rows:,}" if view.total_rows is not None else f"{last_row:,}+"
+    
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button("◀ Previous", key="result_prev", disabled=page == 0,
+                  on_click=change_result_page, args=(-1,), use_container_width=True)
+    with col_info:
+        st.caption(f"Rows {first_row:,}–{last_row:,} of {total}")
+    with col_next:
+        st.button("Next ▶", key="result_next", disabled=not has_next,
+                  on_click=change_result_page, args=(1,), use_container_width=True)
+
+
+def render_export_controls(view: ResultView):
+    """Offer a streamed export of the full result, generated only when requested."""
+    col_fmt, col_prepare, col_download = st.columns([1, 1, 2])
+    with col_fmt:
+        fmt = st.selectbox("Export format", list(EXPORT_FORMATS), key="export_format",
+                           label_visibility="collapsed")
+    with col_prepare:
+        prepare = st.button("📦 Prepare Export", key="prepare_export", use_container_width=True)
+    if not prepare:
+        return
+    
+    # Reuse a finished export of the same query and format
+    export = st.session_state.result_export
+    if not (export and export["sql"] == view.sql and export["db_name"] == view.db_name
+            and export["format"] == fmt and os.path.exists(export["path"])):
+        path = export_path_for(EXPORT_DIR, fmt, f"query_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        with st.spinner("📦 Exporting full result..."):
+            try:
+                rows = export_query(view.db_manager.db_path, view.sql, path, fmt,
+                                    attached=view.db_manager.attached)
+            except QueryPipelineError as e:
+                st.error(e.message)
+                return
+        export = {"sql": view.sql, "db_name": view.db_name, "format": fmt, "path": path, "rows": rows}
+        st.session_state.result_export = export
+    
+    mime, _ = EXPORT_FORMATS[fmt]
+    with col_download, open(export["path"], "rb") as f:
+        st.download_button(
+            label=f"📥 Download {export['rows']:,} rows as {fmt.upper()}",
+            data=f,
+            file_name=os.path.basename(export["path"]),
+            mime=mime,
+            on_click="ignore",
+            use_container_width=True
+        )
+
+
+def run_exact():
+    """Re-run the last (approximate) query exactly, reusing its validated SQL instead of asking Gemini again."""
+    view = st.session_state.result_view
+    job = get_job_manager().submit(
+        st.session_state.last_question,
+        view.db_name,
+        max_rows=DEFAULT_PAGE_SIZE,
+        sql=st.session_state.last_sql_query
+    )
+    st.session_state.active_job_id = job.job_id
+
+
+def render_approximation(approximation: Dict):
+    """Explain that the result is an estimate, show its confidence intervals and offer an exact re-run."""
+    st.info(
+        f"≈ Estimated from a {approximation['fraction']:.1%} random sample "
+        f"({approximation['sample_rows']:,} of {approximation['source_rows']:,} rows of "
+        f"{approximation['source_table']}). Groups too rare to be sampled may be missing."
+    )
+    with st.expander(f"± {approximation['confidence']:.0%} confidence intervals"):
+        st.dataframe([
+            {**row, **{f"{column} ±": width for column, width in intervals.items()}}
+            for row, intervals in zip(st.session_state.last_result or [], approximation["intervals"])
+        ], use_container_width=True)
+    st.button("🎯 Run exact", key="run_exact", on_click=run_exact)
+
+
+def render_workload_report(components):
+    """Admin view of a database's workload log: slow queries, per-table latency, full scans and hot columns."""
+    stats = components.workload.stats()
+    st.divider()
+    st.subheader("📈 Workload Report")
+    if not stats["queries"]:
+        st.info("No queries logged for this database yet.")
+        return
+    col_queries, col_slow, col_scans, col_p95 = st.columns(4)
+    col_queries.metric("Queries", stats["queries"])
+    col_slow.metric(f"Slow (≥ {stats['slow_ms']:g} ms)", stats["slow"])
+    col_scans.metric("Full-scan rate", f"{stats['full_scan_rate']:.0%}")
+    col_p95.metric("p95 execution", f"{stats['p95_ms']} ms")
+
+    st.markdown("**Tables**")
+    st.dataframe([{"table": table, **summary} for table, summary in stats["tables"].items()], use_container_width=True)
+    st.markdown("**Most used columns** (frequently fully scanned ones are index candidates)")
+    st.dataframe(stats["columns"], use_container_width=True)
+    st.markdown("**Costliest query patterns** (candidates for summary tables)")
+    st.dataframe(stats["patterns"], use_container_width=True)
+    st.markdown("**Slowest queries**")
+    for entry in stats["slowest"]:
+        with st.expander(f"{entry['execution_ms']} ms: {entry['question'][:60]}"):
+            st.code(entry["sql"], language="sql")
+            if entry.get("plan"):
+                st.code("\n".join(entry["plan"]), language="text")
+
+
+def apply_finished_job(job: QueryJob) -> bool:
+    """
+    Move a finished job's output into session state, memory and history.
+
+    Returns:
+        bool: False if the job failed and its error was displayed.
+    """
+    st.session_state.active_job_id = None
+
+    if job.status == QueryJob.FAILED:
+        if isinstance(job.error, ValidationError):
+            st.error(f"❌ {job.error.message}")
+            st.warning("Query execution blocked for security reasons.")
+            # Optionally show the problematic query for debugging
+            with st.expander("View Generated Query (Not Executed)"):
+                st.code(job.sql, language="sql")
+        else:
+            st.error(job.error.message)
+        return False
+    
+    for warning in job.warnings:
+        st.warning(warning["message"])
+    for rewrite in job.rewrites:
+        st.info(f"🔎 Matched '{rewrite['from']}' to '{rewrite['to']}' in {rewrite['column']}")
+    if job.optimizations:
+        rules = ", ".join(optimization["rule"].replace("_", " ") for optimization in job.optimizations)
+        st.caption(f"⚙️ Optimized before running: {rules}")
+    if job.outcome_engine == "duckdb":
+        st.caption("🦆 Answered by the columnar engine (DuckDB)")
+
+    # Store the last SQL query for explanation
+    st.session_state.last_sql_query = job.sql
+    st.session_state.last_question = job.question
+    st.session_state.query_explanation = None  # Clear previous explanation
+    st.session_state.last_result = job.result or None
+    st.session_state.last_summary = job.summary
+    st.session_state.last_approximation = job.approximation
+    st.session_state.result_page = 0
+    st.session_state.result_view = None
+    if job.result:
+        st.session_state.result_view = ResultView(
+            job.db_name, get_job_manager().service.db_dir, job.execution_sql or job.sql, job.result, job.truncated
+        )
+
+    # Save to memory
+    try:
+        get_job_manager().service.components(job.db_name).memory_manager.add(
+            job.question, job.sql, job.result, job.summary, timings=job.timings, truncated=job.truncated,
+            approximate=job.approximation is not None
+        )
+        get_job_manager().service.sync_aggregates(job.db_name, job.sql)
+    except QueryPipelineError as e:
+        st.error(e.message)
+    st.session_state.query_history.append({
+        "question": job.question,
+        "timestamp": datetime.now(),
+        "summary": job.summary
+    })
+    return True
 
 
 def main():
@@ -78,20 +368,19 @@ def main():
     # Initialize
     initialize_session_state()
     
-    # Ensure db_manager is using the selected database
-    if st.session_state.db_manager.db_path != f"db/{st.session_state.selected_db}":
-        st.session_state.db_manager.switch_database(st.session_state.selected_db)
+    if not GeminiAssistant.is_configured():
+        st.error("⚠️ Please configure your GEMINI_API_KEY in the .env file")
     
-    # Ensure memory_manager is using the correct memory file for selected database
-    expected_memory_file = MemoryManager.get_memory_file_for_db(st.session_state.selected_db)
-    if st.session_state.memory_manager.memory_file != expected_memory_file:
-        st.session_state.memory_manager.switch_memory_file(st.session_state.selected_db)
+    active_db = get_active_database()
     
-    # Ensure assistant is using the correct prompts for selected database
-    st.session_state.assistant.set_database(st.session_state.selected_db)
+    # Components of the selected database (or federation), shared across sessions
+    components = get_components(active_db)
+    memory_manager = components.memory_manager if components else None
     
     # Generate dynamic title from selected database
-    db_display_name = st.session_state.selected_db.replace('.db', '').replace('_', ' ').title()
+    db_display_name = " + ".join(
+        member.replace('.db', '').replace('_', ' ').title() for member in federation_members(active_db)
+    )
     
     # Header
     st.markdown('<h1 class="main-header">🔍 NL-SQL Query System</h1>', unsafe_allow_html=True)
@@ -104,19 +393,22 @@ def main():
         
         # Memory management
         st.subheader("💾 Memory Management")
-        memory_count = len(st.session_state.memory_manager.memory)
+        memory_count = len(memory_manager.memory) if memory_manager else 0
         st.info(f"Stored interactions: {memory_count}")
         
-        if st.button("🗑️ Clear Memory", type="secondary"):
-            st.session_state.memory_manager.clear()
-            st.success("Memory cleared!")
-            st.rerun()
+        if st.button("🗑️ Clear Memory", type="secondary", disabled=memory_manager is None):
+            try:
+                memory_manager.clear()
+                st.success("Memory cleared!")
+                st.rerun()
+            except QueryPipelineError as e:
+                st.error(e.message)
         
         st.divider()
         
         # Database Info
         st.subheader("🗄️ Database Info")
-        schema = st.session_state.db_manager.get_schema()
+        schema = components.schema if components else None
         if schema:
             for table_name, columns in schema.items():
                 with st.expander(f"Table: {table_name}"):
@@ -125,6 +417,31 @@ def main():
         
         st.divider()
         
+        # Workload log (read only when the report is shown, since it can grow large)
+        st.subheader("📈 Workload")
+        st.toggle(
+            "Show workload report",
+            key="show_workload",
+            disabled=components is None,
+            help="Execution times, plans, full scans and most used columns of the queries run on this database"
+        )
+        
+        st.divider()
+        
+        # Cross-database (federated) queries
+        st.subheader("🔗 Cross-Database Queries")
+        other_dbs = [db for db in get_job_manager().service.list_databases()
+                     if db != st.session_state.selected_db]
+        st.session_state.federated_dbs = [db for db in st.session_state.federated_dbs if db in other_dbs]
+        st.multiselect(
+            "Also attach:",
+            other_dbs,
+            key="federated_dbs",
+            help="Attached databases can be joined with the selected one; tables are named database.table"
+        )
+        
+        st.divider()
+        
         # Database Management in sidebar
         st.subheader("📂 Database Management")
         
@@ -141,8 +458,13 @@ def main():
                 key="db_uploader"
             )
             if uploaded_file:
+                overwrite = False
+                if os.path.basename(uploaded_file.name) in get_job_manager().service.list_databases():
+                    overwrite = st.checkbox(f"Replace the existing {os.path.basename(uploaded_file.name)}", value=False)
                 if st.button("⬆️ Upload Database", type="primary", use_container_width=True):
-                    st.session_state.custom_db.upload_database(uploaded_file)
+                    upload_job = get_custom_db().upload_database(uploaded_file, overwrite)
+                    if upload_job:
+                        st.session_state.upload_job_id = upload_job.job_id
         
         elif db_action == "Create Database from CSV":
             csv_file = st.file_uploader(
@@ -154,11 +476,46 @@ def main():
             db_name = st.text_input("Database Name:", placeholder="e.g., soil_pollution")
             table_name = st.text_input("Table Name:", placeholder="e.g., pollution_data")
             
-            if csv_file and db_name and table_name:
-                if st.button("🆕 Create Database", type="primary", use_container_width=True):
-                    st.session_state.custom_db.create_database(csv_file, db_name, table_name)
+            # Re-importing an existing table applies only the rows that changed; a new table is added as before
+            existing_db = f"{db_name}.db" if f"{db_name}.db" in get_job_manager().service.list_databases() else None
+            if existing_db and table_name:
+                try:
+                    existing_table = table_name in get_job_manager().service.components(existing_db).schema
+                except QueryPipelineError:
+                    existing_table = False
+            else:
+                existing_table = False
+            if existing_table:
+                key_column = st.text_input(
+                    "Key Column (optional):", placeholder="e.g., Case_ID",
+                    help="Column identifying a row; without one, rows are matched by their content"
+                )
+                delete_missing = st.checkbox("Delete rows missing from the CSV", value=False)
+            
+            if csv_file and db_name and table_name and existing_table:
+                if st.button("🔄 Refresh Database", type="primary", use_container_width=True):
+                    report = get_custom_db().refresh_database(csv_file, db_name, table_name, key_column, delete_missing)
+                    if report and report.get("rebuilt"):
+                        # The schema is unchanged, but this database's cached catalogs and results are not
+                        get_job_manager().service.invalidate(existing_db)
+                        view = st.session_state.result_view
+                        if view is not None and view.db_name == existing_db:
+                            st.session_state.result_view = None
+            elif csv_file and db_name and table_name:
+                create_label = f"➕ Add Table to {existing_db}" if existing_db else "🆕 Create Database"
+                if st.button(create_label, type="primary", use_container_width=True):
+                    if get_custom_db().create_database(csv_file, db_name, table_name):
+                        get_job_manager().service.invalidate()
             elif csv_file or db_name or table_name:
                 st.info("Please fill in all fields to create a database.")
+        
+        # Uploads are prepared in the background; the database list refreshes when one is registered
+        if st.session_state.upload_job_id:
+            upload_job = get_custom_db().uploads.get(st.session_state.upload_job_id)
+            if upload_job is not None and not upload_job.done:
+                render_upload_status(upload_job.job_id)
+            else:
+                show_upload_result(st.session_state.upload_job_id)
     
     # Main content area
     col1, col2 = st.columns([3, 1])
@@ -168,7 +525,7 @@ def main():
         db_col1, db_col2 = st.columns([3, 1])
         with db_col1:
             # Database selector
-            available_dbs = st.session_state.db_manager.get_available_databases()
+            available_dbs = get_job_manager().service.list_databases()
             if available_dbs:
                 # Find current index
                 current_idx = 0
@@ -186,7 +543,6 @@ def main():
                 # Switch database if selection changed
                 if selected_db != st.session_state.selected_db:
                     st.session_state.selected_db = selected_db
-                    st.session_state.db_manager.switch_database(selected_db)
                     st.rerun()
             else:
                 st.warning("No databases found. Please create or upload a database.")
@@ -208,120 +564,61 @@ def main():
             clear_button = st.button("🔄 Clear", type="secondary", use_container_width=True)
         
         with col_btn3:
-            st.empty()  # Spacer for alignment
+            st.toggle(
+                "⚡ Approximate",
+                key="approximate_mode",
+                help="Estimate aggregates over very large tables from a random sample for sub-second answers"
+            )
     
     with col2:
         st.metric("Total Queries", len(st.session_state.query_history))
         # Show current database
-        st.caption(f"📁 Active: {st.session_state.selected_db}")
+        st.caption(f"📁 Active: {active_db}")
     
-    # Process query
+    # Submit query to the background workers; reruns reattach to the same job
+    job_manager = get_job_manager()
+    active_job = job_manager.get(st.session_state.active_job_id)
     if query_button and user_question:
-        
-        with st.spinner("🤔 Generating SQL query..."):
-            # Get schema and context
-            schema = st.session_state.db_manager.get_schema()
-            context = st.session_state.memory_manager.get_recent_context(3)
-            
-            # Generate SQL
-            prompt = st.session_state.assistant.build_sql_prompt(schema, user_question, context)
-            sql_query = st.session_state.assistant.generate_sql(prompt)
-            
-            # Validate SQL using SQLValidator
-            validator = SQLValidator(db_path=st.session_state.db_manager.db_path)
-            is_safe, safety_msg = validator.validate(sql_query)
-
-            if not is_safe:
-                st.error(f"❌ SQL Safety Error: {safety_msg}")
-                st.warning("Query execution blocked for security reasons.")
-                # Optionally show the problematic query for debugging
-                with st.expander("View Generated Query (Not Executed)"):
-                    st.code(sql_query, language="sql")
-                return 
-
-            if not sql_query:
-                st.error("Failed to generate SQL query")
-                return
-            
-            # Display generated SQL
-            st.subheader("📝 Generated SQL Query")
-            st.code(sql_query, language="sql")
-            
-            # Store the last SQL query for explanation
-            st.session_state.last_sql_query = sql_query
-            st.session_state.last_question = user_question
-            st.session_state.query_explanation = None  # Clear previous explanation
-        
-        with st.spinner("⚡ Executing query..."):
-            # Execute query
-            result = st.session_state.db_manager.execute_query(sql_query)
-            
-            if result is None:
-                st.error("Query execution failed")
-                return
-            
-            if not result:
-                st.warning("No results found")
-                summary = "No data found for the given query."
-                st.session_state.last_result = None
-                st.session_state.last_summary = summary
-            else:
-                # Generate summary
-                summary = st.session_state.assistant.generate_summary(
-                    user_question, result, context
-                )
-                
-                # Store in session state
-                st.session_state.last_result = result
-                st.session_state.last_summary = summary
-                
-                # Display results
-                st.subheader("📊 Query Results")
-                df = pd.DataFrame(result)
-                st.dataframe(df, use_container_width=True, width="stretch")
-                
-                # Display summary
-                st.subheader("💬 Natural Language Summary")
-                st.markdown(f'<div class="success-box">{summary}</div>', unsafe_allow_html=True)
-                
-                # Download option
-                csv = df.to_csv(index=False)
-                st.download_button(
-                    label="📥 Download Results as CSV",
-                    data=csv,
-                    file_name=f"query_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
-                )
-            
-            # Save to memory
-            st.session_state.memory_manager.add(user_question, sql_query, result, summary)
-            st.session_state.query_history.append({
-                "question": user_question,
-                "timestamp": datetime.now(),
-                "summary": summary
-            })
+        already_running = (
+            active_job is not None and not active_job.done
+            and active_job.question == user_question
+            and active_job.db_name == active_db
+        )
+        if not already_running:
+            context = memory_manager.get_recent_context(3) if memory_manager else ""
+            active_job = job_manager.submit(
+                user_question,
+                active_db,
+                context,
+                max_rows=DEFAULT_PAGE_SIZE,
+                approximate=st.session_state.get("approximate_mode", False)
+            )
+            st.session_state.active_job_id = active_job.job_id
+    
+    if active_job is not None and not active_job.done:
+        render_job_status(active_job.job_id)
+        return
+    
+    if active_job is not None and not apply_finished_job(active_job):
+        return
     
     # Display last results if available (persists across reruns)
-    elif st.session_state.last_sql_query:
+    if st.session_state.last_sql_query:
         st.subheader("📝 Generated SQL Query")
         st.code(st.session_state.last_sql_query, language="sql")
         
-        if st.session_state.last_result:
+        view = st.session_state.result_view
+        if view is not None:
             st.subheader("📊 Query Results")
-            df = pd.DataFrame(st.session_state.last_result)
-            st.dataframe(df, use_container_width=True, width="stretch")
+            render_result_page(view)
+            if st.session_state.last_approximation:
+                render_approximation(st.session_state.last_approximation)
             
             st.subheader("💬 Natural Language Summary")
             st.markdown(f'<div class="success-box">{st.session_state.last_summary}</div>', unsafe_allow_html=True)
             
-            # Download option
-            csv = df.to_csv(index=False)
-            st.download_button(
-                label="📥 Download Results as CSV",
-                data=csv,
-                file_name=f"query_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv"
-            )
+            # Export option
+            render_export_controls(view)
         elif st.session_state.last_summary:
             st.warning("No results found")
     
@@ -331,7 +628,11 @@ def main():
         with col_explain:
             if st.button("🔎 Explain Query", type="secondary", use_container_width=True):
                 with st.spinner("🧠 Generating explanation..."):
-                    explanation = st.session_state.query_explainer.explain_query(st.session_state.last_sql_query)
+                    try:
+                        explanation = get_query_explainer().explain_query(st.session_state.last_sql_query)
+                    except QueryPipelineError as e:
+                        st.error(e.message)
+                        explanation = "Unable to generate explanation."
                     st.session_state.query_explanation = explanation
         
         # Display explanation if available
@@ -343,6 +644,9 @@ def main():
     if clear_button:
         st.rerun()
     
+    if st.session_state.get("show_workload") and components:
+        render_workload_report(components)
+    
     # Query history
     if st.session_state.query_history:
         st.divider()
@@ -1,8 +1,9 @@
 import json
 import os
-import streamlit as st
+import threading
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
+from query_errors import MemoryStoreError
 
 
 class MemoryManager:
@@ -12,6 +13,7 @@ class MemoryManager:
         self.memory_dir = "memory"
         os.makedirs(self.memory_dir, exist_ok=True)
         self.memory_file = memory_file
+        self._lock = threading.RLock()
         self.memory = self._load()
     
     @staticmethod
@@ -39,31 +41,58 @@ class MemoryManager:
         return []
     
     def save(self) -> None:
-        """Save memory to JSON file."""
+        """
+        Save memory to JSON file.
+        
+        Raises:
+            MemoryStoreError: If the memory file cannot be written.
+        """
         try:
-            with open(self.memory_file, "w") as file:
+            with self._lock, open(self.memory_file, "w") as file:
                 json.dump(self.memory, file, indent=2)
         except IOError as e:
-            st.error(f"Error saving memory: {e}")
+            raise MemoryStoreError(f"Error saving memory: {e}") from e
     
-    def add(self, question: str, sql: str, result: List, summary: str) -> None:
-        """Add a new interaction to memory."""
-        self.memory.append({
+    def add(
+        self,
+        question: str,
+        sql: str,
+        result: List,
+        summary: str,
+        timings: Optional[Dict[str, float]] = None,
+        truncated: Optional[bool] = None,
+        approximate: bool = False
+    ) -> None:
+        """
+        Add a new interaction to memory.
+        
+        Args:
+            timings: Per-stage durations in seconds, kept as a latency baseline for replays
+            truncated: Whether result is only the first rows of a longer result
+            approximate: Whether result was estimated from a sample rather than computed exactly
+        """
+        entry = {
             "question": question,
             "sql": sql,
             "result": result,
             "summary": summary,
             "timestamp": datetime.now().isoformat()
-        })
-        self.save()
+        }
+        if timings is not None:
+            entry["timings_ms"] = {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+        if truncated is not None:
+            entry["truncated"] = truncated
+        if approximate:
+            entry["approximate"] = True
+        with self._lock:
+            self.memory.append(entry)
+            self.save()
     
-    def get_recent_context(self, n: int = 3) -> str:
-        """Get formatted context from recent interactions."""
-        if not self.memory:
-            return ""
-        
+    @staticmethod
+    def format_context(turns: List[Dict]) -> str:
+        """Format interactions as the context section of a prompt."""
         context = ""
-        for turn in self.memory[-n:]:
+        for turn in turns:
             context += f"Previous question: '{turn['question']}'\n"
             context += f"Generated SQL: {turn['sql']}\n"
             if 'summary' in turn:
@@ -71,7 +100,14 @@ class MemoryManager:
             context += "\n"
         return context
     
+    def get_recent_context(self, n: int = 3) -> str:
+        """Get formatted context from recent interactions."""
+        if not self.memory:
+            return ""
+        return self.format_context(self.memory[-n:])
+    
     def clear(self) -> None:
         """Clear all memory."""
-        self.memory = []
-        self.save()
\ No newline at end of file
+        with self._lock:
+            self.memory = []
+            self.save()
\ No newline at end of file
@@ -1,27 +1,15 @@
-import importlib
+import hashlib
+import importlib.util
+import json
+import math
 import os
-from typing import Optional, Tuple
+import re
+import threading
+from string import Formatter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 
-class PromptManager:
-    """Manages loading database-specific prompts."""
-    
-    def __init__(self):
-        self.prompts_dir = "prompts"
-        self.current_db = None
-        self.sql_prompt = None
-        self.summary_prompt = None
-        self._load_default_prompts()
-    
-    def _load_default_prompts(self) -> None:
-        """Load default prompts as fallback."""
-        try:
-            from prompts import default_prompt
-            self.sql_prompt = default_prompt.SQL_PROMPT
-            self.summary_prompt = default_prompt.SUMMARY_PROMPT
-        except ImportError:
-            # Hardcoded fallback if default_prompt doesn't exist
-            self.sql_prompt = """You are an AI assistant that converts user questions into SQLite-compatible SQL.
+DEFAULT_SQL_PROMPT = """You are an AI assistant that converts user questions into SQLite-compatible SQL.
 
 Guidelines:
 - Only return SELECT statements
@@ -34,7 +22,8 @@ Guidelines:
 User Question: {user_question}
 
 Generate only the SQL query:"""
-            self.summary_prompt = """Summarize the following data for the user's question: "{user_question}"
+
+DEFAULT_SUMMARY_PROMPT = """Summarize the following data for the user's question: "{user_question}"
 
 {context}
 
@@ -42,70 +31,404 @@ Current result:
 {data_preview}
 
 Summary:"""
-    
+
+# Fields each template may use
+SQL_PROMPT_FIELDS = {"column_descriptions", "context", "user_question"}
+SUMMARY_PROMPT_FIELDS = {"user_question", "context", "data_preview"}
+
+# Schema-bound SQL templates kept per registry (oldest evicted first)
+MAX_BOUND_TEMPLATES = 64
+
+# The prompts/ package next to this module, wherever the app is started from
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+# Estimated token budget for a SQL prompt (0 disables trimming)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+# Rough characters-per-token ratio used for local estimates
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (about four characters per token)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class SplitPrompt(str):
+    """
+    Full prompt text that also knows its stable prefix and per-request suffix.
+
+    The prefix (instructions and schema) is identical across requests to the
+    same database, so it can be cached provider-side; the suffix carries the
+    context and question. As a str it is simply the whole prompt.
+    """
+
+    def __new__(cls, prefix: str, suffix: str):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        return prompt
+
+    @property
+    def prefix_tokens(self) -> int:
+        return estimate_tokens(self.prefix)
+
+    @property
+    def suffix_tokens(self) -> int:
+        return estimate_tokens(self.suffix)
+
+    @property
+    def tokens(self) -> int:
+        return self.prefix_tokens + self.suffix_tokens
+
+
+def split_context_turns(context: str) -> List[str]:
+    """Split memory context (see MemoryManager.get_recent_context) into turns, oldest first."""
+    return [turn for turn in re.split(r"(?m)^(?=Previous question: )", context or "") if turn.strip()]
+
+
+def rank_tables(schema: Dict, question: str) -> List[str]:
+    """
+    Order tables by how many of their name/column words appear in the question.
+
+    Ties keep schema order, so the ranking is deterministic.
+    """
+    question_words = set(re.findall(r"[a-z0-9]+", question.lower()))
+
+    def score(table_name: str) -> int:
+        names = [table_name] + [column["name"] for column in schema[table_name]]
+        words = {word for name in names for word in re.findall(r"[a-z0-9]+", name.lower())}
+        return len(words & question_words)
+
+    order = {table_name: index for index, table_name in enumerate(schema)}
+    return sorted(schema, key=lambda table_name: (-score(table_name), order[table_name]))
+
+
+def trim_steps(schema: Dict, question: str, context: str) -> Iterator[Tuple[List[str], bool, str]]:
+    """
+    Yield ever smaller prompt contents as (tables, compact, context), in a fixed priority order:
+
+    1. Everything
+    2. Drop context turns, oldest first, down to the latest one
+    3. Compact the schema (column names and types only)
+    4. Drop the tables least related to the question, down to one
+    5. Drop the remaining context
+    """
+    tables = list(schema)
+    turns = split_context_turns(context)
+    yield tables, False, context
+    while len(turns) > 1:
+        turns = turns[1:]
+        yield tables, False, "".join(turns)
+    yield tables, True, "".join(turns)
+
+    ranked = rank_tables(schema, question)
+    while len(ranked) > 1:
+        ranked.pop()
+        tables = [table_name for table_name in schema if table_name in ranked]
+        yield tables, True, "".join(turns)
+    if turns:
+        yield tables, True, ""
+
+
+class PromptTemplate:
+    """
+    A prompt template split once into literal text and fields.
+
+    Rendering joins the pieces instead of re-parsing the template with
+    str.format, and bind() pre-renders fields that rarely change (such as
+    the schema) so only the per-request fields are filled in later.
+    """
+
+    def __init__(self, text: str, allowed_fields: Optional[set] = None):
+        """
+        Args:
+            text: Template in str.format syntax
+            allowed_fields: Field names the template may use
+
+        Raises:
+            ValueError: If the template is malformed or uses an unknown field
+        """
+        self.text = text
+        # Literal strings and (field, conversion, format_spec) tuples, in order
+        self.parts: List[Union[str, Tuple[str, Optional[str], str]]] = []
+        for literal, field, format_spec, conversion in Formatter().parse(text):
+            if literal:
+                self.parts.append(literal)
+            if field is not None:
+                if allowed_fields is not None and field not in allowed_fields:
+                    raise ValueError(f"Unknown prompt field: {{{field}}}")
+                self.parts.append((field, conversion, format_spec or ""))
+
+    @property
+    def fields(self) -> set:
+        return {part[0] for part in self.parts if isinstance(part, tuple)}
+
+    @staticmethod
+    def _format(value, conversion: Optional[str], format_spec: str) -> str:
+        if conversion == "r":
+            value = repr(value)
+        elif conversion == "a":
+            value = ascii(value)
+        elif conversion == "s":
+            value = str(value)
+        return format(value, format_spec)
+
+    def bind(self, **values) -> "PromptTemplate":
+        """Return a copy with the given fields rendered in, leaving the others open."""
+        bound = PromptTemplate("")
+        bound.text = self.text
+        for part in self.parts:
+            if isinstance(part, tuple) and part[0] in values:
+                part = self._format(values[part[0]], part[1], part[2])
+            if isinstance(part, str) and bound.parts and isinstance(bound.parts[-1], str):
+                bound.parts[-1] += part
+            else:
+                bound.parts.append(part)
+        return bound
+
+    def render(self, **values) -> str:
+        """Fill in every remaining field."""
+        return "".join(
+            part if isinstance(part, str) else self._format(values[part[0]], part[1], part[2])
+            for part in self.parts
+        )
+
+    def render_split(self, **values) -> SplitPrompt:
+        """
+        Fill in every remaining field, keeping the literal text before the first field as the prefix.
+
+        Surrounding whitespace is stripped, as with render().strip().
+        """
+        first_field = next((i for i, part in enumerate(self.parts) if isinstance(part, tuple)), len(self.parts))
+        prefix = "".join(self.parts[:first_field]).lstrip()
+        suffix = "".join(
+            part if isinstance(part, str) else self._format(values[part[0]], part[1], part[2])
+            for part in self.parts[first_field:]
+        ).rstrip()
+        if not prefix:
+            suffix = suffix.lstrip()
+        return SplitPrompt(prefix, suffix)
+
+
+class PromptSet:
+    """The compiled SQL and summary templates for one database."""
+
+    def __init__(self, sql: PromptTemplate, summary: PromptTemplate, source: Optional[str], version: Tuple):
+        self.sql = sql
+        self.summary = summary
+        # File the prompts came from (None for the built-in defaults)
+        self.source = source
+        # Changes whenever the backing files change
+        self.version = version
+
+
+class PromptRegistry:
+    """
+    Loads prompt templates once per database and hot-reloads them when their files change.
+
+    For a database 'my_data.db' the registry looks for, in order:
+    - prompts/my_data_prompt.json: a data file with "sql_prompt" and/or "summary_prompt"
+      (no code is imported, so it is safe for uploaded databases)
+    - prompts/my_data_prompt.py: a module defining SQL_PROMPT and SUMMARY_PROMPT
+    - prompts/default_prompt.py, then the built-in defaults
+    """
+
+    def __init__(self, prompts_dir: str = PROMPTS_DIR):
+        self.prompts_dir = prompts_dir
+        self._sets: Dict[str, PromptSet] = {}
+        self._bound: Dict[Tuple, PromptTemplate] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_base_name(db_name: str) -> str:
+        return db_name.replace('.db', '').replace('.sqlite', '').replace('.sqlite3', '')
+
+    def candidate_files(self, db_name: Optional[str]) -> List[str]:
+        """Prompt files that would be used for a database, most specific first."""
+        files = []
+        if db_name:
+            base_name = self.get_base_name(db_name)
+            files += [
+                os.path.join(self.prompts_dir, f"{base_name}_prompt.json"),
+                os.path.join(self.prompts_dir, f"{base_name}_prompt.py"),
+            ]
+        files.append(os.path.join(self.prompts_dir, "default_prompt.py"))
+        return files
+
+    def _version(self, db_name: Optional[str]) -> Tuple:
+        """mtime of every candidate file; any file appearing, changing or disappearing changes it."""
+        version = []
+        for path in self.candidate_files(db_name):
+            try:
+                version.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                version.append(None)
+        return tuple(version)
+
+    @staticmethod
+    def _read_file(path: str) -> Dict[str, Optional[str]]:
+        """Read SQL/summary prompt text from a JSON data file or a Python module."""
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {"sql": data.get("sql_prompt"), "summary": data.get("summary_prompt")}
+
+        # Execute the module privately; nothing is cached in sys.modules, so edits are picked up
+        spec = importlib.util.spec_from_file_location(f"_prompt_{os.path.basename(path)[:-3]}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return {"sql": getattr(module, "SQL_PROMPT", None), "summary": getattr(module, "SUMMARY_PROMPT", None)}
+
+    def _load(self, db_name: Optional[str], version: Tuple) -> PromptSet:
+        """Compile the most specific valid SQL and summary templates for a database."""
+        sql_template = summary_template = None
+        source = None
+        for path, mtime in zip(self.candidate_files(db_name), version):
+            if mtime is None:
+                continue
+            try:
+                texts = self._read_file(path)
+                if sql_template is None and texts["sql"]:
+                    sql_template = PromptTemplate(texts["sql"], SQL_PROMPT_FIELDS)
+                    source = source or path
+                if summary_template is None and texts["summary"]:
+                    summary_template = PromptTemplate(texts["summary"], SUMMARY_PROMPT_FIELDS)
+                    source = source or path
+            except Exception:
+                # A broken prompt file falls through to the next candidate
+                continue
+            if sql_template is not None and summary_template is not None:
+                break
+
+        return PromptSet(
+            sql_template or PromptTemplate(DEFAULT_SQL_PROMPT, SQL_PROMPT_FIELDS),
+            summary_template or PromptTemplate(DEFAULT_SUMMARY_PROMPT, SUMMARY_PROMPT_FIELDS),
+            source,
+            version
+        )
+
+    def get(self, db_name: Optional[str]) -> PromptSet:
+        """Return a database's compiled prompts, reloading them only if their files changed."""
+        version = self._version(db_name)
+        with self._lock:
+            prompt_set = self._sets.get(db_name)
+            if prompt_set is None or prompt_set.version != version:
+                prompt_set = self._load(db_name, version)
+                self._sets[db_name] = prompt_set
+            return prompt_set
+
+    def bound_sql_template(
+        self,
+        db_name: Optional[str],
+        schema_fingerprint: str,
+        describe_schema: Callable[[], str]
+    ) -> PromptTemplate:
+        """
+        SQL template with the schema already rendered in, cached per (database, prompt version, schema).
+
+        Args:
+            db_name: Database the prompt is for
+            schema_fingerprint: Identifies the schema's contents
+            describe_schema: Builds the column descriptions on a cache miss
+        """
+        prompt_set = self.get(db_name)
+        key = (db_name, prompt_set.version, schema_fingerprint)
+        with self._lock:
+            template = self._bound.get(key)
+        if template is None:
+            template = prompt_set.sql.bind(column_descriptions=describe_schema())
+            with self._lock:
+                self._bound[key] = template
+                while len(self._bound) > MAX_BOUND_TEMPLATES:
+                    self._bound.pop(next(iter(self._bound)))
+        return template
+
+
+# Shared by every PromptManager, so templates are loaded once per process
+_registry = PromptRegistry()
+
+
+def schema_fingerprint(schema: Dict) -> str:
+    """Stable hash of a schema dictionary's contents."""
+    return hashlib.sha1(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class PromptManager:
+    """Manages loading database-specific prompts."""
+
+    def __init__(self, registry: Optional[PromptRegistry] = None):
+        self.registry = registry or _registry
+        self.prompts_dir = self.registry.prompts_dir
+        self.current_db = None
+        # Fingerprint of the last schema seen, reused while the same schema object is passed in
+        self._schema: Optional[Dict] = None
+        self._schema_fingerprint: Optional[str] = None
+
     @staticmethod
     def get_prompt_module_name(db_name: str) -> str:
         """Generate prompt module name from database name."""
-        # Remove extension and create module name
-        base_name = db_name.replace('.db', '').replace('.sqlite', '').replace('.sqlite3', '')
-        return f"{base_name}_prompt"
-    
+        return f"{PromptRegistry.get_base_name(db_name)}_prompt"
+
+    @property
+    def prompts(self) -> PromptSet:
+        """Current database's compiled prompts (hot-reloaded if their files changed)."""
+        return self.registry.get(self.current_db)
+
     def load_prompts_for_db(self, db_name: str) -> Tuple[str, str]:
         """
         Load prompts specific to the given database.
         Falls back to default prompts if no specific prompt file exists.
-        
+
         Args:
             db_name: Name of the database file (e.g., 'soil_pollution.db')
-            
+
         Returns:
             Tuple of (sql_prompt, summary_prompt)
         """
-        if db_name == self.current_db:
-            return self.sql_prompt, self.summary_prompt
-        
-        module_name = self.get_prompt_module_name(db_name)
-        
-        try:
-            # Try to import database-specific prompt module
-            prompt_module = importlib.import_module(f"prompts.{module_name}")
-            
-            # Reload in case file was modified
-            importlib.reload(prompt_module)
-            
-            self.sql_prompt = getattr(prompt_module, 'SQL_PROMPT', None)
-            self.summary_prompt = getattr(prompt_module, 'SUMMARY_PROMPT', None)
-            
-            # Fall back to defaults if attributes missing
-            if not self.sql_prompt or not self.summary_prompt:
-                self._load_default_prompts()
-            
-            self.current_db = db_name
-            
-        except ImportError:
-            # No specific prompt file, use defaults
-            self._load_default_prompts()
-            self.current_db = db_name
-        
-        return self.sql_prompt, self.summary_prompt
-    
+        self.current_db = db_name
+        return self.get_sql_prompt(), self.get_summary_prompt()
+
     def get_sql_prompt(self) -> str:
         """Get the current SQL prompt template."""
-        return self.sql_prompt
-    
+        return self.prompts.sql.text
+
     def get_summary_prompt(self) -> str:
         """Get the current summary prompt template."""
-        return self.summary_prompt
-    
-    @staticmethod
-    def get_available_prompt_files() -> list:
+        return self.prompts.summary.text
+
+    def get_summary_template(self) -> PromptTemplate:
+        """Get the current compiled summary prompt template."""
+        return self.prompts.summary
+
+    def get_schema_bound_sql_template(
+        self,
+        schema: Dict,
+        describe_schema: Callable[[], str],
+        variant: str = ""
+    ) -> PromptTemplate:
+        """
+        Get the current SQL template with the schema rendered in.
+
+        Args:
+            schema: Database schema (see DatabaseManager.get_schema)
+            describe_schema: Builds the schema's column descriptions on a cache miss
+            variant: Distinguishes trimmed renderings of the same schema
+        """
+        if schema is not self._schema:
+            self._schema = schema
+            self._schema_fingerprint = schema_fingerprint(schema)
+        return self.registry.bound_sql_template(
+            self.current_db, f"{self._schema_fingerprint}:{variant}", describe_schema
+        )
+
+    def get_available_prompt_files(self) -> list:
         """List all available prompt files."""
-        prompts_dir = "prompts"
+        prompts_dir = self.prompts_dir
         if not os.path.exists(prompts_dir):
             return []
-        
+
         prompt_files = []
         for file in os.listdir(prompts_dir):
-            if file.endswith('_prompt.py') and file != 'default_prompt.py':
+            if file.endswith(('_prompt.py', '_prompt.json')) and file != 'default_prompt.py':
                 prompt_files.append(file)
         return prompt_files
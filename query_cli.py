@@ -0,0 +1,475 @@
+import argparse
+import json
+import sys
+
+from query_service import QueryService
+
+
+def _print_outcome(outcome, as_json: bool) -> None:
+    """Print a QueryOutcome as JSON or human-readable text."""
+    if as_json:
+        print(json.dumps(outcome.to_dict(), indent=2, default=str))
+        return
+
+    if outcome.sql:
+        print(f"SQL:\n{outcome.sql}\n")
+    if outcome.candidates:
+        valid = sum(1 for candidate in outcome.candidates if candidate["valid"])
+        print(f"Candidates: {valid} of {len(outcome.candidates)} valid")
+    for rewrite in outcome.rewrites:
+        print(f"Matched '{rewrite['from']}' to '{rewrite['to']}' in {rewrite['column']}")
+    for optimization in outcome.optimizations:
+        print(f"Optimized: {optimization['rule']} (plan cost {optimization['cost_before']:,} -> "
+              f"{optimization['cost_after']:,})")
+    if outcome.error:
+        print(f"Error ({outcome.error.stage}): {outcome.error.message}", file=sys.stderr)
+        return
+    print(f"Rows: {len(outcome.result)}")
+    if outcome.engine and outcome.engine != "sqlite":
+        print(f"Engine: {outcome.engine}")
+    approximation = outcome.approximation
+    if approximation:
+        print(f"Approximate: estimated from {approximation['sample_rows']:,} of {approximation['source_rows']:,} "
+              f"rows of {approximation['source_table']}, ± {approximation['confidence']:.0%} confidence")
+    for index, row in enumerate(outcome.result[:10]):
+        if approximation:
+            intervals = approximation["intervals"][index]
+            row = {key: f"{value} ± {intervals[key]:.4g}" if intervals.get(key) is not None else value
+                   for key, value in row.items()}
+        print(row)
+    if outcome.summary:
+        print(f"\nSummary:\n{outcome.summary}")
+
+
+def _export(args) -> int:
+    """Validate (or generate) a query and stream its full result to a file."""
+    import os
+    from query_errors import QueryPipelineError
+    from databse_manager import DatabaseManager
+    from result_export import export_query
+    from sql_validation import SQLValidator
+
+    db_manager = DatabaseManager.for_database(args.database, args.db_dir)
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+
+    sql = args.sql
+    if args.question:
+        outcome = QueryService(args.db_dir).ask(
+            args.question, args.database, summarize=False, remember=False, max_rows=0
+        )
+        if not outcome.ok:
+            _print_outcome(outcome, as_json=False)
+            return 1
+        sql = outcome.sql
+    else:
+        validator = SQLValidator(db_path=db_manager.db_path, attached=db_manager.attached)
+        is_valid, message = validator.validate(sql)
+        if not is_valid:
+            print(f"Error (validation): {message}", file=sys.stderr)
+            return 1
+
+    try:
+        rows = export_query(db_manager.db_path, sql, args.output, fmt, args.chunk_size,
+                            attached=db_manager.attached)
+    except QueryPipelineError as e:
+        print(f"Error ({e.stage}): {e.message}", file=sys.stderr)
+        return 1
+    print(f"Exported {rows} rows to {args.output}")
+    return 0
+
+
+def _aggregates(args) -> int:
+    """List a database's summary tables, optionally rebuilding them first."""
+    import os
+    from aggregate_cache import AggregateCache
+    from databse_manager import DatabaseManager
+    from memory_management import MemoryManager
+
+    db_path = os.path.join(args.db_dir, args.database)
+    if not os.path.exists(db_path):
+        print(f"Error (database): Database not found: {args.database}", file=sys.stderr)
+        return 1
+    cache = AggregateCache(DatabaseManager(db_path))
+    if args.refresh:
+        cache.refresh(MemoryManager.get_memory_file_for_db(args.database))
+    for summary in cache.catalog:
+        print(f"{summary.name}: {summary.source_table} by {', '.join(summary.group_columns)} "
+              f"({summary.group_count} groups, {len(summary.measures)} measures, {summary.hits} hits)")
+    return 0
+
+
+def _samples(args) -> int:
+    """List a database's table samples, optionally rebuilding them first."""
+    import os
+    from databse_manager import DatabaseManager
+    from sample_cache import SampleCache
+
+    db_path = os.path.join(args.db_dir, args.database)
+    if not os.path.exists(db_path):
+        print(f"Error (database): Database not found: {args.database}", file=sys.stderr)
+        return 1
+    cache = SampleCache(DatabaseManager(db_path))
+    if args.refresh:
+        cache.refresh()
+    for sample in cache.catalog.values():
+        print(f"{sample.name}: {sample.sample_rows:,} of {sample.source_rows:,} rows of {sample.source_table} "
+              f"({sample.fraction:.2%})")
+    return 0
+
+
+def _columnar(args) -> int:
+    """Show a database's columnar mirror, optionally rebuilding it first."""
+    import os
+    from query_engines import ColumnarMirror
+    from query_errors import QueryPipelineError
+
+    db_path = os.path.join(args.db_dir, args.database)
+    if not os.path.exists(db_path):
+        print(f"Error (database): Database not found: {args.database}", file=sys.stderr)
+        return 1
+    mirror = ColumnarMirror(db_path, args.database)
+    try:
+        if args.refresh:
+            mirror.build()
+        meta = mirror.meta()
+    except QueryPipelineError as e:
+        print(f"Error ({e.stage}): {e.message}", file=sys.stderr)
+        return 1
+    if meta is None:
+        print("No columnar mirror (build one with --refresh)")
+        return 0
+    print(f"{mirror.path}: {'current' if mirror.is_current() else 'stale'}")
+    for table, columns in meta["tables"].items():
+        mixed = meta["mixed"].get(table)
+        print(f"{table}: {meta['rows'][table]:,} rows, {len(columns)} columns"
+              + (f" (stays on SQLite for {', '.join(mixed)})" if mixed else ""))
+    return 0
+
+
+def _replay(args) -> int:
+    """Re-run a database's recorded questions and report result drift and latency changes."""
+    from query_errors import QueryPipelineError
+    from replay import ReplayHarness, load_responses
+
+    responses = load_responses(args.responses) if args.responses else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    harness = ReplayHarness(args.db_dir, llm=args.llm, responses=responses)
+    try:
+        report = harness.replay(args.database, limit=args.limit, repeat=args.repeat, baseline=baseline)
+    except QueryPipelineError as e:
+        print(f"Error ({e.stage}): {e.message}", file=sys.stderr)
+        return 1
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    print(f"Replayed {report['entries']} interactions from {report['database']} ({report['llm']} SQL): "
+          f"{report['matched']} match, {report['drifted']} drift, {report['failed']} errors, "
+          f"{report['rewritten']} read summary tables")
+    for record in report["results"]:
+        if record["status"] != "match":
+            reason = record.get("drift") or record["error"]["message"]
+            print(f"  [{record['status']}] {record['question']}: {reason}")
+    for stage, summary in report["stages"].items():
+        line = f"  {stage:<12} p50 {summary['p50_ms']:9.2f} ms  p95 {summary['p95_ms']:9.2f} ms"
+        if "baseline_p50_ms" in summary:
+            line += f"  (baseline p50 {summary['baseline_p50_ms']:.2f} ms, {summary['p50_change_pct']:+.1f}%"
+            line += ", REGRESSED)" if summary["regressed"] else ")"
+        print(line)
+    regressed = any(summary.get("regressed") for summary in report["stages"].values())
+    return 0 if report["drifted"] == 0 and report["failed"] == 0 and not regressed else 1
+
+
+def _workload(args) -> int:
+    """Show a database's workload statistics or logged queries."""
+    from workload_log import WorkloadLog
+
+    log = WorkloadLog(args.database)
+    if args.clear:
+        log.clear()
+        print(f"Cleared {log.path}")
+        return 0
+    entries = log.entries(since=args.since, table=args.table, slow_only=args.slow)
+    if args.queries:
+        entries = entries[-args.limit:] if args.limit else entries
+        if args.json:
+            print(json.dumps(entries, indent=2))
+            return 0
+        for entry in entries:
+            flags = " SLOW" if entry.get("slow") else ""
+            flags += f" ERROR: {entry['error']}" if entry.get("error") else ""
+            timing = f"{entry['execution_ms']:.2f} ms" if entry.get("execution_ms") is not None else "-"
+            print(f"[{entry['timestamp']}] {timing}, {entry.get('rows_returned')} rows returned, "
+                  f"~{entry.get('rows_scanned', '?')} scanned{flags}")
+            print(f"  Q: {entry['question']}")
+            print(f"  SQL: {entry['sql']}")
+            for line in entry.get("plan", []):
+                print(f"    {line}")
+        return 0
+
+    stats = log.stats(entries, top=args.top)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return 0
+    if not stats["queries"]:
+        print(f"No queries logged for {args.database}")
+        return 0
+    print(f"{stats['queries']} queries, {stats['errors']} errors, {stats['slow']} slow (>= {stats['slow_ms']:g} ms), "
+          f"{stats['full_scan_queries']} with full table scans ({stats['full_scan_rate']:.0%})")
+    print(f"Execution p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms")
+    print("\nTables:")
+    for table, summary in stats["tables"].items():
+        print(f"  {table}: {summary['queries']} queries, p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, "
+              f"{summary['full_scans']} full scans, {summary['automatic_indexes']} automatic indexes, "
+              f"{summary['slow']} slow")
+    print("\nMost used columns:")
+    for usage in stats["columns"]:
+        roles = ", ".join(f"{role} {usage[role]}" for role in ("filter", "join", "group", "order") if role in usage)
+        print(f"  {usage['column']}: {usage['queries']} queries ({roles}), {usage['full_scans']} on full scans")
+    print("\nCostliest patterns:")
+    for pattern in stats["patterns"]:
+        print(f"  {pattern['total_ms']} ms total, {pattern['queries']}x, p95 {pattern['p95_ms']} ms: {pattern['pattern']}")
+    return 0
+
+
+def _refresh(args) -> int:
+    """Apply an updated CSV to a table imported from an earlier version of it."""
+    import os
+    from csv_refresh import invalidate_derived, refresh_table_from_csv
+    from query_errors import QueryPipelineError
+
+    db_path = os.path.join(args.db_dir, args.database)
+    if not os.path.exists(db_path):
+        print(f"Error (database): Database not found: {args.database}", file=sys.stderr)
+        return 1
+    try:
+        report = refresh_table_from_csv(db_path, args.csv, args.table, args.key, args.delete_missing)
+        if report["inserted"] or report["updated"] or report["deleted"]:
+            report["rebuilt"] = invalidate_derived(db_path, args.database, [args.table])
+    except QueryPipelineError as e:
+        print(f"Error ({e.stage}): {e.message}", file=sys.stderr)
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def _upload(args) -> int:
+    """Check, analyze and index a SQLite file, then register it in the database directory."""
+    import os
+    from query_errors import UploadError
+    from upload_pipeline import UploadManager
+
+    manager = UploadManager(args.db_dir, vacuum=args.vacuum, page_size=args.page_size)
+    try:
+        with open(args.path, "rb") as f:
+            job = manager.prepare(args.name or os.path.basename(args.path), f.read(), args.overwrite)
+    except (OSError, UploadError) as e:
+        print(f"Error (upload): {e}", file=sys.stderr)
+        return 1
+    if job.error:
+        print(f"Error ({job.error.stage}): {job.error.message}", file=sys.stderr)
+        return 1
+    print(json.dumps(job.report, indent=2))
+    return 0
+
+
+def _startup(args) -> int:
+    """Print where the time goes when a module is imported from a cold start."""
+    from startup_profile import profile_imports
+
+    try:
+        profile = profile_imports(args.module, args.top)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(profile, indent=2))
+        return 0
+    print(f"import {profile['module']}: {profile['total_ms']:.1f} ms")
+    print("\nSlowest direct imports (cumulative):")
+    for record in profile["direct_imports"]:
+        print(f"  {record['cumulative_ms']:9.1f} ms  {record['module']}")
+    print("\nPackages by own import time:")
+    for record in profile["packages"]:
+        print(f"  {record['self_ms']:9.1f} ms  {record['package']}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Headless NL-SQL query tools")
+    parser.add_argument("--db-dir", default="db", help="Directory holding the SQLite databases")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ask = subparsers.add_parser("ask", help="Answer a single question")
+    ask.add_argument("question", help="Natural language question")
+    ask.add_argument("-d", "--database", default="soil_pollution.db",
+                     help="Database file name, or several joined with '+' for a cross-database query")
+    ask.add_argument("--no-summary", action="store_true", help="Skip the natural language summary")
+    ask.add_argument("--no-memory", action="store_true", help="Do not store the interaction in memory")
+    ask.add_argument("--json", action="store_true", help="Print the full outcome as JSON")
+    ask.add_argument("--candidates", type=int, help="SQL candidates generated concurrently (first valid wins)")
+    ask.add_argument("--consensus", action="store_true",
+                     help="Pick the candidate whose result most candidates agree on")
+    ask.add_argument("--approximate", action="store_true",
+                     help="Estimate aggregates over large tables from a random sample, with confidence intervals")
+    ask.add_argument("--engine", choices=["sqlite", "duckdb", "auto"],
+                     help="Execution engine (defaults to QUERY_ENGINE)")
+
+    subparsers.add_parser("databases", help="List available databases")
+
+    batch = subparsers.add_parser("batch", help="Answer a CSV/JSONL file of questions")
+    batch.add_argument("input", help="CSV (with header) or JSONL file with 'question' and 'database' fields")
+    batch.add_argument("-o", "--output", required=True, help="Output .jsonl or .csv file, written incrementally")
+    batch.add_argument("-d", "--database", help="Database for rows that do not name one")
+    batch.add_argument("--llm-concurrency", type=int, default=4, help="Concurrent Gemini calls")
+    batch.add_argument("--db-concurrency", type=int, default=4, help="Concurrent database validations/executions")
+    batch.add_argument("--no-summary", action="store_true", help="Skip natural language summaries")
+    batch.add_argument("--no-rows", action="store_true", help="Omit result rows from the output")
+
+    export = subparsers.add_parser("export", help="Stream a query's full result to a CSV, JSONL or Parquet file")
+    source = export.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sql", help="SELECT query to export (validated before running)")
+    source.add_argument("--question", help="Natural language question to answer and export")
+    export.add_argument("-d", "--database", default="soil_pollution.db", help="Database file name")
+    export.add_argument("-o", "--output", required=True, help="Output file")
+    export.add_argument("--format", choices=["csv", "jsonl", "parquet"],
+                        help="Export format (defaults to the output file's extension)")
+    export.add_argument("--chunk-size", type=int, default=5000, help="Rows fetched per round trip")
+
+    aggregates = subparsers.add_parser("aggregates", help="List materialized summary tables")
+    aggregates.add_argument("-d", "--database", default="soil_pollution.db", help="Database file name")
+    aggregates.add_argument("--refresh", action="store_true",
+                            help="Rebuild summaries from memory (run after changing the data outside the app)")
+
+    samples = subparsers.add_parser("samples", help="List random samples used for approximate answers")
+    samples.add_argument("-d", "--database", default="soil_pollution.db", help="Database file name")
+    samples.add_argument("--refresh", action="store_true",
+                         help="Rebuild samples of every large table (run after changing the data outside the app)")
+
+    columnar = subparsers.add_parser("columnar", help="Show the DuckDB mirror used by the columnar engine")
+    columnar.add_argument("-d", "--database", default="soil_pollution.db", help="Database file name")
+    columnar.add_argument("--refresh", action="store_true", help="Rebuild the mirror from the SQLite file")
+
+    refresh = subparsers.add_parser("refresh", help="Apply only the changes in an updated CSV to an imported table")
+    refresh.add_argument("csv", help="Updated CSV file")
+    refresh.add_argument("-d", "--database", default="soil_pollution.db", help="Database file name")
+    refresh.add_argument("-t", "--table", required=True, help="Table the CSV was imported into")
+    refresh.add_argument("--key", help="Column identifying a row (default: match rows by content)")
+    refresh.add_argument("--delete-missing", action="store_true", help="Delete rows no longer in the CSV")
+
+    workload = subparsers.add_parser("workload", help="Show logged query timings, plans and workload statistics")
+    workload.add_argument("-d", "--database", default="soil_pollution.db", help="Database file name")
+    workload.add_argument("--queries", action="store_true", help="List logged queries with their plans")
+    workload.add_argument("--slow", action="store_true", help="Only queries flagged as slow")
+    workload.add_argument("--table", help="Only queries reading this table")
+    workload.add_argument("--since", help="Only queries logged since this ISO date (e.g., 2026-10-01)")
+    workload.add_argument("--limit", type=int, default=20, help="Most recent queries listed with --queries (0 for all)")
+    workload.add_argument("--top", type=int, default=10, help="Columns and patterns listed in the statistics")
+    workload.add_argument("--json", action="store_true", help="Print JSON")
+    workload.add_argument("--clear", action="store_true", help="Delete the database's workload log")
+
+    replay = subparsers.add_parser("replay", help="Re-run recorded questions and report drift and latency changes")
+    replay.add_argument("-d", "--database", default="soil_pollution.db", help="Database whose memory is replayed")
+    replay.add_argument("--llm", choices=["recorded", "live"], default="recorded",
+                        help="Use the recorded SQL (offline) or regenerate it with Gemini")
+    replay.add_argument("--responses", help="JSON/JSONL of stubbed SQL by question, overriding the recorded SQL")
+    replay.add_argument("--baseline", help="Previous replay report to compare latencies with")
+    replay.add_argument("-o", "--output", help="Write the full JSON report here")
+    replay.add_argument("--limit", type=int, help="Only replay the most recent N interactions")
+    replay.add_argument("--repeat", type=int, default=1, help="Replay the set N times for steadier latencies")
+
+    upload = subparsers.add_parser("upload", help="Check, analyze and index a SQLite file, then register it")
+    upload.add_argument("path", help="SQLite database file")
+    upload.add_argument("--name", help="Database name to register it under (default: the file name)")
+    upload.add_argument("--overwrite", action="store_true", help="Replace an existing database of the same name")
+    upload.add_argument("--vacuum", action="store_true", help="Rebuild the file with VACUUM")
+    upload.add_argument("--page-size", type=int, default=0, help="Page size to VACUUM into (e.g., 8192)")
+
+    startup = subparsers.add_parser("startup", help="Show the import-time breakdown of a cold start")
+    startup.add_argument("--module", default="main", help="Module to import (default: the Streamlit app)")
+    startup.add_argument("--top", type=int, default=10, help="Entries shown per breakdown")
+    startup.add_argument("--json", action="store_true", help="Print the breakdown as JSON")
+
+    serve = subparsers.add_parser("serve", help="Run the HTTP query API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--processes", type=int, default=1, help="Server processes sharing the port")
+    serve.add_argument("--max-inflight", type=int, default=8, help="Concurrent pipeline runs per process")
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if args.command == "databases":
+        for db_name in QueryService(args.db_dir).list_databases():
+            print(db_name)
+        return 0
+
+    if args.command == "batch":
+        from batch_runner import run_batch
+        stats = run_batch(
+            args.input,
+            args.output,
+            default_database=args.database,
+            db_dir=args.db_dir,
+            llm_concurrency=args.llm_concurrency,
+            db_concurrency=args.db_concurrency,
+            summarize=not args.no_summary,
+            include_rows=not args.no_rows
+        )
+        print(json.dumps(stats, indent=2))
+        return 0 if stats["failed"] == 0 else 1
+
+    if args.command == "export":
+        return _export(args)
+
+    if args.command == "aggregates":
+        return _aggregates(args)
+
+    if args.command == "samples":
+        return _samples(args)
+
+    if args.command == "columnar":
+        return _columnar(args)
+
+    if args.command == "workload":
+        return _workload(args)
+
+    if args.command == "refresh":
+        return _refresh(args)
+
+    if args.command == "replay":
+        return _replay(args)
+
+    if args.command == "upload":
+        return _upload(args)
+
+    if args.command == "startup":
+        return _startup(args)
+
+    if args.command == "serve":
+        from query_server import serve
+        serve(args.host, args.port, args.db_dir, args.processes, args.max_inflight)
+        return 0
+
+    outcome = QueryService(args.db_dir).ask(
+        args.question,
+        args.database,
+        summarize=not args.no_summary,
+        remember=not args.no_memory,
+        candidates=args.candidates,
+        candidate_mode="consensus" if args.consensus else None,
+        approximate=args.approximate,
+        engine=args.engine
+    )
+    _print_outcome(outcome, args.json)
+    return 0 if outcome.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,574 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from databse_manager import DatabaseManager, data_fingerprint, is_federation, is_internal_table
+from query_errors import ExecutionError
+
+
+# Execution engine: 'sqlite' (default), 'duckdb' (every query the columnar mirror can answer)
+# or 'auto' (only analytical queries over large tables)
+ENGINE_MODE = os.getenv("QUERY_ENGINE", "sqlite")
+ENGINE_MODES = ("sqlite", "duckdb", "auto")
+COLUMNAR_DIR = "cache"
+# In auto mode, aggregates over fewer source rows than this stay on SQLite
+COLUMNAR_MIN_ROWS = int(os.getenv("COLUMNAR_MIN_ROWS", "100000"))
+# DuckDB worker threads (0 lets DuckDB use every core)
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0"))
+# Rows copied from SQLite into the mirror per batch
+INGEST_BATCH_ROWS = 100000
+# Table inside the mirror recording what it was built from
+MIRROR_META_TABLE = "_nlsql_mirror"
+
+# Storage classes found in a column -> DuckDB column type
+DUCKDB_TYPES = {"integer": "BIGINT", "real": "DOUBLE", "text": "VARCHAR"}
+COMPARISONS = (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE)
+ARITHMETIC = (exp.Add, exp.Sub, exp.Mul, exp.Div, exp.Mod)
+
+
+def load_duckdb():
+    """
+    Import DuckDB, which only the columnar engine needs.
+
+    Raises:
+        ExecutionError: If duckdb is not installed.
+    """
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ExecutionError("The DuckDB engine requires the duckdb package (pip install duckdb)") from e
+    return duckdb
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _affinity(declared_type: str) -> str:
+    """SQLite column affinity of a declared type (see 'Determination Of Column Affinity')."""
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "integer"
+    if any(token in declared_type for token in ("CHAR", "CLOB", "TEXT")):
+        return "text"
+    if not declared_type or "BLOB" in declared_type:
+        return "blob"
+    if any(token in declared_type for token in ("REAL", "FLOA", "DOUB")):
+        return "real"
+    return "numeric"
+
+
+class UnsupportedQuery(Exception):
+    """A query whose SQLite semantics the columnar engine would not reproduce."""
+
+
+class SQLiteEngine:
+    """The default engine: runs queries on the database's own SQLite connection."""
+
+    name = "sqlite"
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+
+    def execute(self, sql: str, max_rows: Optional[int] = None) -> List[Dict]:
+        return self.db_manager.execute_query(sql, max_rows=max_rows)
+
+
+class ColumnarMirror:
+    """
+    Read-only DuckDB copy of a SQLite database's user tables.
+
+    Each column gets the DuckDB type of the values it actually stores, so
+    numbers imported as TEXT stay VARCHAR and compare exactly as they do in
+    SQLite. Columns that mix text and numbers are recorded as such (queries
+    touching them stay on SQLite) and tables holding BLOBs are not mirrored.
+    The mirror remembers the data fingerprint it was copied from and counts
+    as stale as soon as the SQLite file's data changes.
+    """
+
+    def __init__(self, db_path: str, db_name: Optional[str] = None, mirror_dir: str = COLUMNAR_DIR):
+        self.db_path = db_path
+        self.path = self.mirror_path(db_name or os.path.basename(db_path), mirror_dir)
+        self._meta: Optional[Dict] = None
+        self._meta_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # Why the last background build failed, until a build succeeds
+        self.last_error: Optional[ExecutionError] = None
+
+    @staticmethod
+    def mirror_path(db_name: str, mirror_dir: str = COLUMNAR_DIR) -> str:
+        """Mirror file of a database (e.g., 'cache/soil_pollution_columnar.duckdb')."""
+        base_name = db_name.replace('.db', '').replace('.sqlite', '').replace('.sqlite3', '')
+        return os.path.join(mirror_dir, f"{base_name}_columnar.duckdb")
+
+    @staticmethod
+    def _column_types(conn: sqlite3.Connection, table: str) -> Optional[Dict[str, Tuple[str, bool]]]:
+        """
+        Census the storage classes of a table's columns in one scan.
+
+        Returns:
+            column -> (DuckDB type, whether the column mixes text with numbers),
+            or None if the table holds BLOBs
+        """
+        columns = [(row[1], row[2] or "") for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+        counts = conn.execute("SELECT " + ", ".join(
+            f"SUM(typeof({_quote(column)}) = '{storage}')"
+            for column, _ in columns for storage in ("integer", "real", "text", "blob")
+        ) + f" FROM {_quote(table)}").fetchone()
+
+        types = {}
+        for position, (column, declared_type) in enumerate(columns):
+            integers, reals, texts, blobs = (count or 0 for count in counts[position * 4:position * 4 + 4])
+            if blobs:
+                return None
+            if texts:
+                # Text in a column without TEXT affinity compares differently from a VARCHAR
+                mixed = bool(integers or reals) or _affinity(declared_type) != "text"
+                types[column] = (DUCKDB_TYPES["text"], mixed)
+            elif reals:
+                types[column] = (DUCKDB_TYPES["real"], False)
+            elif integers:
+                types[column] = (DUCKDB_TYPES["integer"], False)
+            else:
+                types[column] = (DUCKDB_TYPES["text"], _affinity(declared_type) != "text")
+        return types
+
+    @staticmethod
+    def _copy_rows(source: sqlite3.Connection, target, table: str, types: Dict[str, Tuple[str, bool]]) -> int:
+        """Stream a table's rows from SQLite into the mirror in batches, via Arrow when available."""
+        try:
+            import pyarrow as pa
+            arrow_types = {"BIGINT": pa.int64(), "DOUBLE": pa.float64(), "VARCHAR": pa.string()}
+        except ImportError:
+            pa = None
+
+        column_types = [duck_type for duck_type, _ in types.values()]
+        # Mixed columns are never queried on the mirror, but their numbers must still fit a VARCHAR
+        mixed = [position for position, (_, is_mixed) in enumerate(types.values()) if is_mixed]
+        cursor = source.execute(f"SELECT * FROM {_quote(table)}")
+        copied = 0
+        while True:
+            rows = cursor.fetchmany(INGEST_BATCH_ROWS)
+            if not rows:
+                return copied
+            if mixed:
+                rows = [
+                    tuple(str(value) if position in mixed and value is not None else value for position, value in enumerate(row))
+                    for row in rows
+                ]
+            if pa is None:
+                placeholders = ", ".join("?" for _ in column_types)
+                target.executemany(f"INSERT INTO {_quote(table)} VALUES ({placeholders})", rows)
+            else:
+                batch = pa.table({
+                    f"c{position}": pa.array([row[position] for row in rows], type=arrow_types[duck_type])
+                    for position, duck_type in enumerate(column_types)
+                })
+                target.register("_nlsql_batch", batch)
+                target.execute(f"INSERT INTO {_quote(table)} SELECT * FROM _nlsql_batch")
+                target.unregister("_nlsql_batch")
+            copied += len(rows)
+
+    @staticmethod
+    def _ingest_csv(target, table: str, columns: List[str], csv_path: str) -> int:
+        """Load a table straight from the CSV it was imported from, as all-TEXT like create_db does."""
+        # Empty fields are empty strings in SQLite, so nothing may be read as NULL
+        target.execute(
+            f"INSERT INTO {_quote(table)} SELECT * FROM read_csv(?, header = true, all_varchar = true, "
+            "delim = ',', quote = '\"', escape = '\"', nullstr = ?, names = ?)",
+            [csv_path, "\x00", columns]
+        )
+        return target.execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0]
+
+    def build(self, csv_sources: Optional[Dict[str, str]] = None) -> List[str]:
+        """
+        (Re)build the mirror from the SQLite file and swap it in atomically.
+
+        Returns immediately (with no changes) if another build is running.
+
+        Args:
+            csv_sources: table -> CSV file the table holds exactly (e.g., right after
+                create_db imported it); those tables are read from the CSV directly
+
+        Returns:
+            Names of the tables mirrored
+
+        Raises:
+            ExecutionError: If duckdb is not installed or the mirror cannot be written.
+        """
+        duckdb = load_duckdb()
+        if not self._build_lock.acquire(blocking=False):
+            return []
+        building_path = self.path + ".building"
+        try:
+            # Taken before copying, so writes made meanwhile leave the mirror stale rather than wrong
+            source_fingerprint = data_fingerprint(self.db_path)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            for leftover in (building_path, building_path + ".wal"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+            source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            target = duckdb.connect(building_path)
+            try:
+                meta: Dict = {"source": source_fingerprint, "tables": {}, "mixed": {}, "rows": {}}
+                tables = [
+                    name for (name,) in source.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                    if not name.startswith("sqlite_") and not is_internal_table(name)
+                ]
+                for table in tables:
+                    types = self._column_types(source, table)
+                    if types is None:
+                        continue
+                    target.execute(f"CREATE TABLE {_quote(table)} (" + ", ".join(
+                        f"{_quote(column)} {duck_type}" for column, (duck_type, _) in types.items()
+                    ) + ")")
+                    csv_path = (csv_sources or {}).get(table)
+                    if csv_path and all(duck_type == "VARCHAR" for duck_type, _ in types.values()):
+                        rows = self._ingest_csv(target, table, list(types), csv_path)
+                    else:
+                        rows = self._copy_rows(source, target, table, types)
+                    meta["tables"][table] = {column: duck_type for column, (duck_type, _) in types.items()}
+                    meta["mixed"][table] = [column for column, (_, mixed) in types.items() if mixed]
+                    meta["rows"][table] = rows
+                meta["built_at"] = time.time()
+                target.execute(f"CREATE TABLE {MIRROR_META_TABLE} (payload VARCHAR)")
+                target.execute(f"INSERT INTO {MIRROR_META_TABLE} VALUES (?)", [json.dumps(meta)])
+                target.execute("CHECKPOINT")
+            finally:
+                target.close()
+                source.close()
+            os.replace(building_path, self.path)
+            self.last_error = None
+            return list(meta["tables"])
+        except (sqlite3.Error, duckdb.Error, OSError) as e:
+            if os.path.exists(building_path):
+                os.remove(building_path)
+            raise ExecutionError(f"Error building columnar mirror: {e}") from e
+        finally:
+            self._build_lock.release()
+
+    def build_in_background(self) -> None:
+        """Rebuild the mirror on a daemon thread; a failure is kept in last_error rather than raised."""
+        def run() -> None:
+            try:
+                self.build()
+            except ExecutionError as e:
+                self.last_error = e
+
+        threading.Thread(target=run, daemon=True, name="nlsql-columnar").start()
+
+    @property
+    def building(self) -> bool:
+        return self._build_lock.locked()
+
+    @contextmanager
+    def connect(self) -> Iterator:
+        """
+        A short-lived read-only connection to the mirror.
+
+        Connections are not kept open: DuckDB shares one instance per file
+        within a process, so a long-lived one would keep serving a replaced mirror.
+        """
+        duckdb = load_duckdb()
+        config = {"integer_division": True}
+        if DUCKDB_THREADS:
+            config["threads"] = DUCKDB_THREADS
+        conn = duckdb.connect(self.path, read_only=True, config=config)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def meta(self) -> Optional[Dict]:
+        """Source fingerprint, column types, mixed columns and row counts of the mirror, if any."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        with self._lock:
+            if self._meta is None or self._meta_mtime != mtime:
+                with self.connect() as conn:
+                    self._meta = json.loads(conn.execute(f"SELECT payload FROM {MIRROR_META_TABLE}").fetchone()[0])
+                self._meta_mtime = mtime
+            return self._meta
+
+    def is_current(self) -> bool:
+        """Whether the mirror exists and holds the SQLite file's current data."""
+        meta = self.meta()
+        return meta is not None and meta["source"] == json.loads(json.dumps(data_fingerprint(self.db_path)))
+
+
+class DuckDBEngine:
+    """
+    Embedded columnar, multi-threaded engine reading a database's ColumnarMirror.
+
+    Queries arrive in SQLite's dialect (that is what is generated and validated)
+    and are transpiled with sqlglot. Where DuckDB would answer differently the
+    SQL is adjusted to SQLite's semantics: LIKE is case-insensitive, numeric
+    literals compared with TEXT columns compare as text, SUM/AVG read numbers
+    out of TEXT columns and integer division truncates. Anything else it cannot
+    reproduce raises UnsupportedQuery. Result columns keep SQLite's names.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, mirror: ColumnarMirror, db_manager: DatabaseManager):
+        self.mirror = mirror
+        self.db_manager = db_manager
+
+    @staticmethod
+    def _tables(tree: exp.Expression) -> Dict[str, str]:
+        """Alias (or name) -> table name of the tables a query reads, excluding CTEs."""
+        ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        return {
+            table.alias_or_name.lower(): table.name
+            for table in tree.find_all(exp.Table)
+            if table.name.lower() not in ctes
+        }
+
+    @staticmethod
+    def _column_type(column: exp.Column, tables: Dict[str, str], types: Dict[str, Dict[str, str]]) -> Optional[str]:
+        """DuckDB type of a column, resolved against the query's tables (types keyed by lowercase names)."""
+        if column.table:
+            table = tables.get(column.table.lower(), "")
+            return types.get(table.lower(), {}).get(column.name.lower())
+        matches = [
+            types[table.lower()][column.name.lower()]
+            for table in set(tables.values())
+            if column.name.lower() in types.get(table.lower(), {})
+        ]
+        return matches[0] if len(matches) == 1 else None
+
+    @staticmethod
+    def _as_text_literal(node: exp.Expression) -> exp.Expression:
+        """A numeric literal as SQLite's TEXT affinity would convert it before comparing."""
+        negative = isinstance(node, exp.Neg)
+        literal = node.this if negative else node
+        if not isinstance(literal, exp.Literal) or literal.is_string:
+            return node
+        if not literal.this.isdigit():
+            # REAL -> TEXT conversion follows SQLite's own float formatting
+            raise UnsupportedQuery(f"real literal {literal.this} compared with a TEXT column")
+        return exp.Literal.string(f"-{int(literal.this)}" if negative else str(int(literal.this)))
+
+    def check(self, sql: str) -> exp.Expression:
+        """
+        Parse a query and make sure the mirror can answer it like SQLite would.
+
+        Raises:
+            UnsupportedQuery: If it reads tables or columns the mirror does not hold as SQLite does.
+        """
+        meta = self.mirror.meta()
+        if meta is None:
+            raise UnsupportedQuery("no columnar mirror")
+        try:
+            tree = sqlglot.parse_one(sql, read="sqlite")
+        except sqlglot.errors.ParseError as e:
+            raise UnsupportedQuery(str(e))
+        tables = self._tables(tree)
+        mirrored = {table.lower(): table for table in meta["tables"]}
+        for table in tables.values():
+            if table.lower() not in mirrored:
+                raise UnsupportedQuery(f"table {table} is not mirrored")
+        mixed = {
+            column.lower()
+            for table in tables.values()
+            for column in meta["mixed"].get(mirrored[table.lower()], [])
+        }
+        for column in tree.find_all(exp.Column):
+            if column.name.lower() in mixed:
+                raise UnsupportedQuery(f"column {column.name} mixes text and numbers")
+        return tree
+
+    def translate(self, sql: str) -> Tuple[str, List[int]]:
+        """
+        Transpile a SQLite query to DuckDB's dialect, keeping SQLite's semantics.
+
+        Returns:
+            (DuckDB SQL, positions of result columns that sum TEXT columns, which SQLite
+            returns as integers when every value is one)
+
+        Raises:
+            UnsupportedQuery: If the mirror cannot answer it like SQLite would.
+        """
+        tree = self.check(sql)
+        types = {
+            table.lower(): {column.lower(): duck_type for column, duck_type in columns.items()}
+            for table, columns in self.mirror.meta()["tables"].items()
+        }
+        tables = self._tables(tree)
+
+        def is_text(node: exp.Expression) -> bool:
+            return isinstance(node, exp.Column) and self._column_type(node, tables, types) == "VARCHAR"
+
+        text_sums = [
+            position for position, projection in enumerate(tree.selects)
+            if isinstance(projection.unalias(), exp.Sum) and is_text(projection.unalias().this)
+        ] if isinstance(tree, exp.Select) else []
+
+        def transform(node: exp.Expression) -> exp.Expression:
+            if isinstance(node, ARITHMETIC) and (is_text(node.this) or is_text(node.expression)):
+                # SQLite's result type depends on each value's text ('7' / 2 is 3, '7.0' / 2 is 3.5)
+                raise UnsupportedQuery("arithmetic on a TEXT column")
+            if isinstance(node, exp.Like):
+                return exp.ILike(this=node.this, expression=node.expression)
+            if isinstance(node, COMPARISONS):
+                if is_text(node.this):
+                    node.set("expression", self._as_text_literal(node.expression))
+                elif is_text(node.expression):
+                    node.set("this", self._as_text_literal(node.this))
+            elif isinstance(node, exp.In) and is_text(node.this):
+                node.set("expressions", [self._as_text_literal(value) for value in node.expressions])
+            elif isinstance(node, exp.Between) and is_text(node.this):
+                node.set("low", self._as_text_literal(node.args["low"]))
+                node.set("high", self._as_text_literal(node.args["high"]))
+            elif isinstance(node, (exp.Sum, exp.Avg)) and is_text(node.this):
+                # SQLite sums TEXT as numbers, counting what does not parse as 0
+                value = node.this.copy()
+                node.set("this", exp.Coalesce(
+                    this=exp.TryCast(this=value, to=exp.DataType.build("DOUBLE")),
+                    expressions=[exp.Case(ifs=[exp.If(
+                        this=exp.Not(this=exp.Is(this=value.copy(), expression=exp.Null())),
+                        true=exp.Literal.number(0)
+                    )])]
+                ))
+            return node
+
+        return tree.transform(transform).sql(dialect="duckdb"), text_sums
+
+    def execute(self, sql: str, max_rows: Optional[int] = None) -> List[Dict]:
+        """
+        Run a SQLite query on the mirror.
+
+        Raises:
+            UnsupportedQuery: If the mirror cannot answer it like SQLite would.
+            ExecutionError: If DuckDB fails to run the translated query.
+        """
+        duckdb = load_duckdb()
+        translated, text_sums = self.translate(sql)
+        # Result columns are named as SQLite would name them
+        columns = self.db_manager.column_names(sql)
+        try:
+            with self.mirror.connect() as conn:
+                cursor = conn.execute(translated)
+                rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows)
+        except duckdb.Error as e:
+            raise ExecutionError(f"DuckDB error: {e}", sql=translated) from e
+        if rows and len(rows[0]) != len(columns):
+            raise ExecutionError("DuckDB returned a different number of columns than SQLite", sql=translated)
+        if text_sums:
+            rows = [
+                tuple(
+                    int(value) if position in text_sums and isinstance(value, float) and value.is_integer() else value
+                    for position, value in enumerate(row)
+                )
+                for row in rows
+            ]
+        return [dict(zip(columns, row)) for row in rows]
+
+
+class EngineRouter:
+    """
+    Picks the engine each query runs on.
+
+    SQLite stays the default and the fallback. With QUERY_ENGINE=duckdb every
+    query the columnar mirror can answer runs on DuckDB; with 'auto' only
+    analytical ones (aggregates, GROUP BY, DISTINCT) over at least
+    COLUMNAR_MIN_ROWS rows do, since point lookups are faster on SQLite's
+    B-trees. Federations, internal tables (summary tables, samples) and a
+    stale mirror always use SQLite; a stale mirror is rebuilt in the background.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, db_name: str, mode: str = ENGINE_MODE, mirror_dir: str = COLUMNAR_DIR):
+        """
+        Args:
+            db_manager: Manager of the database (or federation) queries run against
+            db_name: Database name, used to name the mirror file
+            mode: 'sqlite', 'duckdb' or 'auto'
+            mirror_dir: Directory holding columnar mirrors
+        """
+        if mode not in ENGINE_MODES:
+            raise ValueError(f"Unknown query engine: {mode}")
+        self.mode = mode
+        self.sqlite = SQLiteEngine(db_manager)
+        self.mirror = None if is_federation(db_name) else ColumnarMirror(db_manager.db_path, db_name, mirror_dir)
+        self.duckdb = None if self.mirror is None else DuckDBEngine(self.mirror, db_manager)
+
+    def route(self, sql: str, mode: Optional[str] = None) -> Tuple[object, str]:
+        """
+        Choose the engine for a query.
+
+        Args:
+            sql: Query in SQLite's dialect
+            mode: Override the router's mode for this query
+
+        Returns:
+            (engine, reason the engine was chosen)
+        """
+        mode = mode or self.mode
+        if mode not in ENGINE_MODES:
+            raise ValueError(f"Unknown query engine: {mode}")
+        if mode == "sqlite":
+            return self.sqlite, "default engine"
+        if self.duckdb is None:
+            return self.sqlite, "federated query"
+        try:
+            load_duckdb()
+        except ExecutionError:
+            return self.sqlite, "duckdb is not installed"
+        if not self.mirror.is_current():
+            failed = self.mirror.last_error
+            if not self.mirror.building:
+                self.mirror.build_in_background()
+            if failed is not None:
+                return self.sqlite, f"columnar mirror could not be built: {failed.message}"
+            return self.sqlite, "columnar mirror is being built"
+        try:
+            tree = self.duckdb.check(sql)
+            self.duckdb.translate(sql)
+        except UnsupportedQuery as e:
+            return self.sqlite, str(e)
+        if mode == "auto":
+            if not (tree.find(exp.AggFunc) or tree.find(exp.Group) or tree.find(exp.Distinct)):
+                return self.sqlite, "not an analytical query"
+            rows = self.mirror.meta()["rows"]
+            scanned = sum(rows.get(table, 0) for table in set(self.duckdb._tables(tree).values()))
+            if scanned < COLUMNAR_MIN_ROWS:
+                return self.sqlite, f"only {scanned} source rows"
+        return self.duckdb, "columnar mirror"
+
+    def execute(self, sql: str, max_rows: Optional[int] = None, mode: Optional[str] = None) -> Tuple[List[Dict], str, Optional[ExecutionError]]:
+        """
+        Run a query on the engine route() picks, falling back to SQLite if DuckDB fails.
+
+        Returns:
+            (rows, name of the engine that produced them, the DuckDB error a fallback
+            recovered from, or why the mirror could not be built)
+
+        Raises:
+            ExecutionError: If the query fails on SQLite.
+        """
+        engine, _ = self.route(sql, mode)
+        warning = None
+        if engine is self.sqlite and (mode or self.mode) != "sqlite" and self.mirror is not None:
+            failed = self.mirror.last_error
+            if failed is not None:
+                warning = ExecutionError(f"Columnar mirror could not be built, answered with SQLite instead: {failed.message}")
+        if engine is self.duckdb:
+            try:
+                return self.duckdb.execute(sql, max_rows), self.duckdb.name, None
+            except UnsupportedQuery:
+                pass
+            except ExecutionError as e:
+                fallback = ExecutionError(f"Columnar engine failed, answered with SQLite instead: {e.message}", sql=e.sql)
+                return self.sqlite.execute(sql, max_rows), self.sqlite.name, fallback
+        return self.sqlite.execute(sql, max_rows), self.sqlite.name, warning
@@ -0,0 +1,66 @@
+from typing import Dict, Optional
+
+
+class QueryPipelineError(Exception):
+    """Base class for structured errors raised by the NL-SQL pipeline."""
+
+    stage = "pipeline"
+
+    def __init__(self, message: str, sql: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.sql = sql
+
+    def to_dict(self) -> Dict:
+        """Serialize the error for JSON responses and batch output."""
+        return {
+            "stage": self.stage,
+            "type": type(self).__name__,
+            "message": self.message,
+            "sql": self.sql
+        }
+
+
+class ConfigurationError(QueryPipelineError):
+    """Raised when the service is missing required configuration (e.g., API key)."""
+    stage = "configuration"
+
+
+class DatabaseNotFoundError(QueryPipelineError):
+    """Raised when the requested database does not exist."""
+    stage = "database"
+
+
+class SchemaError(QueryPipelineError):
+    """Raised when the database schema cannot be read."""
+    stage = "schema"
+
+
+class GenerationError(QueryPipelineError):
+    """Raised when the LLM fails to produce SQL or an explanation."""
+    stage = "generation"
+
+
+class ValidationError(QueryPipelineError):
+    """Raised when generated SQL fails safety, semantic or execution checks."""
+    stage = "validation"
+
+
+class ExecutionError(QueryPipelineError):
+    """Raised when a validated query fails to run against the database."""
+    stage = "execution"
+
+
+class SummaryError(QueryPipelineError):
+    """Raised when the LLM fails to summarize a result."""
+    stage = "summary"
+
+
+class MemoryStoreError(QueryPipelineError):
+    """Raised when conversation memory cannot be persisted."""
+    stage = "memory"
+
+
+class UploadError(QueryPipelineError):
+    """Raised when an uploaded database is corrupt or cannot be prepared."""
+    stage = "upload"
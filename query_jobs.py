@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from query_errors import QueryPipelineError
+
+if TYPE_CHECKING:
+    # The pipeline pulls in sqlglot, so the UI only imports it when the job manager is built
+    from query_service import QueryService
+
+
+class QueryJob:
+    """Tracks a single natural language question processed in the background."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    def __init__(
+        self,
+        question: str,
+        db_name: str,
+        context: str = "",
+        max_rows: Optional[int] = None,
+        approximate: bool = False,
+        sql: Optional[str] = None,
+        engine: Optional[str] = None
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.question = question
+        self.db_name = db_name
+        self.context = context
+        self.max_rows = max_rows
+        self.approximate = approximate
+        # SQL to run instead of generating it (an exact re-run of an approximate answer)
+        self.requested_sql = sql
+        # Engine override for this question; outcome_engine is the one that answered
+        self.engine = engine
+        self.outcome_engine: Optional[str] = None
+        self.status = self.PENDING
+        self.stage: Optional[str] = None
+        self.sql: Optional[str] = None
+        self.execution_sql: Optional[str] = None
+        self.result: Optional[List[Dict]] = None
+        self.truncated = False
+        self.summary: Optional[str] = None
+        self.error: Optional[QueryPipelineError] = None
+        self.warnings: List[Dict] = []
+        self.rewrites: List[Dict] = []
+        self.optimizations: List[Dict] = []
+        self.timings: Dict[str, float] = {}
+        self.approximation: Optional[Dict] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the job has finished, successfully or not."""
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class QueryJobManager:
+    """Runs the NL-SQL pipeline on a bounded worker pool shared by all sessions."""
+
+    def __init__(
+        self,
+        service: Optional["QueryService"] = None,
+        max_workers: Optional[int] = None,
+        retention_seconds: int = 3600
+    ):
+        if service is None:
+            from query_service import QueryService
+            service = QueryService()
+        self.service = service
+        self.max_workers = max_workers or int(os.getenv("QUERY_WORKERS", "4"))
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="nlsql-query"
+        )
+        self._jobs: Dict[str, QueryJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        question: str,
+        db_name: str,
+        context: str = "",
+        max_rows: Optional[int] = None,
+        approximate: bool = False,
+        sql: Optional[str] = None,
+        engine: Optional[str] = None
+    ) -> QueryJob:
+        """
+        Queue a question for background processing.
+
+        Args:
+            question: User's natural language question
+            db_name: Name of the selected database (e.g., 'soil_pollution.db')
+            context: Recent interaction context from the session's memory
+            max_rows: Only fetch this many preview rows (fetch all if None)
+            approximate: Estimate aggregates over large tables from a sample
+            sql: Run this SQL instead of generating it
+            engine: 'sqlite', 'duckdb' or 'auto' to override QUERY_ENGINE
+
+        Returns:
+            The queued QueryJob, whose status can be polled via get()
+        """
+        job = QueryJob(question, db_name, context, max_rows, approximate, sql, engine)
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[QueryJob]:
+        """Look up a job by id, returning None if it is unknown or expired."""
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_count(self) -> int:
+        """Number of jobs that are queued or running."""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.done)
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than the retention window. Caller holds the lock."""
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.done and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self, job: QueryJob) -> None:
+        """Run the pipeline for a job, leaving memory updates to the submitting session."""
+        job.status = QueryJob.RUNNING
+
+        def on_stage(stage: str) -> None:
+            job.stage = stage
+
+        outcome = self.service.ask(
+            job.question,
+            job.db_name,
+            context=job.context,
+            remember=False,
+            on_stage=on_stage,
+            max_rows=job.max_rows,
+            approximate=job.approximate,
+            sql=job.requested_sql,
+            engine=job.engine
+        )
+        job.sql = outcome.sql
+        job.execution_sql = outcome.execution_sql
+        job.result = outcome.result
+        job.truncated = outcome.truncated
+        job.summary = outcome.summary
+        job.error = outcome.error
+        job.warnings = outcome.warnings
+        job.rewrites = outcome.rewrites
+        job.optimizations = outcome.optimizations
+        job.timings = outcome.timings
+        job.approximation = outcome.approximation
+        job.outcome_engine = outcome.engine
+        job.finished_at = time.time()
+        job.status = QueryJob.SUCCEEDED if outcome.ok else QueryJob.FAILED
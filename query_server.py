@@ -0,0 +1,155 @@
+import json
+import multiprocessing
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from query_engines import ENGINE_MODES
+from query_service import QueryService
+
+
+# HTTP status returned for each pipeline error stage
+ERROR_STATUS = {
+    "configuration": HTTPStatus.SERVICE_UNAVAILABLE,
+    "database": HTTPStatus.NOT_FOUND,
+    "schema": HTTPStatus.INTERNAL_SERVER_ERROR,
+    "generation": HTTPStatus.BAD_GATEWAY,
+    "validation": HTTPStatus.UNPROCESSABLE_ENTITY,
+    "execution": HTTPStatus.UNPROCESSABLE_ENTITY,
+    "summary": HTTPStatus.BAD_GATEWAY,
+    "memory": HTTPStatus.INTERNAL_SERVER_ERROR,
+}
+
+
+class QueryHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server that shares one QueryService between request threads."""
+
+    daemon_threads = True
+
+    def __init__(self, server_address, service: QueryService, max_inflight: int = 8, reuse_port: bool = False):
+        # Must be set before binding so several processes can share the port
+        self.allow_reuse_port = reuse_port
+        super().__init__(server_address, QueryRequestHandler)
+        self.service = service
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API for the NL-SQL pipeline.
+
+    GET  /health     -> {"status": "ok", "resources": {...shared component pool stats}}
+    GET  /databases  -> {"databases": [...]}
+    POST /query      -> {"question": "...", "database": "...", "summarize": true, "remember": true}
+    """
+
+    # HTTP/1.1 keeps client connections alive between requests
+    protocol_version = "HTTP/1.1"
+    server: QueryHTTPServer
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Optional[Dict]:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            return None
+        return payload if isinstance(payload, dict) else None
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(HTTPStatus.OK, {"status": "ok", "resources": self.server.service.resource_stats()})
+        elif self.path == "/databases":
+            self._send_json(HTTPStatus.OK, {"databases": self.server.service.list_databases()})
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path != "/query":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path: {self.path}"})
+            return
+
+        payload = self._read_json()
+        if payload is None or not payload.get("question") or not payload.get("database"):
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "Body must be JSON with 'question' and 'database'"})
+            return
+        database = payload["database"]
+        if not isinstance(database, str) or "/" in database or "\\" in database:
+            # Names are database file names from GET /databases, never paths
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "'database' must be a database name from /databases"})
+            return
+        candidates = payload.get("candidates")
+        if candidates is not None and (type(candidates) is not int or candidates < 1):
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "'candidates' must be a positive integer"})
+            return
+        engine = payload.get("engine")
+        if engine is not None and engine not in ENGINE_MODES:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": f"'engine' must be one of {', '.join(ENGINE_MODES)}"})
+            return
+
+        with self.server.inflight:
+            outcome = self.server.service.ask(
+                payload["question"],
+                database,
+                context=payload.get("context"),
+                summarize=bool(payload.get("summarize", True)),
+                remember=bool(payload.get("remember", True)),
+                candidates=candidates,
+                candidate_mode="consensus" if payload.get("consensus") else None,
+                approximate=bool(payload.get("approximate", False)),
+                engine=engine
+            )
+
+        status = HTTPStatus.OK
+        if outcome.error is not None:
+            status = ERROR_STATUS.get(outcome.error.stage, HTTPStatus.INTERNAL_SERVER_ERROR)
+        self._send_json(status, outcome.to_dict())
+
+
+def _serve_forever(host: str, port: int, db_dir: str, max_inflight: int, reuse_port: bool) -> None:
+    """Run one server process until interrupted."""
+    server = QueryHTTPServer((host, port), QueryService(db_dir), max_inflight, reuse_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, db_dir: str = "db", processes: int = 1, max_inflight: int = 8) -> None:
+    """
+    Serve the query API over HTTP.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind
+        db_dir: Directory holding the SQLite databases
+        processes: Number of server processes sharing the port (uses SO_REUSEPORT when > 1)
+        max_inflight: Maximum concurrent pipeline runs per process
+    """
+    print(f"Serving NL-SQL API on http://{host}:{port} with {processes} process(es)")
+    if processes <= 1:
+        _serve_forever(host, port, db_dir, max_inflight, reuse_port=False)
+        return
+
+    workers = [
+        multiprocessing.Process(target=_serve_forever, args=(host, port, db_dir, max_inflight, True))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
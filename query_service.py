@@ -0,0 +1,381 @@
+import os
+import threading
+import time
+from contextlib import ExitStack, nullcontext
+from typing import Callable, Dict, List, Optional
+
+from aggregate_cache import AggregateCache, AggregateShape
+from databse_manager import DatabaseManager, federation_members, is_federation
+from gemini_class import GeminiAssistant
+from memory_management import MemoryManager
+from query_engines import EngineRouter
+from query_errors import DatabaseNotFoundError, QueryPipelineError, SummaryError, ValidationError
+from sample_cache import CONFIDENCE_LEVEL, SampleCache
+from shared_resources import SHARED_MAX_IDLE, SharedResourcePool
+from sql_candidates import CANDIDATE_COUNT, CANDIDATE_MODE, CandidateSelector
+from sql_optimizer import OPTIMIZER_ENABLED, QueryOptimizer
+from sql_validation import SQLValidator
+from value_index import ValueIndex
+from workload_log import WORKLOAD_LOG_ENABLED, WorkloadLog
+
+
+class QueryOutcome:
+    """Result of running one question through the NL-SQL pipeline."""
+
+    def __init__(self, question: str, database: str):
+        self.question = question
+        self.database = database
+        self.sql: Optional[str] = None
+        # SQL actually run, when it differs from sql (e.g., rewritten to read a summary table)
+        self.execution_sql: Optional[str] = None
+        self.result: Optional[List[Dict]] = None
+        self.truncated = False
+        self.summary: Optional[str] = None
+        self.error: Optional[QueryPipelineError] = None
+        self.warnings: List[Dict] = []
+        self.rewrites: List[Dict] = []
+        # Plan-cost-checked optimizations applied to the validated SQL
+        self.optimizations: List[Dict] = []
+        self.timings: Dict[str, float] = {}
+        # Estimated tokens of the SQL prompt's cacheable prefix and per-request suffix
+        self.prompt_tokens: Dict[str, int] = {}
+        # Speculative SQL candidates, in arrival order (empty for single generation)
+        self.candidates: List[Dict] = []
+        # Sample, confidence level and per-row interval half-widths, when the result is an estimate
+        self.approximation: Optional[Dict] = None
+        # Engine that produced the result ('sqlite' or 'duckdb')
+        self.engine: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the question was answered without errors."""
+        return self.error is None
+
+    def to_dict(self) -> Dict:
+        """Serialize the outcome for JSON responses and batch output."""
+        return {
+            "question": self.question,
+            "database": self.database,
+            "ok": self.ok,
+            "sql": self.sql,
+            "execution_sql": self.execution_sql,
+            "result": self.result,
+            "row_count": len(self.result) if self.result is not None else None,
+            "truncated": self.truncated,
+            "summary": self.summary,
+            "error": self.error.to_dict() if self.error else None,
+            "warnings": self.warnings,
+            "rewrites": self.rewrites,
+            "optimizations": self.optimizations,
+            "timings_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.timings.items()},
+            "prompt_tokens": self.prompt_tokens,
+            "candidates": self.candidates,
+            "approximation": self.approximation,
+            "engine": self.engine
+        }
+
+
+class _DatabaseComponents:
+    """Pipeline components bound to a single database, shared by every caller that uses it."""
+
+    def __init__(self, db_dir: str, db_name: str):
+        self.db_dir = db_dir
+        self.db_name = db_name
+        self.db_manager = DatabaseManager.for_database(db_name, db_dir)
+        self.assistant = GeminiAssistant()
+        self.assistant.set_database(db_name)
+        self.memory_manager = MemoryManager(MemoryManager.get_memory_file_for_db(db_name))
+        self._validator: Optional[SQLValidator] = None
+        self._validator_lock = threading.Lock()
+        self._value_index: Optional[ValueIndex] = None
+        self._value_index_lock = threading.Lock()
+        self.schema = self.db_manager.get_schema()
+        # Summary tables live inside a single database file, so federations go without
+        self.aggregates = None if is_federation(db_name) else AggregateCache(self.db_manager)
+        if self.aggregates is not None:
+            self.aggregates.sync_in_background(self.memory_manager.memory_file)
+        self.samples = None if is_federation(db_name) else SampleCache(self.db_manager)
+        self.optimizer = QueryOptimizer(self.db_manager)
+        self.engines = EngineRouter(self.db_manager, db_name)
+        self.workload = WorkloadLog(db_name, self.optimizer)
+        # Warm the validator off the caller's thread so the first question does not pay for it
+        threading.Thread(target=lambda: self.validator, name=f"nlsql-validator-{db_name}", daemon=True).start()
+
+    @property
+    def validator(self) -> SQLValidator:
+        # Reflected through SQLAlchemy on the first validation, so browsing a database stays cheap
+        with self._validator_lock:
+            if self._validator is None:
+                self._validator = SQLValidator(db_path=self.db_manager.db_path, attached=self.db_manager.attached)
+            return self._validator
+
+    @property
+    def value_index(self) -> ValueIndex:
+        # Built (or loaded from cache) on first use and kept until these components are invalidated,
+        # so questions do not recompute the data fingerprint
+        with self._value_index_lock:
+            if self._value_index is None:
+                self._value_index = ValueIndex.for_database(self.db_name, self.db_dir)
+            return self._value_index
+
+
+class QueryService:
+    """
+    UI-free NL-SQL pipeline: generate, validate, execute and summarize.
+
+    Components are built once per database and reused across calls, so a
+    single service instance can be shared by threads of a server or CLI (and
+    by every Streamlit session). Databases in use are never evicted; at most
+    max_idle idle databases keep their components.
+    """
+
+    STAGES = ("generation", "validation", "execution", "summary")
+
+    def __init__(
+        self,
+        db_dir: str = "db",
+        llm_concurrency: Optional[int] = None,
+        db_concurrency: Optional[int] = None,
+        max_idle: int = SHARED_MAX_IDLE,
+        log_workload: bool = WORKLOAD_LOG_ENABLED
+    ):
+        """
+        Args:
+            db_dir: Directory holding the SQLite databases
+            llm_concurrency: Maximum concurrent Gemini calls (unbounded if None)
+            db_concurrency: Maximum concurrent validation/execution runs (unbounded if None)
+            max_idle: Idle databases whose components are kept (SHARED_MAX_IDLE if not given)
+            log_workload: Record every executed query in its database's workload log
+        """
+        self.db_dir = db_dir
+        self.log_workload = log_workload
+        self._components: SharedResourcePool[_DatabaseComponents] = SharedResourcePool(self._build_components, max_idle)
+        self._lock = threading.Lock()
+        self._llm_slots = threading.BoundedSemaphore(llm_concurrency) if llm_concurrency else nullcontext()
+        self._db_slots = threading.BoundedSemaphore(db_concurrency) if db_concurrency else nullcontext()
+        self._candidate_selector: Optional[CandidateSelector] = None
+
+    @property
+    def candidate_selector(self) -> CandidateSelector:
+        """Worker pool for speculative SQL generation, created on first use."""
+        with self._lock:
+            if self._candidate_selector is None:
+                self._candidate_selector = CandidateSelector(self._llm_slots, self._db_slots)
+            return self._candidate_selector
+
+    def list_databases(self) -> List[str]:
+        """List database files available to the service."""
+        if not os.path.exists(self.db_dir):
+            return []
+        return sorted(
+            file for file in os.listdir(self.db_dir)
+            if file.endswith(('.db', '.sqlite', '.sqlite3'))
+        )
+
+    def _build_components(self, db_name: str) -> _DatabaseComponents:
+        """Build the components for a database (called once per database by the pool)."""
+        available = set(self.list_databases())
+        for member in federation_members(db_name):
+            # Only bare file names listed in db_dir, so a name like '../x.db' or '/tmp/x.db' cannot escape it
+            if member not in available:
+                raise DatabaseNotFoundError(f"Database not found: {member}")
+        return _DatabaseComponents(self.db_dir, db_name)
+
+    def components(self, db_name: str) -> _DatabaseComponents:
+        """
+        Shared components (schema, memory, database manager, ...) for a database.
+
+        Raises:
+            DatabaseNotFoundError: If the database (or a federation member) is not one of list_databases().
+        """
+        return self._components.get(db_name)
+
+    def invalidate(self, db_name: Optional[str] = None) -> None:
+        """Drop cached components for a database (or all databases) after it changes."""
+        self._components.invalidate(db_name)
+
+    def resource_stats(self) -> Dict:
+        """Shared component pool size, active leases and hit/miss/eviction counts."""
+        return self._components.stats()
+
+    def sync_aggregates(self, db_name: str, sql: Optional[str] = None) -> None:
+        """
+        Materialize newly frequent GROUP BY shapes from a database's memory in the background.
+
+        Args:
+            db_name: Database whose memory changed
+            sql: Query just remembered; nothing is done unless it has a summarizable shape
+        """
+        if sql is not None and AggregateShape.from_sql(sql) is None:
+            return
+        components = self.components(db_name)
+        if components.aggregates is not None:
+            components.aggregates.sync_in_background(components.memory_manager.memory_file)
+
+    def ask(
+        self,
+        question: str,
+        db_name: str,
+        context: Optional[str] = None,
+        summarize: bool = True,
+        remember: bool = True,
+        on_stage: Optional[Callable[[str], None]] = None,
+        max_rows: Optional[int] = None,
+        candidates: Optional[int] = None,
+        candidate_mode: Optional[str] = None,
+        approximate: bool = False,
+        sql: Optional[str] = None,
+        engine: Optional[str] = None
+    ) -> QueryOutcome:
+        """
+        Answer a natural language question against a database.
+
+        Args:
+            question: User's natural language question
+            db_name: Database file name inside db_dir (e.g., 'soil_pollution.db'), or a
+                federation name joining several (e.g., 'air_pollution.db+soil_pollution.db')
+            context: Conversation context; defaults to the database's recent memory
+            summarize: Whether to generate a natural language summary
+            remember: Whether to store the interaction in the database's memory
+            on_stage: Optional callback invoked with each stage name as it starts
+            max_rows: Only fetch this many rows; outcome.truncated tells if more exist
+            candidates: Generate this many SQL candidates concurrently (SQL_CANDIDATES if None)
+            candidate_mode: 'first' (first valid candidate wins) or 'consensus' (SQL_CANDIDATE_MODE if None)
+            approximate: Estimate aggregates over large tables from a random sample, with
+                confidence intervals in outcome.approximation; other queries still run exactly
+            sql: Run this SQL instead of generating it (e.g., an exact re-run of an approximate
+                answer); it is still validated
+            engine: 'sqlite', 'duckdb' or 'auto' to override QUERY_ENGINE for this question
+
+        Returns:
+            QueryOutcome with the SQL, rows, summary, timings and any structured error.
+            Pipeline failures are reported on the outcome rather than raised.
+        """
+        outcome = QueryOutcome(question, db_name)
+        stage = None
+
+        def start(name: str) -> float:
+            nonlocal stage
+            stage = name
+            if on_stage:
+                on_stage(name)
+            return time.perf_counter()
+
+        leases = ExitStack()
+        components = None
+        try:
+            # Leased for the whole run so the database's components cannot be evicted mid-question
+            components = leases.enter_context(self._components.lease(db_name))
+            if context is None:
+                context = components.memory_manager.get_recent_context(3)
+
+            candidates = CANDIDATE_COUNT if candidates is None else candidates
+            if sql is None:
+                prompt = components.assistant.build_sql_prompt(components.schema, question, context)
+                outcome.prompt_tokens = {"prefix": prompt.prefix_tokens, "suffix": prompt.suffix_tokens}
+            if sql is None and candidates > 1:
+                # Candidates are grounded and validated as they arrive
+                started = start("generation")
+                selection = self.candidate_selector.select(
+                    components, prompt, candidates, candidate_mode or CANDIDATE_MODE
+                )
+                outcome.timings["generation"] = time.perf_counter() - started
+                outcome.candidates = [candidate.to_dict() for candidate in selection.candidates]
+                if selection.winner is None:
+                    raise selection.failure()
+                outcome.sql, outcome.rewrites = selection.winner.sql, selection.winner.rewrites
+            else:
+                if sql is not None:
+                    outcome.sql = sql
+                else:
+                    with self._llm_slots:
+                        started = start("generation")
+                        outcome.sql = components.assistant.generate_sql(prompt)
+                        outcome.timings["generation"] = time.perf_counter() - started
+
+                    # Match literals against the database's actual values instead of returning zero rows
+                    started = time.perf_counter()
+                    outcome.sql, outcome.rewrites = components.value_index.ground_sql(outcome.sql)
+                    outcome.timings["grounding"] = time.perf_counter() - started
+
+                with self._db_slots:
+                    started = start("validation")
+                    is_valid, message = components.validator.validate(outcome.sql)
+                    outcome.timings["validation"] = time.perf_counter() - started
+                    if not is_valid:
+                        raise ValidationError(f"SQL Safety Error: {message}", sql=outcome.sql)
+
+            with self._db_slots:
+                if OPTIMIZER_ENABLED:
+                    # Rewrites are only kept when SQLite's plan for them is no more expensive
+                    started = time.perf_counter()
+                    optimized = components.optimizer.optimize(outcome.sql)
+                    outcome.sql, outcome.optimizations = optimized.sql, optimized.applied
+                    outcome.timings["optimization"] = time.perf_counter() - started
+
+                started = start("execution")
+                if components.aggregates is not None:
+                    outcome.execution_sql = components.aggregates.rewrite(outcome.sql)
+                estimate = None
+                # A summary table already answers exactly, so only unsummarized queries are estimated
+                if approximate and outcome.execution_sql is None and components.samples is not None:
+                    estimate = components.samples.rewrite(outcome.sql)
+                if estimate is not None:
+                    outcome.execution_sql = estimate.sql
+                    execution_sql = estimate.estimate_sql
+                else:
+                    execution_sql = outcome.execution_sql or outcome.sql
+                # The SQL stays in SQLite's dialect; a columnar engine transpiles it itself
+                rows, outcome.engine, fallback = components.engines.execute(
+                    execution_sql, None if max_rows is None else max_rows + 1, engine
+                )
+                if fallback is not None:
+                    outcome.warnings.append(fallback.to_dict())
+                if max_rows is None:
+                    outcome.result = rows
+                else:
+                    outcome.truncated = len(rows) > max_rows
+                    outcome.result = rows[:max_rows]
+                if estimate is not None:
+                    outcome.result, intervals = estimate.finish(outcome.result)
+                    outcome.approximation = {
+                        **estimate.sample.to_dict(), "confidence": CONFIDENCE_LEVEL, "intervals": intervals
+                    }
+                outcome.timings["execution"] = time.perf_counter() - started
+
+            if not outcome.result:
+                outcome.summary = "No data found for the given query."
+            elif summarize:
+                with self._llm_slots:
+                    started = start("summary")
+                    try:
+                        outcome.summary = components.assistant.generate_summary(question, outcome.result, context)
+                    except SummaryError as e:
+                        outcome.summary = "Unable to generate summary."
+                        outcome.warnings.append(e.to_dict())
+                    outcome.timings["summary"] = time.perf_counter() - started
+
+            if remember:
+                components.memory_manager.add(
+                    question, outcome.sql, outcome.result, outcome.summary,
+                    timings=outcome.timings, truncated=outcome.truncated,
+                    approximate=outcome.approximation is not None
+                )
+                # A repeated GROUP BY shape may now be worth a summary table
+                self.sync_aggregates(db_name, outcome.sql)
+        except QueryPipelineError as e:
+            if e.sql is None:
+                e.sql = outcome.sql
+            outcome.error = e
+        except Exception as e:
+            outcome.error = QueryPipelineError(f"Unexpected error during {stage or 'setup'}: {e}", sql=outcome.sql)
+        finally:
+            if self.log_workload and components is not None:
+                try:
+                    components.workload.record(outcome, components.schema)
+                except OSError:
+                    # The log is diagnostic; failing to write it never fails a question
+                    pass
+            leases.close()
+
+        return outcome
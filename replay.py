@@ -0,0 +1,275 @@
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from latency_stats import percentile
+from memory_management import MemoryManager
+from query_service import QueryService
+
+
+# Stages reported in latency comparisons, in pipeline order
+REPLAY_STAGES = ("generation", "grounding", "validation", "optimization", "execution")
+# Relative slowdown of a stage's median that is flagged as a regression
+LATENCY_REGRESSION_RATIO = float(os.getenv("REPLAY_REGRESSION_RATIO", "0.2"))
+# ...as long as it is also this much slower in absolute terms (sub-millisecond stages are mostly noise)
+LATENCY_REGRESSION_MIN_MS = float(os.getenv("REPLAY_REGRESSION_MIN_MS", "1.0"))
+
+
+def _normalize_rows(rows: List[Dict]) -> List[str]:
+    """Rows as comparable strings, with floats rounded so storage round-trips do not count as drift."""
+    normalized = []
+    for row in rows:
+        values = [round(value, 9) if isinstance(value, float) else value for value in row.values()]
+        normalized.append(json.dumps([list(row.keys()), values], default=str))
+    return normalized
+
+
+def compare_results(stored: List[Dict], current: List[Dict], ordered: bool, stored_truncated: Optional[bool]) -> Optional[str]:
+    """
+    Compare a replayed result with the one stored in memory.
+
+    Args:
+        stored: Rows recorded in memory (possibly only a preview)
+        current: Rows returned now (at most one more row than stored)
+        ordered: Whether row order is significant (the query has ORDER BY)
+        stored_truncated: Whether stored was a preview of a longer result (None if unknown)
+
+    Returns:
+        None if the results agree, otherwise a short description of the drift
+    """
+    if len(current) < len(stored):
+        return f"row count dropped from {len(stored)} to {len(current)}"
+    # current holds one row more than stored when the result goes on past it
+    complete = len(current) <= len(stored)
+    if stored_truncated is False and not complete:
+        return f"row count grew beyond the recorded {len(stored)}"
+
+    expected = _normalize_rows(stored)
+    actual = _normalize_rows(current[:len(stored)])
+    if ordered or not complete:
+        # A preview is a prefix, so only an ordered comparison is meaningful
+        if expected != actual:
+            index = next(i for i, (a, b) in enumerate(zip(expected, actual)) if a != b)
+            return f"rows differ from row {index + 1}"
+        return None
+    if sorted(expected) != sorted(actual):
+        return "rows differ"
+    return None
+
+
+class RecordedAssistant:
+    """
+    Stand-in for GeminiAssistant that answers with recorded SQL instead of calling Gemini.
+
+    Everything except generation (prompt building, prompts, summaries) is
+    delegated to the real assistant, so replays still exercise it.
+    """
+
+    def __init__(self, assistant, responses: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            assistant: The real assistant to delegate to
+            responses: Stubbed SQL by question, overriding what memory recorded
+        """
+        self._assistant = assistant
+        self.responses = responses or {}
+        self.next_sql: Optional[str] = None
+        self.next_question: Optional[str] = None
+
+    def __getattr__(self, name):
+        return getattr(self._assistant, name)
+
+    def generate_sql(self, prompt: str, temperature: Optional[float] = None) -> str:
+        return self.responses.get(self.next_question, self.next_sql)
+
+
+def load_responses(path: str) -> Dict[str, str]:
+    """Load stubbed LLM responses: a JSON object of question -> SQL, or JSONL with question and sql fields."""
+    with open(path) as f:
+        text = f.read()
+    try:
+        payload = json.loads(text)
+        if isinstance(payload, dict):
+            return payload
+    except json.JSONDecodeError:
+        pass
+    responses = {}
+    for line in text.splitlines():
+        if line.strip():
+            record = json.loads(line)
+            responses[record["question"]] = record["sql"]
+    return responses
+
+
+class ReplayHarness:
+    """
+    Re-runs interactions recorded in a database's memory against the current code.
+
+    Each recorded question goes through the full pipeline (prompt building,
+    grounding, validation, summary-table rewrite, execution). With the
+    'recorded' LLM the stored SQL stands in for Gemini, so replays are
+    offline and deterministic; with 'live' the SQL is regenerated. Results
+    are compared with the stored ones and per-stage latencies with a
+    baseline (a previous replay report, else timings recorded in memory).
+    """
+
+    def __init__(self, db_dir: str = "db", llm: str = "recorded", responses: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            db_dir: Directory holding the SQLite databases
+            llm: 'recorded' (stored or stubbed SQL) or 'live' (regenerate with Gemini)
+            responses: Stubbed SQL by question for the recorded LLM
+        """
+        if llm not in ("recorded", "live"):
+            raise ValueError(f"Unknown LLM mode: {llm}")
+        self.db_dir = db_dir
+        self.llm = llm
+        self.responses = responses or {}
+        # A private service, so swapping in the recorded assistant affects no one else; replayed
+        # questions are not new workload, so they stay out of the workload log
+        self.service = QueryService(db_dir, log_workload=False)
+
+    def _assistant_for(self, db_name: str) -> Optional[RecordedAssistant]:
+        if self.llm != "recorded":
+            return None
+        components = self.service.components(db_name)
+        if not isinstance(components.assistant, RecordedAssistant):
+            components.assistant = RecordedAssistant(components.assistant, self.responses)
+        return components.assistant
+
+    def replay_entry(self, db_name: str, entry: Dict, context: str = "") -> Dict:
+        """Replay one memory entry and compare it with what was recorded."""
+        assistant = self._assistant_for(db_name)
+        if assistant is not None:
+            assistant.next_sql, assistant.next_question = entry.get("sql"), entry.get("question")
+
+        stored = entry.get("result") or []
+        started = time.perf_counter()
+        outcome = self.service.ask(
+            entry["question"],
+            db_name,
+            context=context,
+            summarize=False,
+            remember=False,
+            # One extra row tells whether the result grew past the recorded rows
+            max_rows=len(stored) + 1
+        )
+        record = {
+            "question": entry["question"],
+            "sql": outcome.sql,
+            "recorded_sql": entry.get("sql"),
+            "timings_ms": {stage: round(seconds * 1000, 3) for stage, seconds in outcome.timings.items()},
+            "total_ms": round((time.perf_counter() - started) * 1000, 3),
+            "rewritten": outcome.execution_sql is not None,
+            "engine": outcome.engine,
+        }
+        if outcome.error is not None:
+            record["status"] = "error"
+            record["error"] = outcome.error.to_dict()
+            return record
+
+        ordered = "order by" in (outcome.execution_sql or outcome.sql or "").lower()
+        drift = compare_results(stored, outcome.result or [], ordered, entry.get("truncated"))
+        record["status"] = "drift" if drift else "match"
+        if drift:
+            record["drift"] = drift
+        return record
+
+    def replay(
+        self,
+        db_name: str,
+        limit: Optional[int] = None,
+        repeat: int = 1,
+        baseline: Optional[Dict] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None
+    ) -> Dict:
+        """
+        Replay a database's recorded interactions.
+
+        Args:
+            db_name: Database (or federation) whose memory is replayed
+            limit: Only replay the most recent entries
+            repeat: Replay the set this many times; correctness comes from the first pass,
+                latencies from all of them
+            baseline: A previous replay report to compare latencies with
+            on_progress: Optional callback invoked with (done, total)
+
+        Returns:
+            Report with per-entry status, drift and error counts, and per-stage latency changes
+
+        Raises:
+            DatabaseNotFoundError: If the database does not exist.
+        """
+        memory = list(self.service.components(db_name).memory_manager.memory)
+        # Estimated results cannot be compared with an exact replay
+        indexed = [
+            (index, entry) for index, entry in enumerate(memory)
+            if entry.get("sql") and not entry.get("approximate")
+        ]
+        if limit:
+            indexed = indexed[-limit:]
+
+        # Build (and warm) the database's components first, so the first entry's latency is not a cold start
+        self.service.components(db_name).validator
+
+        entries: List[Dict] = []
+        stage_samples: Dict[str, List[float]] = {}
+        total = len(indexed) * repeat
+        for run in range(repeat):
+            for position, (index, entry) in enumerate(indexed):
+                # The context the question originally had: the turns recorded before it
+                context = MemoryManager.format_context(memory[max(index - 3, 0):index])
+                record = self.replay_entry(db_name, entry, context)
+                for stage, ms in record["timings_ms"].items():
+                    stage_samples.setdefault(stage, []).append(ms)
+                if run == 0:
+                    entries.append(record)
+                if on_progress:
+                    on_progress(run * len(indexed) + position + 1, total)
+
+        return {
+            "database": db_name,
+            "llm": self.llm,
+            "entries": len(entries),
+            "repeat": repeat,
+            "matched": sum(1 for record in entries if record["status"] == "match"),
+            "drifted": sum(1 for record in entries if record["status"] == "drift"),
+            "failed": sum(1 for record in entries if record["status"] == "error"),
+            "rewritten": sum(1 for record in entries if record["rewritten"]),
+            "stages": self._compare_stages(stage_samples, self._baseline_samples(baseline, [e for _, e in indexed])),
+            "results": entries,
+        }
+
+    @staticmethod
+    def _baseline_samples(baseline: Optional[Dict], recorded: List[Dict]) -> Dict[str, List[float]]:
+        """Per-stage latency samples to compare against: a previous report's, else those stored in memory."""
+        samples: Dict[str, List[float]] = {}
+        if baseline is not None:
+            sources = [record.get("timings_ms", {}) for record in baseline.get("results", [])]
+        else:
+            sources = [entry.get("timings_ms", {}) for entry in recorded]
+        for timings in sources:
+            for stage, ms in timings.items():
+                samples.setdefault(stage, []).append(ms)
+        return samples
+
+    @staticmethod
+    def _compare_stages(current: Dict[str, List[float]], baseline: Dict[str, List[float]]) -> Dict[str, Dict]:
+        stages = {}
+        for stage in [*REPLAY_STAGES, *sorted(set(current) - set(REPLAY_STAGES))]:
+            if stage not in current:
+                continue
+            p50, p95 = percentile(current[stage], 50), percentile(current[stage], 95)
+            summary = {"p50_ms": p50, "p95_ms": p95, "samples": len(current[stage])}
+            baseline_p50 = percentile(baseline.get(stage, []), 50)
+            if baseline_p50:
+                change = (p50 - baseline_p50) / baseline_p50
+                summary.update({
+                    "baseline_p50_ms": baseline_p50,
+                    "baseline_p95_ms": percentile(baseline[stage], 95),
+                    "p50_change_pct": round(change * 100, 1),
+                    "regressed": change > LATENCY_REGRESSION_RATIO and p50 - baseline_p50 > LATENCY_REGRESSION_MIN_MS,
+                })
+            stages[stage] = summary
+        return stages
@@ -0,0 +1,223 @@
+import csv
+import json
+import os
+import pickle
+import sqlite3
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from databse_manager import connect_database
+from query_errors import ExecutionError
+
+
+# Format name -> (MIME type, file extension)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("text/csv", ".csv"),
+    "jsonl": ("application/x-ndjson", ".jsonl"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+DEFAULT_CHUNK_SIZE = 5000
+# Exports (and partial files left by crashed exports) older than this many seconds are deleted
+EXPORT_MAX_AGE = int(os.getenv("EXPORT_MAX_AGE", "86400"))
+
+
+def _open_cursor(db_path: str, sql: str, attached: Optional[Dict[str, str]]) -> Tuple[sqlite3.Connection, sqlite3.Cursor]:
+    """Open a read-only connection and start streaming a query."""
+    conn = connect_database(db_path, attached, read_only=True)
+    try:
+        cursor = conn.execute(sql)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn, cursor
+
+
+def _write_csv(cursor: sqlite3.Cursor, columns: List[str], path: str, chunk_size: int) -> int:
+    rows_written = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            writer.writerows(chunk)
+            rows_written += len(chunk)
+    return rows_written
+
+
+def _write_jsonl(cursor: sqlite3.Cursor, columns: List[str], path: str, chunk_size: int) -> int:
+    rows_written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            f.writelines(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in chunk)
+            rows_written += len(chunk)
+    return rows_written
+
+
+def _parquet_type(pa, seen: set):
+    """Narrowest Arrow type holding every Python type a column produced; NULL-only columns are strings."""
+    seen = seen - {type(None)}
+    if seen == {int}:
+        return pa.int64()
+    if seen and seen <= {int, float}:
+        return pa.float64()
+    if seen == {bytes}:
+        return pa.binary()
+    return pa.string()
+
+
+def _parquet_values(values, arrow_type, pa) -> List:
+    """Convert a column's values to what its promoted type expects (ints to floats, anything to text)."""
+    if pa.types.is_float64(arrow_type):
+        return [None if value is None else float(value) for value in values]
+    if pa.types.is_string(arrow_type):
+        return [value if value is None or isinstance(value, str) else str(value) for value in values]
+    return list(values)
+
+
+def _write_parquet(cursor: sqlite3.Cursor, columns: List[str], path: str, chunk_size: int, compression: str) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ExecutionError("Parquet export requires pyarrow (pip install pyarrow)") from e
+
+    # SQLite columns can change type between rows, but a Parquet file has one schema.
+    # Chunks are spooled to disk while their types are tallied, then written with the
+    # promoted types (int + real -> double, anything with text -> string)
+    seen = [set() for _ in columns]
+    spool_path = f"{path}.spool"
+    try:
+        with open(spool_path, "wb") as spool:
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                for column_types, values in zip(seen, zip(*chunk)):
+                    column_types.update(map(type, values))
+                pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+
+        schema = pa.schema([pa.field(name, _parquet_type(pa, types)) for name, types in zip(columns, seen)])
+        rows_written = 0
+        with pq.ParquetWriter(path, schema, compression=compression) as writer, open(spool_path, "rb") as spool:
+            while True:
+                try:
+                    chunk = pickle.load(spool)
+                except EOFError:
+                    break
+                arrays = [
+                    pa.array(_parquet_values(values, field.type, pa), type=field.type)
+                    for values, field in zip(zip(*chunk), schema)
+                ]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                rows_written += len(chunk)
+        return rows_written
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def export_query(
+    db_path: str,
+    sql: str,
+    output_path: str,
+    fmt: str = "csv",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compression: str = "zstd",
+    attached: Optional[Dict[str, str]] = None
+) -> int:
+    """
+    Stream a query's full result from SQLite straight to a file.
+
+    Rows are fetched from the cursor in chunks, so the result is never held in
+    memory. The file is written next to output_path and moved into place once
+    complete.
+
+    Args:
+        db_path: Path of the SQLite database
+        sql: SELECT query to export
+        output_path: Destination file
+        fmt: One of 'csv', 'jsonl' or 'parquet'
+        chunk_size: Rows fetched per round trip
+        compression: Parquet compression codec
+        attached: Federated databases to ATTACH (see DatabaseManager.attached)
+
+    Returns:
+        Number of rows written
+
+    Raises:
+        ExecutionError: If the query fails or the format is unsupported
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ExecutionError(f"Unsupported export format: {fmt}", sql=sql)
+
+    try:
+        conn, cursor = _open_cursor(db_path, sql, attached)
+    except sqlite3.Error as e:
+        raise ExecutionError(f"Database error: {e}", sql=sql) from e
+
+    partial_path = f"{output_path}.part"
+    try:
+        columns = [description[0] for description in cursor.description]
+        if fmt == "csv":
+            rows_written = _write_csv(cursor, columns, partial_path, chunk_size)
+        elif fmt == "jsonl":
+            rows_written = _write_jsonl(cursor, columns, partial_path, chunk_size)
+        else:
+            rows_written = _write_parquet(cursor, columns, partial_path, chunk_size, compression)
+        os.replace(partial_path, output_path)
+        return rows_written
+    except sqlite3.Error as e:
+        raise ExecutionError(f"Database error: {e}", sql=sql) from e
+    finally:
+        conn.close()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def prune_exports(export_dir: str, max_age: int = EXPORT_MAX_AGE) -> List[str]:
+    """
+    Delete exports in export_dir last written more than max_age seconds ago.
+
+    Only files with an export extension (or a partial export) are touched.
+
+    Returns:
+        Names of the deleted files
+    """
+    if not os.path.isdir(export_dir):
+        return []
+    extensions = tuple(extension for _, extension in EXPORT_FORMATS.values())
+    cutoff = time.time() - max_age
+    deleted = []
+    for name in os.listdir(export_dir):
+        if not name.removesuffix(".spool").removesuffix(".part").endswith(extensions):
+            continue
+        path = os.path.join(export_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                deleted.append(name)
+        except OSError:
+            # Deleted by another session meanwhile
+            continue
+    return deleted
+
+
+def export_path_for(export_dir: str, fmt: str, stem: Optional[str] = None) -> str:
+    """
+    Build a unique output path in export_dir with the right extension for fmt.
+
+    export_dir is shared by every session, so the stem gets a random suffix;
+    two exports started in the same second never write to the same file.
+    Old exports are pruned first, so the directory does not grow without limit.
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    prune_exports(export_dir)
+    _, extension = EXPORT_FORMATS[fmt]
+    return os.path.join(export_dir, f"{stem or 'query_results'}_{uuid.uuid4().hex[:8]}{extension}")
@@ -0,0 +1,90 @@
+import math
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from databse_manager import DatabaseManager
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+DEFAULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "100"))
+
+
+class ResultView:
+    """
+    Cached, page-by-page view over one query's result.
+
+    The first page comes from the pipeline's preview rows; later pages are
+    fetched from the database on demand and kept as DataFrames, so reruns
+    that revisit a page do not touch the database or rebuild the frame.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        db_dir: str,
+        sql: str,
+        first_rows: List[Dict],
+        truncated: bool,
+        page_size: int = DEFAULT_PAGE_SIZE
+    ):
+        self.db_name = db_name
+        self.db_dir = db_dir
+        self.sql = sql
+        self.page_size = page_size
+        self._pages: Dict[int, "pd.DataFrame"] = {}
+        self._total_rows: Optional[int] = None if truncated else len(first_rows)
+        self._db_manager: Optional[DatabaseManager] = None
+
+        # Split the preview into cached pages (pandas is imported with the first result, not at startup)
+        import pandas as pd
+        for start in range(0, len(first_rows), page_size):
+            self._pages[start // page_size] = pd.DataFrame(first_rows[start:start + page_size])
+
+    @property
+    def db_manager(self) -> DatabaseManager:
+        if self._db_manager is None:
+            self._db_manager = DatabaseManager.for_database(self.db_name, self.db_dir)
+        return self._db_manager
+
+    def matches(self, db_name: str, sql: str) -> bool:
+        """Whether this view belongs to the given query."""
+        return self.db_name == db_name and self.sql == sql
+
+    @property
+    def total_rows(self) -> Optional[int]:
+        """Total row count, or None if it has not been counted yet."""
+        return self._total_rows
+
+    def count_rows(self) -> int:
+        """Count the full result once and cache it."""
+        if self._total_rows is None:
+            self._total_rows = self.db_manager.count_rows(self.sql)
+        return self._total_rows
+
+    @property
+    def page_count(self) -> Optional[int]:
+        """Number of pages, if the total row count is known."""
+        if self._total_rows is None:
+            return None
+        return max(1, math.ceil(self._total_rows / self.page_size))
+
+    def get_page(self, page: int) -> "pd.DataFrame":
+        """Return a page (0-based), fetching it from the database on first access."""
+        if page not in self._pages:
+            rows = self.db_manager.fetch_page(self.sql, page * self.page_size, self.page_size)
+            if len(rows) < self.page_size and self._total_rows is None:
+                # A short page is the last one, so the total is now known
+                self._total_rows = page * self.page_size + len(rows)
+            import pandas as pd
+            self._pages[page] = pd.DataFrame(rows)
+        return self._pages[page]
+
+    def has_next_page(self, page: int) -> bool:
+        """Whether rows exist after the given page (may prefetch the next page)."""
+        if self.page_count is not None:
+            return page + 1 < self.page_count
+        if len(self.get_page(page)) < self.page_size:
+            return False
+        return not self.get_page(page + 1).empty
@@ -0,0 +1,374 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from databse_manager import INTERNAL_TABLE_PREFIX, DatabaseManager, is_internal_table
+from query_errors import QueryPipelineError
+
+
+SAMPLE_TABLE_PREFIX = f"{INTERNAL_TABLE_PREFIX}sample_"
+CATALOG_TABLE = f"{INTERNAL_TABLE_PREFIX}samples"
+# Rows kept in each table's random sample
+SAMPLE_ROWS = int(os.getenv("APPROX_SAMPLE_ROWS", "100000"))
+# Tables smaller than this are fast enough to query exactly
+MIN_SOURCE_ROWS = int(os.getenv("APPROX_MIN_ROWS", "1000000"))
+# Confidence level of reported intervals, and its normal quantile
+CONFIDENCE_LEVEL = 0.95
+CONFIDENCE_Z = 1.96
+
+ESTIMABLE_AGGREGATES = (exp.Count, exp.Sum, exp.Avg)
+# Prefix of the helper columns an estimate query carries for its confidence intervals
+HELPER_PREFIX = "__nlsql_ci_"
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Sample:
+    """Catalog entry for one table's random sample."""
+
+    def __init__(self, name: str, source_table: str, source_rows: int, sample_rows: int, source_max_rowid: Optional[int]):
+        self.name = name
+        self.source_table = source_table
+        self.source_rows = source_rows
+        self.sample_rows = sample_rows
+        self.source_max_rowid = source_max_rowid
+
+    @property
+    def fraction(self) -> float:
+        """Share of the source table's rows held in the sample."""
+        return self.sample_rows / self.source_rows if self.source_rows else 1.0
+
+    @property
+    def scale(self) -> float:
+        """Factor that turns a count or sum over the sample into an estimate for the whole table."""
+        return self.source_rows / self.sample_rows if self.sample_rows else 1.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "sample_table": self.name,
+            "source_table": self.source_table,
+            "source_rows": self.source_rows,
+            "sample_rows": self.sample_rows,
+            "fraction": round(self.fraction, 6),
+        }
+
+
+class ApproximateQuery:
+    """
+    A validated query rewritten to estimate its answer from a table's sample.
+
+    sql returns the estimates under the original column names (and can be
+    paged like any query); estimate_sql additionally returns the sample
+    statistics the confidence intervals are computed from.
+    """
+
+    def __init__(self, sql: str, estimate_sql: str, sample: Sample, measures: List[Tuple[str, str, List[str]]]):
+        """
+        Args:
+            sql: Estimates only, with the original column names
+            estimate_sql: sql plus helper columns
+            sample: The sample the query reads
+            measures: (output column, aggregate kind, helper columns) for every column that gets an interval
+        """
+        self.sql = sql
+        self.estimate_sql = estimate_sql
+        self.sample = sample
+        self.measures = measures
+
+    def _half_width(self, kind: str, stats: List) -> Optional[float]:
+        """Half-width of the confidence interval for one estimate, from its group's sample statistics."""
+        if any(value is None for value in stats):
+            return None
+        n = self.sample.sample_rows
+        # Finite population correction: a sample holding most of the table is nearly exact
+        fpc = max(1 - self.sample.fraction, 0.0)
+        if kind == "avg":
+            count, mean, mean_square = stats
+            if count < 2:
+                return None
+            variance = max(mean_square - mean * mean, 0.0) * count / (count - 1)
+            return CONFIDENCE_Z * math.sqrt(fpc * variance / count)
+        # COUNT and SUM estimate a total: N times the sample mean of the per-row contribution
+        if kind == "count":
+            share = stats[0] / n
+            variance = share * (1 - share)
+        else:
+            total, total_square = stats
+            mean = total / n
+            variance = max(total_square / n - mean * mean, 0.0)
+        return CONFIDENCE_Z * self.sample.source_rows * math.sqrt(fpc * variance / n)
+
+    def finish(self, rows: List[Dict]) -> Tuple[List[Dict], List[Dict[str, Optional[float]]]]:
+        """
+        Split rows of estimate_sql into the estimates and their confidence intervals.
+
+        Returns:
+            (rows without helper columns, per-row {column: interval half-width})
+        """
+        estimates, intervals = [], []
+        for row in rows:
+            intervals.append({
+                column: self._half_width(kind, [row.get(helper) for helper in helpers])
+                for column, kind, helpers in self.measures
+            })
+            estimates.append({key: value for key, value in row.items() if not key.startswith(HELPER_PREFIX)})
+        return estimates, intervals
+
+
+def estimable(tree: exp.Expression) -> Optional[str]:
+    """
+    The table a parsed query can be estimated from a sample of, or None.
+
+    Supported: one plain table, at least one aggregate, and only COUNT/SUM/AVG
+    (not DISTINCT). MIN/MAX and row-level queries cannot be estimated from a
+    sample, and are always run exactly.
+    """
+    if not isinstance(tree, exp.Select) or tree.args.get("with") or tree.args.get("joins"):
+        return None
+    if tree.args.get("distinct") or tree.find(exp.Window) or len(list(tree.find_all(exp.Select))) > 1:
+        return None
+    source = tree.find(exp.From)
+    if source is None or not isinstance(source.this, exp.Table) or source.this.db:
+        return None
+    aggregates = list(tree.find_all(exp.AggFunc))
+    if not aggregates:
+        return None
+    for aggregate in aggregates:
+        if not isinstance(aggregate, ESTIMABLE_AGGREGATES) or aggregate.expressions:
+            return None
+        if isinstance(aggregate.this, exp.Distinct) or aggregate.this.find(exp.AggFunc):
+            return None
+    return source.this.name
+
+
+class SampleCache:
+    """
+    Uniform random samples of large tables, kept inside the database itself.
+
+    Each table over MIN_SOURCE_ROWS gets a simple random sample of
+    SAMPLE_ROWS rows. In approximate mode, validated aggregate queries are
+    rewritten to read the sample, with COUNT and SUM scaled up to the whole
+    table, and return confidence intervals alongside the estimates.
+    """
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+        self._catalog: Optional[Dict[str, Sample]] = None
+        self._build_lock = threading.Lock()
+
+    def _connect_for_build(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_manager.db_path, isolation_level=None, timeout=30)
+
+    @property
+    def catalog(self) -> Dict[str, Sample]:
+        """Samples by source table, loaded from the database on first use."""
+        if self._catalog is None:
+            self._catalog = self._load_catalog()
+        return self._catalog
+
+    def _load_catalog(self) -> Dict[str, Sample]:
+        try:
+            rows = self.db_manager.execute_query(
+                f"SELECT name, source_table, source_rows, sample_rows, source_max_rowid FROM {CATALOG_TABLE}"
+            )
+        except QueryPipelineError:
+            # No samples have been built for this database yet
+            return {}
+        return {
+            row["source_table"]: Sample(row["name"], row["source_table"], row["source_rows"],
+                                        row["sample_rows"], row["source_max_rowid"])
+            for row in rows
+        }
+
+    def _build(self, conn: sqlite3.Connection, table: str) -> Optional[Sample]:
+        """Build one table's sample, unless the table is too small to need one."""
+        name = f"{SAMPLE_TABLE_PREFIX}{hashlib.sha1(table.encode()).hexdigest()[:10]}"
+        source = _quote(table)
+        source_rows, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {source}").fetchone()
+        if source_rows < MIN_SOURCE_ROWS:
+            return None
+
+        conn.execute("BEGIN")
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+            # ORDER BY random() with a LIMIT keeps only the chosen rowids, not a sort of the whole table
+            conn.execute(
+                f"CREATE TABLE {_quote(name)} AS SELECT * FROM {source} "
+                f"WHERE rowid IN (SELECT rowid FROM {source} ORDER BY random() LIMIT {SAMPLE_ROWS})"
+            )
+            sample_rows = conn.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0]
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (name TEXT PRIMARY KEY, source_table TEXT, "
+                f"source_rows INTEGER, sample_rows INTEGER, source_max_rowid INTEGER, built_at REAL)"
+            )
+            conn.execute(f"DELETE FROM {CATALOG_TABLE} WHERE source_table = ?", (table,))
+            conn.execute(
+                f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                (name, table, source_rows, sample_rows, max_rowid, time.time())
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return Sample(name, table, source_rows, sample_rows, max_rowid)
+
+    def build(self, tables: Optional[List[str]] = None) -> List[str]:
+        """
+        (Re)build the samples of the given tables, or of every large user table.
+
+        Returns immediately (with no changes) if another build is running.
+
+        Returns:
+            Names of the source tables sampled
+        """
+        if not self._build_lock.acquire(blocking=False):
+            return []
+        conn = self._connect_for_build()
+        try:
+            if tables is None:
+                tables = [
+                    name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                    if not name.startswith("sqlite_") and not is_internal_table(name)
+                ]
+            built = []
+            for table in tables:
+                try:
+                    if self._build(conn, table) is not None:
+                        built.append(table)
+                except sqlite3.Error:
+                    # WITHOUT ROWID tables and the like simply stay exact
+                    continue
+            self._catalog = self._load_catalog()
+            return built
+        finally:
+            conn.close()
+            self._build_lock.release()
+
+    def build_in_background(self, tables: Optional[List[str]] = None) -> None:
+        threading.Thread(target=self.build, args=(tables,), daemon=True, name="nlsql-samples").start()
+
+    def refresh(self, tables: Optional[List[str]] = None) -> List[str]:
+        """
+        Drop samples and rebuild them, after the source data changed.
+
+        Args:
+            tables: Only resample these source tables (every table if None)
+
+        Returns:
+            Names of the source tables sampled
+        """
+        conn = self._connect_for_build()
+        try:
+            if tables is None:
+                names = [name for (name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ?", (f"{SAMPLE_TABLE_PREFIX}%",)
+                )]
+                for name in names:
+                    conn.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+                conn.execute(f"DROP TABLE IF EXISTS {CATALOG_TABLE}")
+            else:
+                # A table that shrank below MIN_SOURCE_ROWS must not keep its old sample
+                for sample in self._load_catalog().values():
+                    if sample.source_table in tables:
+                        conn.execute(f"DROP TABLE IF EXISTS {_quote(sample.name)}")
+                        conn.execute(f"DELETE FROM {CATALOG_TABLE} WHERE name = ?", (sample.name,))
+        finally:
+            conn.close()
+        self._catalog = None
+        return self.build(tables)
+
+    def sample_for(self, table: str) -> Optional[Sample]:
+        """
+        A current sample of a table, or None.
+
+        A large table without a current sample (never sampled, or appended to
+        since) gets one built in the background for later questions.
+        """
+        try:
+            rows = self.db_manager.execute_query(f"SELECT MAX(rowid) AS max_rowid FROM {_quote(table)}")
+        except QueryPipelineError:
+            return None
+        max_rowid = rows[0]["max_rowid"]
+        sample = self.catalog.get(table)
+        if sample is not None and sample.source_max_rowid == max_rowid:
+            return sample
+        # MAX(rowid) is a cheap upper bound on the row count
+        if max_rowid is not None and max_rowid >= MIN_SOURCE_ROWS:
+            self.build_in_background([table])
+        return None
+
+    def rewrite(self, sql: str) -> Optional[ApproximateQuery]:
+        """
+        Rewrite a validated query to estimate its answer from a sample.
+
+        Output column names are preserved. COUNT and SUM are scaled by the
+        sampling fraction; AVG needs no scaling. Groups too rare to appear in
+        the sample are missing from the estimate.
+
+        Returns:
+            The approximate query, or None if the query must run exactly
+        """
+        try:
+            tree = sqlglot.parse_one(sql, dialect="sqlite")
+        except Exception:
+            return None
+        table = estimable(tree)
+        if table is None:
+            return None
+        sample = self.sample_for(table)
+        if sample is None:
+            return None
+        try:
+            column_names = self.db_manager.column_names(sql)
+        except QueryPipelineError:
+            return None
+
+        # Output columns that are a (possibly rounded) aggregate get an interval
+        measured = []
+        for index, (select, name) in enumerate(zip(tree.expressions, column_names)):
+            node = select.unalias()
+            if isinstance(node, exp.Round):
+                node = node.this
+            if isinstance(node, ESTIMABLE_AGGREGATES):
+                measured.append((index, name, node.copy()))
+
+        scale = exp.Literal.number(repr(sample.scale))
+        for aggregate in list(tree.find_all(exp.Count, exp.Sum)):
+            estimate = exp.Mul(this=aggregate.copy(), expression=scale.copy())
+            if isinstance(aggregate, exp.Count):
+                # Estimated counts are still counts
+                estimate = exp.cast(exp.Round(this=estimate), "INTEGER")
+            aggregate.replace(estimate)
+        source = tree.find(exp.From).this
+        source.replace(exp.alias_(exp.to_table(sample.name), source.alias_or_name, table=True))
+        for select, name in zip(tree.expressions, column_names):
+            if not isinstance(select, (exp.Alias, exp.Column)):
+                select.replace(exp.alias_(select, name, quoted=True))
+        approximate_sql = tree.sql(dialect="sqlite")
+
+        measures = []
+        for index, name, aggregate in measured:
+            argument = aggregate.this
+            real = exp.cast(argument.copy(), "REAL") if not isinstance(argument, exp.Star) else None
+            if isinstance(aggregate, exp.Count):
+                kind, stats = "count", [exp.Count(this=argument.copy())]
+            elif isinstance(aggregate, exp.Sum):
+                kind, stats = "sum", [exp.Sum(this=real.copy()), exp.Sum(this=exp.Mul(this=real.copy(), expression=real.copy()))]
+            else:
+                kind, stats = "avg", [exp.Count(this=argument.copy()), exp.Avg(this=real.copy()),
+                                      exp.Avg(this=exp.Mul(this=real.copy(), expression=real.copy()))]
+            helpers = [f"{HELPER_PREFIX}{index}_{position}" for position in range(len(stats))]
+            for helper, stat in zip(helpers, stats):
+                tree.append("expressions", exp.alias_(stat, helper, quoted=True))
+            measures.append((name, kind, helpers))
+
+        return ApproximateQuery(approximate_sql, tree.sql(dialect="sqlite"), sample, measures)
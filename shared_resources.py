@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, Iterator, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+# Idle (unleased) entries kept per pool before the least recently used are evicted
+SHARED_MAX_IDLE = int(os.getenv("SHARED_MAX_IDLE", "8"))
+
+
+class _Entry(Generic[T]):
+    """One pooled resource, its lease count and the lock its construction runs under."""
+
+    def __init__(self):
+        self.value: Optional[T] = None
+        self.refs = 0
+        self.build_lock = threading.Lock()
+
+
+class SharedResourcePool(Generic[T]):
+    """
+    Thread-safe, reference-counted cache of expensive per-key resources.
+
+    Each key's resource is built once by the factory and shared by every
+    thread and session that asks for it. Callers that use a resource for a
+    while take a lease; leased entries are never evicted, and once their
+    lease count drops to zero they join an LRU of idle entries capped at
+    max_idle. Building one key does not block lookups of other keys.
+    """
+
+    def __init__(self, factory: Callable[[str], T], max_idle: int = SHARED_MAX_IDLE):
+        """
+        Args:
+            factory: Builds the resource for a key; exceptions propagate to the caller
+            max_idle: Unleased entries kept before the least recently used are evicted
+        """
+        self.factory = factory
+        self.max_idle = max_idle
+        self._entries: "OrderedDict[str, _Entry[T]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _acquire(self, key: str) -> _Entry[T]:
+        """Take a lease on a key's entry, building its resource on first use."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            self._entries.move_to_end(key)
+            entry.refs += 1
+
+        try:
+            with entry.build_lock:
+                if entry.value is None:
+                    with self._lock:
+                        self._stats["misses"] += 1
+                    entry.value = self.factory(key)
+                else:
+                    with self._lock:
+                        self._stats["hits"] += 1
+                return entry
+        except BaseException:
+            self._release(key, entry)
+            raise
+
+    def _release(self, key: str, entry: _Entry[T]) -> None:
+        """Drop a lease and evict idle entries beyond max_idle."""
+        with self._lock:
+            entry.refs -= 1
+            # A failed build leaves nothing worth keeping
+            if entry.value is None and entry.refs == 0 and self._entries.get(key) is entry:
+                del self._entries[key]
+            self._evict_idle()
+
+    def _evict_idle(self) -> None:
+        idle = [key for key, entry in self._entries.items() if entry.refs == 0]
+        # Oldest first, so the most recently used idle entries survive
+        for key in idle[:max(len(idle) - self.max_idle, 0)]:
+            del self._entries[key]
+            self._stats["evictions"] += 1
+
+    @contextmanager
+    def lease(self, key: str) -> Iterator[T]:
+        """Use a key's resource for the duration of a block, protected from eviction."""
+        entry = self._acquire(key)
+        try:
+            yield entry.value
+        finally:
+            self._release(key, entry)
+
+    def get(self, key: str) -> T:
+        """
+        Get (or build) a key's resource without holding a lease.
+
+        The caller may keep using the returned object after it is evicted;
+        the pool just stops handing it out and builds a fresh one next time.
+        """
+        with self.lease(key) as value:
+            return value
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Forget a key's resource (or all of them) so the next use rebuilds it."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Pool size, lease counts and hit/miss/eviction counters."""
+        with self._lock:
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "leases": {key: entry.refs for key, entry in self._entries.items() if entry.refs},
+            }
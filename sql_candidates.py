@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+from query_errors import GenerationError, QueryPipelineError, ValidationError
+
+
+# Candidates generated per question (1 disables speculative generation)
+CANDIDATE_COUNT = int(os.getenv("SQL_CANDIDATES", "1"))
+# Sampling temperature of each candidate, reused cyclically
+CANDIDATE_TEMPERATURES = [
+    float(value) for value in os.getenv("SQL_CANDIDATE_TEMPERATURES", "0.0,0.4,0.8,1.0").split(",")
+]
+# 'first' returns the first valid candidate; 'consensus' picks the result most candidates agree on
+CANDIDATE_MODE = os.getenv("SQL_CANDIDATE_MODE", "first")
+CANDIDATE_WORKERS = int(os.getenv("SQL_CANDIDATE_WORKERS", "8"))
+# Rows compared when checking whether candidates agree
+CONSENSUS_ROWS = 1000
+
+
+class SQLCandidate:
+    """One speculative SQL generation and what became of it."""
+
+    def __init__(self, index: int, temperature: float):
+        self.index = index
+        self.temperature = temperature
+        self.sql: Optional[str] = None
+        self.rewrites: List[Dict] = []
+        self.valid = False
+        self.message: Optional[str] = None
+        self.error: Optional[QueryPipelineError] = None
+        self.cancelled = False
+        # Hash of the candidate's first rows, compared in consensus mode
+        self.result_fingerprint: Optional[str] = None
+        self.votes = 0
+        self.elapsed = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "temperature": self.temperature,
+            "sql": self.sql,
+            "valid": self.valid,
+            "message": self.message if self.error is None else self.error.message,
+            "cancelled": self.cancelled,
+            "votes": self.votes,
+            "elapsed_ms": round(self.elapsed * 1000, 2)
+        }
+
+
+class CandidateSelection:
+    """Outcome of a speculative generation round."""
+
+    def __init__(self, winner: Optional[SQLCandidate], candidates: List[SQLCandidate]):
+        self.winner = winner
+        # In arrival order
+        self.candidates = candidates
+
+    def failure(self) -> QueryPipelineError:
+        """The error to report when no candidate passed validation."""
+        for candidate in self.candidates:
+            if candidate.sql is not None and not candidate.valid and candidate.error is None:
+                return ValidationError(f"SQL Safety Error: {candidate.message}", sql=candidate.sql)
+        for candidate in self.candidates:
+            if candidate.error is not None:
+                return candidate.error
+        return GenerationError("Failed to generate SQL query")
+
+
+class CandidateSelector:
+    """
+    Generates several SQL candidates concurrently and keeps the best one.
+
+    Each candidate is generated, grounded and validated on its own worker
+    as soon as its generation returns. In 'first' mode the first candidate
+    to pass validation wins and the rest are cancelled; in 'consensus' mode
+    valid candidates are also dry-run and the result most of them agree on
+    wins (stopping early once a majority agrees).
+    """
+
+    def __init__(self, llm_slots, db_slots, max_workers: int = CANDIDATE_WORKERS):
+        """
+        Args:
+            llm_slots: Context manager bounding concurrent Gemini calls
+            db_slots: Context manager bounding concurrent database work
+            max_workers: Threads shared by all candidate generations
+        """
+        self.llm_slots = llm_slots
+        self.db_slots = db_slots
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nlsql-candidate")
+
+    @staticmethod
+    def _fingerprint(rows: List[Dict]) -> str:
+        # Column names are ignored so differently aliased but equal results agree
+        values = [list(row.values()) for row in rows]
+        return hashlib.sha1(json.dumps(values, default=str).encode()).hexdigest()
+
+    def _run(self, components, prompt: str, candidate: SQLCandidate, consensus: bool, stop: threading.Event) -> SQLCandidate:
+        """Generate, ground and validate (and in consensus mode dry-run) one candidate."""
+        started = time.perf_counter()
+        try:
+            if stop.is_set():
+                candidate.cancelled = True
+                return candidate
+            with self.llm_slots:
+                sql = components.assistant.generate_sql(prompt, temperature=candidate.temperature)
+            candidate.sql, candidate.rewrites = components.value_index.ground_sql(sql)
+
+            if stop.is_set():
+                candidate.cancelled = True
+                return candidate
+            with self.db_slots:
+                candidate.valid, candidate.message = components.validator.validate(candidate.sql)
+                if candidate.valid and consensus:
+                    rows = components.db_manager.execute_query(candidate.sql, max_rows=CONSENSUS_ROWS)
+                    candidate.result_fingerprint = self._fingerprint(rows)
+        except QueryPipelineError as e:
+            candidate.valid = False
+            candidate.error = e
+        except Exception as e:
+            candidate.valid = False
+            candidate.error = GenerationError(f"Unexpected error in SQL candidate: {e}", sql=candidate.sql)
+        finally:
+            candidate.elapsed = time.perf_counter() - started
+        return candidate
+
+    def select(self, components, prompt: str, count: int = CANDIDATE_COUNT, mode: str = CANDIDATE_MODE) -> CandidateSelection:
+        """
+        Run one speculative generation round.
+
+        Args:
+            components: The database's pipeline components (assistant, validator, value index, database)
+            prompt: SQL generation prompt
+            count: Number of candidates to generate
+            mode: 'first' or 'consensus'
+
+        Returns:
+            CandidateSelection; its winner is None if no candidate passed validation
+        """
+        consensus = mode == "consensus"
+        stop = threading.Event()
+        candidates = [
+            SQLCandidate(index, CANDIDATE_TEMPERATURES[index % len(CANDIDATE_TEMPERATURES)])
+            for index in range(count)
+        ]
+        pending: Dict[Future, SQLCandidate] = {
+            self._executor.submit(self._run, components, prompt, candidate, consensus, stop): candidate
+            for candidate in candidates
+        }
+
+        arrived: List[SQLCandidate] = []
+        winner = None
+        votes: Dict[str, List[SQLCandidate]] = {}
+        while pending and winner is None:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            # Every finished candidate is recorded, even those finishing alongside the winner
+            for future in done:
+                candidate = future.result()
+                del pending[future]
+                arrived.append(candidate)
+                if not candidate.valid:
+                    continue
+                if not consensus:
+                    winner = winner or candidate
+                    continue
+                agreeing = votes.setdefault(candidate.result_fingerprint, [])
+                agreeing.append(candidate)
+                if winner is None and len(agreeing) * 2 > count:
+                    winner = agreeing[0]
+
+        # Cancel what has not started; running candidates stop at their next checkpoint
+        stop.set()
+        for future, candidate in pending.items():
+            if future.done() and not future.cancelled():
+                # Finished after the last wait; it is reported as it ended, not as cancelled
+                arrived.append(future.result())
+                continue
+            future.cancel()
+            candidate.cancelled = True
+            arrived.append(candidate)
+
+        if winner is None and votes:
+            # No majority: the largest group wins, ties going to the group that answered first
+            winner = max(votes.values(), key=lambda group: (len(group), -arrived.index(group[0])))[0]
+        for group in votes.values():
+            for candidate in group:
+                candidate.votes = len(group)
+
+        return CandidateSelection(winner, arrived)
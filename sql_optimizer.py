@@ -0,0 +1,451 @@
+import math
+import os
+import re
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.simplify import simplify
+
+from databse_manager import DatabaseManager
+from query_errors import QueryPipelineError
+
+
+# Set SQL_OPTIMIZER=0 to run validated SQL exactly as generated
+OPTIMIZER_ENABLED = os.getenv("SQL_OPTIMIZER", "1") != "0"
+# Rows assumed for a plan step whose source size is unknown (e.g., a view)
+DEFAULT_SOURCE_ROWS = 1000
+# Share of an index's rows an equality or range lookup is assumed to match
+EQUALITY_SELECTIVITY = 0.01
+RANGE_SELECTIVITY = 0.25
+
+# Nodes of a constant expression that simplify() folds exactly as SQLite evaluates it
+_FOLDABLE = (
+    exp.Literal, exp.Boolean, exp.Paren, exp.Add, exp.Sub, exp.Mul, exp.Neg,
+    exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.And, exp.Or, exp.Not
+)
+_GLOB_SPECIAL = re.compile(r"[*?\[\]]")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _within(node: exp.Expression, ancestor: exp.Expression) -> bool:
+    """Whether node is ancestor or nested somewhere below it."""
+    while node is not None:
+        if node is ancestor:
+            return True
+        node = node.parent
+    return False
+
+
+def _ascii_lower(text: str) -> str:
+    """Lowercase ASCII letters only, like SQLite's lower() and NOCASE collation."""
+    return "".join(char.lower() if char.isascii() else char for char in text)
+
+
+def _ascii_upper(text: str) -> str:
+    return "".join(char.upper() if char.isascii() else char for char in text)
+
+
+def _is_unordered_consumer(select: exp.Select) -> bool:
+    """Whether a subquery's row order cannot affect the result: derived tables, CTEs, IN and EXISTS."""
+    parent = select.parent
+    if isinstance(parent, (exp.CTE, exp.Exists)):
+        return True
+    return isinstance(parent, exp.Subquery) and isinstance(parent.parent, (exp.From, exp.Join, exp.In))
+
+
+def _drop_subquery_order(tree: exp.Select, optimizer: "QueryOptimizer") -> bool:
+    """
+    ORDER BY without LIMIT inside a derived table, CTE, IN or EXISTS only costs a sort.
+
+    Derived tables and CTEs keep it when the query reading them has a LIMIT
+    or OFFSET, or no ORDER BY of its own, since SQLite then returns rows in
+    the inner order.
+    """
+    changed = False
+    for select in list(tree.find_all(exp.Select)):
+        if select is tree or not select.args.get("order") or select.args.get("limit") or select.args.get("offset"):
+            continue
+        if not _is_unordered_consumer(select):
+            # A scalar subquery returns its first row, so its order matters
+            continue
+        consumer = select.parent_select
+        if consumer is not None and consumer.find(exp.GroupConcat, exp.Window):
+            # Concatenation and window functions may depend on the order rows arrive in
+            continue
+        if isinstance(select.parent, exp.CTE):
+            # A CTE is read by the query it belongs to
+            consumer = tree
+        is_source = isinstance(select.parent, exp.CTE) or isinstance(select.parent.parent, (exp.From, exp.Join))
+        if is_source and consumer is not None and (
+            consumer.args.get("limit") or consumer.args.get("offset") or not consumer.args.get("order")
+        ):
+            # "SELECT * FROM (... ORDER BY x) LIMIT 5" returns the first rows of the inner order
+            continue
+        select.set("order", None)
+        changed = True
+    return changed
+
+
+def _drop_redundant_distinct(tree: exp.Select, optimizer: "QueryOptimizer") -> bool:
+    """DISTINCT is a no-op over GROUP BY output that projects every group key, and inside IN/EXISTS."""
+    changed = False
+    for select in list(tree.find_all(exp.Select)):
+        distinct = select.args.get("distinct")
+        if distinct is None or distinct.args.get("on"):
+            continue
+        group = select.args.get("group")
+        redundant = isinstance(select.parent, exp.Exists) or (
+            isinstance(select.parent, exp.Subquery) and isinstance(select.parent.parent, exp.In)
+        )
+        if not redundant and group is not None and group.expressions:
+            projected = {projection.unalias().sql(dialect="sqlite") for projection in select.expressions}
+            aliases = {projection.alias for projection in select.expressions if projection.alias}
+            redundant = all(
+                key.sql(dialect="sqlite") in projected or (isinstance(key, exp.Column) and key.name in aliases)
+                for key in group.expressions
+            )
+        if redundant:
+            select.set("distinct", None)
+            changed = True
+    return changed
+
+
+def _is_constant(node: exp.Expression) -> bool:
+    """Whether an expression only combines numeric literals with arithmetic, comparisons and logic."""
+    return all(
+        isinstance(child, _FOLDABLE) and not (isinstance(child, exp.Literal) and child.is_string)
+        for child in node.walk()
+    )
+
+
+def _fold_constants(condition: exp.Expression) -> exp.Expression:
+    """
+    Fold the constant parts of a condition (e.g., 1 = 1 becomes TRUE).
+
+    Anything involving a column or a string is left alone: imported columns
+    are TEXT, so their comparisons follow SQLite's affinity rules (text
+    ordering), which simplify() does not model.
+    """
+    if _is_constant(condition):
+        return condition if isinstance(condition, exp.Literal) else simplify(condition, dialect="sqlite")
+    for child in list(condition.iter_expressions()):
+        folded = _fold_constants(child)
+        if folded is not child:
+            child.replace(folded)
+    return condition
+
+
+def _drop_duplicate_conditions(condition: exp.Expression) -> exp.Expression:
+    """Drop repeated operands of AND/OR, and TRUE operands of AND (FALSE ones of OR)."""
+    for connective, identity, combine in ((exp.And, True, exp.and_), (exp.Or, False, exp.or_)):
+        if not isinstance(condition, connective):
+            continue
+        parts, seen = [], set()
+        for part in condition.flatten():
+            part = _drop_duplicate_conditions(part.unnest())
+            key = part.sql(dialect="sqlite")
+            if key in seen or (isinstance(part, exp.Boolean) and part.this is identity):
+                continue
+            seen.add(key)
+            parts.append(part)
+        if not parts:
+            return exp.Boolean(this=identity)
+        return combine(*parts, copy=False) if len(parts) > 1 else parts[0]
+    return condition
+
+
+def _simplify_predicates(tree: exp.Select, optimizer: "QueryOptimizer") -> bool:
+    """Fold constants and drop tautologies and duplicated conditions in WHERE, HAVING and ON."""
+    changed = False
+    for clause in list(tree.find_all(exp.Where, exp.Having)):
+        simplified = _drop_duplicate_conditions(_fold_constants(clause.this.copy()))
+        if simplified.sql(dialect="sqlite") != clause.this.sql(dialect="sqlite"):
+            if isinstance(simplified, exp.Boolean) and simplified.this:
+                # WHERE TRUE filters nothing
+                clause.pop()
+            else:
+                clause.set("this", simplified)
+            changed = True
+    for join in list(tree.find_all(exp.Join)):
+        on = join.args.get("on")
+        if on is None:
+            continue
+        simplified = _drop_duplicate_conditions(_fold_constants(on.copy()))
+        if simplified.sql(dialect="sqlite") != on.sql(dialect="sqlite") and not isinstance(simplified, exp.Boolean):
+            join.set("on", simplified)
+            changed = True
+    return changed
+
+
+def _prune_projections(tree: exp.Select, optimizer: "QueryOptimizer") -> bool:
+    """
+    Derived tables and CTEs only compute the columns the rest of the query reads.
+
+    SELECT * over a single table becomes the referenced columns, and unused
+    projections are dropped. Queries that read a source with * are left alone.
+    """
+    scopes: List[Tuple[exp.Select, Set[str]]] = []
+    for subquery in tree.find_all(exp.Subquery):
+        if isinstance(subquery.parent, (exp.From, exp.Join)) and subquery.alias and isinstance(subquery.this, exp.Select):
+            scopes.append((subquery.this, {subquery.alias}))
+    for cte in tree.find_all(exp.CTE):
+        if isinstance(cte.this, exp.Select):
+            names = {cte.alias} | {
+                table.alias_or_name for table in tree.find_all(exp.Table) if table.name == cte.alias
+            }
+            scopes.append((cte.this, names))
+
+    changed = False
+    for inner, names in scopes:
+        if inner.args.get("distinct") or (inner.find(exp.AggFunc) and not inner.args.get("group")):
+            # Dropping columns would change which rows DISTINCT keeps, or how many rows an aggregate returns
+            continue
+        if any(not _within(star, inner) and star.find_ancestor(exp.Count) is None for star in tree.find_all(exp.Star)):
+            # Something reads every column (SELECT *, alias.*)
+            continue
+        referenced = {
+            column.name for column in tree.find_all(exp.Column)
+            if not _within(column, inner) and (not column.table or column.table in names)
+        }
+        # Output aliases the inner query itself refers to (ORDER BY, GROUP BY, HAVING) must stay
+        referenced |= {
+            column.name for column in inner.find_all(exp.Column)
+            if column.find_ancestor(exp.Order, exp.Group, exp.Having, exp.Where) is not None
+        }
+
+        projections = inner.expressions
+        source = inner.args.get("from_")
+        if len(projections) == 1 and isinstance(projections[0], exp.Star):
+            if inner.args.get("joins") or source is None or not isinstance(source.this, exp.Table):
+                continue
+            columns = optimizer.table_columns(source.this)
+            kept = [column for column in columns if column in referenced] or columns[:1]
+            if not columns or len(kept) == len(columns):
+                continue
+            inner.set("expressions", [exp.column(column, quoted=True) for column in kept])
+            changed = True
+            continue
+
+        if any(projection.find(exp.Star) and not projection.find(exp.Count) for projection in projections):
+            continue
+        kept = [projection for projection in projections if projection.alias_or_name in referenced]
+        if kept and len(kept) < len(projections):
+            inner.set("expressions", kept)
+            changed = True
+    return changed
+
+
+def _sargable_predicates(tree: exp.Select, optimizer: "QueryOptimizer") -> bool:
+    """
+    Unwrap functions around columns in WHERE comparisons so an index can be searched.
+
+    LOWER(col) = 'abc' becomes col = 'abc' COLLATE NOCASE (both fold ASCII
+    letters only) and SUBSTR(col, 1, n) = '<n chars>' becomes a GLOB prefix
+    match. Only kept when the plan actually gets cheaper.
+    """
+    changed = False
+    for comparison in list(tree.find_all(exp.EQ)):
+        if comparison.find_ancestor(exp.Where) is None:
+            continue
+        function, literal = comparison.this, comparison.expression
+        if isinstance(function, exp.Literal):
+            function, literal = literal, function
+        if not isinstance(literal, exp.Literal) or not literal.is_string or not isinstance(function.this, exp.Column):
+            continue
+        column, text = function.this.copy(), literal.this
+
+        replacement = None
+        if isinstance(function, exp.Lower) and text == _ascii_lower(text):
+            replacement = exp.EQ(this=column, expression=exp.Collate(this=literal.copy(), expression=exp.var("NOCASE")))
+        elif isinstance(function, exp.Upper) and text == _ascii_upper(text):
+            replacement = exp.EQ(this=column, expression=exp.Collate(this=literal.copy(), expression=exp.var("NOCASE")))
+        elif isinstance(function, exp.Substring) and not _GLOB_SPECIAL.search(text):
+            start, length = function.args.get("start"), function.args.get("length")
+            if (isinstance(start, exp.Literal) and start.this == "1" and isinstance(length, exp.Literal)
+                    and length.this.isdigit() and int(length.this) == len(text) > 0):
+                replacement = exp.Glob(this=column, expression=exp.Literal.string(f"{text}*"))
+        if replacement is not None:
+            comparison.replace(replacement)
+            changed = True
+    return changed
+
+
+# (name, rule, whether the plan must get strictly cheaper), applied in order
+RULES: List[Tuple[str, Callable[[exp.Select, "QueryOptimizer"], bool], bool]] = [
+    ("simplify_predicates", _simplify_predicates, False),
+    ("drop_subquery_order", _drop_subquery_order, False),
+    ("drop_redundant_distinct", _drop_redundant_distinct, False),
+    ("prune_projections", _prune_projections, False),
+    ("sargable_predicates", _sargable_predicates, True),
+]
+
+
+class OptimizedQuery:
+    """A query after optimization, with the rewrites that were kept."""
+
+    def __init__(self, sql: str, original_sql: str, cost: Optional[float], applied: List[Dict]):
+        self.sql = sql
+        self.original_sql = original_sql
+        self.cost = cost
+        self.applied = applied
+
+
+class QueryOptimizer:
+    """
+    Rewrites validated SQL into cheaper, equivalent SQL before it runs.
+
+    Each rule rewrites the sqlglot AST; the rewrite is kept only if SQLite
+    still compiles it with the same output columns and its EXPLAIN QUERY
+    PLAN does not get more expensive under a simple cost model (rows
+    scanned or searched, nested-loop fan-out and temporary sorts).
+    """
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+        self._table_rows: Dict[str, int] = {}
+        self._table_columns: Dict[str, List[str]] = {}
+
+    def _table_ref(self, table: exp.Table) -> str:
+        return f"{_quote(table.db)}.{_quote(table.name)}" if table.db else _quote(table.name)
+
+    def table_columns(self, table: exp.Table) -> List[str]:
+        """Column names of a table, in definition order."""
+        key = self._table_ref(table)
+        if key not in self._table_columns:
+            pragma = f"PRAGMA {_quote(table.db)}.table_info({_quote(table.name)})" if table.db \
+                else f"PRAGMA table_info({_quote(table.name)})"
+            try:
+                self._table_columns[key] = [row["name"] for row in self.db_manager.execute_query(pragma)]
+            except QueryPipelineError:
+                self._table_columns[key] = []
+        return self._table_columns[key]
+
+    def _rows(self, table: exp.Table) -> Optional[int]:
+        """Approximate row count of a table (its highest rowid), cached; None for CTEs and views."""
+        key = self._table_ref(table)
+        if key not in self._table_rows:
+            try:
+                rows = self.db_manager.execute_query(f"SELECT MAX(rowid) AS max_rowid FROM {key}")
+                self._table_rows[key] = rows[0]["max_rowid"] or 0
+            except QueryPipelineError:
+                return None
+        return self._table_rows[key]
+
+    def plan(self, sql: str) -> List[Dict]:
+        """
+        SQLite's EXPLAIN QUERY PLAN rows (id, parent, detail) for a query.
+
+        Raises:
+            ExecutionError: If the query does not compile.
+        """
+        return self.db_manager.execute_query(f"EXPLAIN QUERY PLAN {sql}")
+
+    def cost(self, sql: str, tree: exp.Select, plan: Optional[List[Dict]] = None, sorts: bool = True) -> float:
+        """
+        Estimated cost of running a query: rows visited by its plan.
+
+        Scans cost the source's rows, index searches a logarithmic probe,
+        nested loops multiply by the rows of the loops around them, and each
+        temporary B-tree sorts the rows flowing into it (only the LIMIT's
+        worth of them when the top-level query has a literal LIMIT).
+
+        Args:
+            sql: Query to cost
+            tree: The query's parsed AST
+            plan: Its EXPLAIN QUERY PLAN rows, if already fetched
+            sorts: Whether temporary B-trees count (without them the cost is just the rows scanned and searched)
+
+        Raises:
+            ExecutionError: If the query does not compile.
+        """
+        sources: Dict[str, Optional[int]] = {}
+        for table in tree.find_all(exp.Table):
+            sources[table.alias_or_name] = self._rows(table)
+        limit = tree.args.get("limit")
+        top_limit = int(limit.expression.this) if limit is not None and isinstance(limit.expression, exp.Literal) \
+            and limit.expression.this.isdigit() else None
+
+        children: Dict[int, List[Dict]] = {}
+        for step in plan if plan is not None else self.plan(sql):
+            children.setdefault(step["parent"], []).append(step)
+        derived_rows: Dict[str, float] = {}
+
+        def walk(parent: int) -> Tuple[float, float]:
+            """(cost, output rows) of the loops under one plan node."""
+            cost, rows = 0.0, 1.0
+            for step in children.get(parent, []):
+                detail = step["detail"]
+                sub_cost, sub_rows = walk(step["id"])
+                words = detail.split()
+                if words[0] in ("SCAN", "SEARCH") and len(words) > 1:
+                    name = words[1]
+                    size = sources.get(name)
+                    if size is None:
+                        size = derived_rows.get(name, sub_rows if step["id"] in children else DEFAULT_SOURCE_ROWS)
+                    size = max(float(size), 1.0)
+                    if words[0] == "SCAN":
+                        probe, matched = size, size
+                    elif "rowid=" in detail or "PRIMARY KEY" in detail and "=?" in detail:
+                        probe, matched = math.log2(size + 1), 1.0
+                    elif ">" in detail or "<" in detail:
+                        probe, matched = size * RANGE_SELECTIVITY, size * RANGE_SELECTIVITY
+                    else:
+                        probe, matched = math.log2(size + 1), max(size * EQUALITY_SELECTIVITY, 1.0)
+                    cost += rows * probe + sub_cost
+                    rows *= matched
+                elif "TEMP B-TREE" in detail and sorts:
+                    kept = min(rows, top_limit) if parent == 0 and top_limit else rows
+                    cost += rows * math.log2(kept + 1)
+                elif words[0] in ("MATERIALIZE", "CO-ROUTINE") and len(words) > 1:
+                    derived_rows[words[1]] = sub_rows
+                    cost += sub_cost
+                elif words[0] == "CORRELATED":
+                    cost += rows * sub_cost
+                else:
+                    cost += sub_cost
+            return cost, rows
+
+        return walk(0)[0]
+
+    def optimize(self, sql: str) -> OptimizedQuery:
+        """
+        Apply every rule that keeps the query equivalent and does not make its plan more expensive.
+
+        Args:
+            sql: Validated SELECT query
+
+        Returns:
+            The optimized query and the rewrites kept, each with its plan cost before and after.
+            The original query is returned unchanged if it cannot be analyzed.
+        """
+        try:
+            tree = sqlglot.parse_one(sql, dialect="sqlite")
+            if not isinstance(tree, exp.Select):
+                return OptimizedQuery(sql, sql, None, [])
+            columns = self.db_manager.column_names(sql)
+            cost = self.cost(sql, tree)
+        except Exception:
+            return OptimizedQuery(sql, sql, None, [])
+
+        current_sql, applied = sql, []
+        for name, rule, needs_gain in RULES:
+            candidate = tree.copy()
+            try:
+                if not rule(candidate, self):
+                    continue
+                candidate_sql = candidate.sql(dialect="sqlite")
+                if self.db_manager.column_names(candidate_sql) != columns:
+                    continue
+                candidate_cost = self.cost(candidate_sql, candidate)
+            except Exception:
+                # A rewrite SQLite rejects is simply not applied
+                continue
+            if candidate_cost > cost or (needs_gain and candidate_cost >= cost):
+                continue
+            applied.append({"rule": name, "cost_before": round(cost, 1), "cost_after": round(candidate_cost, 1)})
+            tree, current_sql, cost = candidate, candidate_sql, candidate_cost
+        return OptimizedQuery(current_sql, sql, cost, applied)
@@ -1,21 +1,51 @@
 import sqlglot
-from sqlalchemy import create_engine, text, MetaData
+from databse_manager import FEDERATED_DB_PATH, connect_database, is_internal_table
 
 
 class SQLValidator:
-    def __init__(self, db_path="db/soil_pollution.db", allowed_tables=None):
+    def __init__(self, db_path="db/soil_pollution.db", allowed_tables=None, attached=None):
+        # SQLAlchemy is only needed once a database is actually queried, so it is not imported at startup
+        from sqlalchemy import create_engine
         self.db_path = db_path
-        self.engine = create_engine(f"sqlite:///{db_path}")
+        # Schema alias -> database file for federated (cross-database) validation
+        self.attached = dict(attached or {})
+        if self.attached:
+            self.db_path = FEDERATED_DB_PATH
+            self.engine = create_engine(
+                "sqlite://",
+                creator=lambda: connect_database(FEDERATED_DB_PATH, self.attached)
+            )
+        else:
+            self.engine = create_engine(f"sqlite:///{db_path}")
         self.schema_tables = set(allowed_tables or [])
         self.schema_columns = set()
         self._reflect_schema()
     
     def _reflect_schema(self):
-        metadata = MetaData()
-        metadata.reflect(self.engine)
-        self.schema_tables = {t.name for t in metadata.tables.values()}
-        self.schema_columns = {c.name for t in metadata.tables.values() 
-                              for c in t.columns}
+        from sqlalchemy import MetaData
+        if not self.attached:
+            metadata = MetaData()
+            metadata.reflect(self.engine, only=lambda name, _: not is_internal_table(name))
+            self.schema_tables = {t.name for t in metadata.tables.values()}
+            self.schema_columns = {c.name for t in metadata.tables.values() 
+                                  for c in t.columns}
+            return
+        
+        # Federated: accept alias.table, plus bare table names SQLite can resolve
+        self.schema_tables = set()
+        self.schema_columns = set()
+        for alias in self.attached:
+            metadata = MetaData(schema=alias)
+            metadata.reflect(self.engine, only=lambda name, _: not is_internal_table(name))
+            for t in metadata.tables.values():
+                self.schema_tables.update({f"{alias}.{t.name}", t.name})
+                self.schema_columns.update(c.name for c in t.columns)
+    
+    def _table_name(self, table):
+        """Name of a table reference, qualified with its database alias when federated."""
+        if self.attached and table.db:
+            return f"{table.db}.{table.name}"
+        return table.name
     
     def safety_check(self, sql):
         try:
@@ -99,7 +129,7 @@ class SQLValidator:
                 real_columns.add(col_name)
             
             # Extract used tables, excluding CTEs
-            used_tables = {t.name for t in parsed_ast.find_all(sqlglot.exp.Table)}
+            used_tables = {self._table_name(t) for t in parsed_ast.find_all(sqlglot.exp.Table)}
             used_tables = used_tables - cte_names
             
             missing_tables = used_tables - self.schema_tables
@@ -114,21 +144,26 @@ class SQLValidator:
             return False, f"Semantic error: {str(e)}"
     
     def execution_check(self, sql):
+        from sqlalchemy import text
         try:
+            # EXPLAIN compiles the statement against the real schema without running it
             with self.engine.begin() as conn:
-                conn.execute(text(sql))
+                conn.execute(text(f"EXPLAIN {sql}"))
             return True, "Executed successfully"
         except Exception as e:
             return False, f"Runtime error: {str(e)}"
     
     def validate(self, sql):
+        # Checks run lazily and in order: the execution check must never
+        # run a statement the safety check rejected
         checks = [
-            ("Safety", self.safety_check(sql)),
-            ("Semantic", self.semantic_check(sql)),
-            ("Execution", self.execution_check(sql))
+            ("Safety", self.safety_check),
+            ("Semantic", self.semantic_check),
+            ("Execution", self.execution_check)
         ]
         
-        for stage, (ok, msg) in checks:
+        for stage, check in checks:
+            ok, msg = check(sql)
             if not ok:
                 return False, f"{stage} failed: {msg}"
         return True, "All validations passed"
\ No newline at end of file
@@ -0,0 +1,89 @@
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+
+# "import time:   self [us] | cumulative | imported package"
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def parse_importtime(output: str) -> List[Dict]:
+    """
+    Parse `python -X importtime` output into import records.
+
+    Returns:
+        Records with module, self_ms, cumulative_ms and nesting depth, in the
+        order Python reports them (children before their parent).
+    """
+    records = []
+    for line in output.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        records.append({
+            "module": module,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            # importtime indents one level by two spaces, after a single separator space
+            "depth": max(len(indent) - 1, 0) // 2
+        })
+    return records
+
+
+def profile_imports(module: str = "main", top: int = 10, python: Optional[str] = None) -> Dict:
+    """
+    Measure how long importing a module takes, and where the time goes.
+
+    The import runs in a fresh interpreter so nothing is already cached in
+    sys.modules, which is what a cold Streamlit or CLI start pays.
+
+    Args:
+        module: Module to import (e.g., 'main' for the Streamlit app)
+        top: Number of entries to keep in each breakdown
+        python: Interpreter to profile with (the current one if None)
+
+    Returns:
+        Dict with the module's total import time, its slowest direct imports
+        and the packages that spent the most time importing themselves.
+
+    Raises:
+        RuntimeError: If the module cannot be imported.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    completed = subprocess.run(
+        [python or sys.executable, "-X", "importtime", "-W", "ignore", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env
+    )
+    records = parse_importtime(completed.stderr)
+    target = next((record for record in reversed(records) if record["module"] == module and record["depth"] == 0), None)
+    if completed.returncode != 0 or target is None:
+        last_line = (completed.stderr.strip().splitlines() or ["no output"])[-1]
+        raise RuntimeError(f"Could not import {module}: {last_line}")
+
+    # The target's own imports are the depth-1 records directly before it
+    target_index = records.index(target)
+    start = target_index
+    while start > 0 and records[start - 1]["depth"] >= 1:
+        start -= 1
+    direct = [record for record in records[start:target_index] if record["depth"] == 1]
+
+    # Self time summed per top-level package, across everything the import pulled in
+    packages: Dict[str, float] = {}
+    for record in records[start:target_index + 1]:
+        package = record["module"].split(".")[0]
+        packages[package] = packages.get(package, 0.0) + record["self_ms"]
+
+    return {
+        "module": module,
+        "total_ms": target["cumulative_ms"],
+        "direct_imports": sorted(direct, key=lambda record: record["cumulative_ms"], reverse=True)[:top],
+        "packages": [
+            {"package": package, "self_ms": round(self_ms, 3)}
+            for package, self_ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        ]
+    }
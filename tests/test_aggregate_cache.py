@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import aggregate_cache
+from aggregate_cache import AggregateCache, AggregateShape
+from databse_manager import DatabaseManager
+
+
+SQL = "SELECT Country, SUM(AQI) AS total FROM readings GROUP BY Country ORDER BY Country"
+ROWS = [(country, aqi) for country in ("Chile", "France", "India") for aqi in range(1, 101)]
+
+
+class SummaryStaleness(unittest.TestCase):
+    """A summary must stop answering queries as soon as its source table changes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "readings.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE readings (Country TEXT, AQI INTEGER)")
+        conn.executemany("INSERT INTO readings VALUES (?, ?)", ROWS)
+        conn.commit()
+        conn.close()
+        self.db_manager = DatabaseManager(self.path)
+        self.cache = AggregateCache(self.db_manager)
+        with mock.patch.object(aggregate_cache, "MIN_SOURCE_ROWS", 10):
+            self.assertIsNotNone(self.cache._materialize(AggregateShape.from_sql(SQL), hits=2))
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp.cleanup()
+
+    def change_outside_the_app(self, sql):
+        conn = sqlite3.connect(self.path)
+        conn.execute(sql)
+        conn.commit()
+        conn.close()
+
+    def test_unchanged_source_is_rewritten(self):
+        rewritten = self.cache.rewrite(SQL)
+        self.assertIsNotNone(rewritten)
+        self.assertEqual(self.db_manager.execute_query(rewritten), self.db_manager.execute_query(SQL))
+
+    def assert_change_retires_summary(self, sql):
+        self.assertIsNotNone(self.cache.rewrite(SQL))
+        self.change_outside_the_app(sql)
+        self.assertIsNone(self.cache.rewrite(SQL))
+
+    def test_update_retires_summary(self):
+        self.assert_change_retires_summary("UPDATE readings SET AQI = AQI + 1 WHERE Country = 'India'")
+
+    def test_delete_retires_summary(self):
+        self.assert_change_retires_summary("DELETE FROM readings WHERE rowid = 1")
+
+    def test_insert_retires_summary(self):
+        self.assert_change_retires_summary("INSERT INTO readings VALUES ('Peru', 5)")
+
+    def test_recreated_source_retires_summary(self):
+        self.assertIsNotNone(self.cache.rewrite(SQL))
+        conn = sqlite3.connect(self.path)
+        conn.executescript(
+            "ALTER TABLE readings RENAME TO old_readings; "
+            "CREATE TABLE readings AS SELECT * FROM old_readings; DROP TABLE old_readings;"
+        )
+        conn.close()
+        self.assertIsNone(self.cache.rewrite(SQL))
+
+    def test_refresh_drops_retired_summaries(self):
+        self.change_outside_the_app("UPDATE readings SET AQI = 0")
+        self.cache.refresh(tables=["readings"])
+        conn = sqlite3.connect(self.path)
+        summaries = [
+            name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            if name.startswith(aggregate_cache.AGGREGATE_TABLE_PREFIX)
+        ]
+        conn.close()
+        self.assertEqual(summaries, [])
+
+    def test_refresh_drops_triggers(self):
+        self.cache.refresh()
+        self.change_outside_the_app("UPDATE readings SET AQI = 0")
+        conn = sqlite3.connect(self.path)
+        triggers = conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall()
+        conn.close()
+        self.assertEqual(triggers, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
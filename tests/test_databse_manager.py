@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from databse_manager import DatabaseManager
+
+
+class WrappedQueries(unittest.TestCase):
+    """Paging, counting and column probes must accept any query the validator lets through."""
+
+    QUERIES = [
+        "SELECT City FROM readings ORDER BY City",
+        "SELECT City FROM readings ORDER BY City;",
+        "SELECT City FROM readings ORDER BY City -- every city",
+        "SELECT City FROM readings ORDER BY City; -- every city\n/* done */",
+        "SELECT City, '--;' AS note FROM readings /* all */ ORDER BY City -- a; b",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.tmp.name, "cities.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE readings (City TEXT)")
+        conn.executemany("INSERT INTO readings VALUES (?)", [("Delhi",), ("Lyon",), ("Paris",)])
+        conn.commit()
+        conn.close()
+        cls.db_manager = DatabaseManager(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_manager.close()
+        cls.tmp.cleanup()
+
+    def test_trailing_comments_and_semicolons(self):
+        for sql in self.QUERIES:
+            with self.subTest(sql=sql):
+                self.assertEqual(self.db_manager.count_rows(sql), 3)
+                self.assertEqual([row["City"] for row in self.db_manager.fetch_page(sql, 1, 1)], ["Lyon"])
+                self.assertEqual(self.db_manager.column_names(sql)[0], "City")
+
+
+class SchemaTables(unittest.TestCase):
+    """Only user tables reach the schema shown to the LLM and in the sidebar."""
+
+    def test_sqlite_and_internal_tables_are_hidden(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "analyzed.db")
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE readings (City TEXT)")
+            conn.execute("CREATE INDEX readings_city ON readings (City)")
+            conn.execute("CREATE TABLE _nlsql_agg_test (City TEXT)")
+            conn.execute("INSERT INTO readings VALUES ('Lyon')")
+            conn.execute("ANALYZE")
+            conn.commit()
+            conn.close()
+            db_manager = DatabaseManager(path)
+            try:
+                self.assertEqual(list(db_manager.get_schema()), ["readings"])
+            finally:
+                db_manager.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from query_errors import DatabaseNotFoundError
+from query_service import QueryService
+
+
+class DatabaseNames(unittest.TestCase):
+    """Only databases listed in db_dir can be opened, whatever name a client sends."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_dir = os.path.join(self.tmp.name, "db")
+        os.makedirs(self.db_dir)
+        self.outside = os.path.join(self.tmp.name, "outside.db")
+        conn = sqlite3.connect(self.outside)
+        conn.execute("CREATE TABLE secrets (value TEXT)")
+        conn.commit()
+        conn.close()
+        sqlite3.connect(os.path.join(self.db_dir, "inside.db")).close()
+        self.service = QueryService(self.db_dir, log_workload=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_paths_are_rejected(self):
+        for name in ("../outside.db", self.outside, "inside.db+../outside.db", "missing.db", ""):
+            with self.subTest(name=name):
+                with self.assertRaises(DatabaseNotFoundError):
+                    self.service.components(name)
+
+    def test_ask_reports_database_stage(self):
+        outcome = self.service.ask("How many secrets?", "../outside.db", sql="SELECT COUNT(*) FROM secrets")
+        self.assertEqual(outcome.error.stage, "database")
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["db", "outside.db"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from result_export import export_path_for, export_query, prune_exports
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class PruneExports(unittest.TestCase):
+    """Old exports are deleted so the shared exports directory stays bounded."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.export_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def touch(self, name, age):
+        path = os.path.join(self.export_dir, name)
+        with open(path, "w") as f:
+            f.write("x")
+        written = time.time() - age
+        os.utime(path, (written, written))
+
+    def test_only_old_exports_are_deleted(self):
+        self.touch("old.csv", 7200)
+        self.touch("old.parquet.part", 7200)
+        self.touch("old.parquet.part.spool", 7200)
+        self.touch("new.jsonl", 10)
+        self.touch("notes.txt", 7200)
+        self.assertEqual(sorted(prune_exports(self.export_dir, max_age=3600)), ["old.csv", "old.parquet.part", "old.parquet.part.spool"])
+        self.assertEqual(sorted(os.listdir(self.export_dir)), ["new.jsonl", "notes.txt"])
+
+    def test_new_export_prunes(self):
+        self.touch("old.csv", 10 ** 7)
+        path = export_path_for(self.export_dir, "csv", "query_results")
+        self.assertEqual(os.listdir(self.export_dir), [])
+        self.assertTrue(path.endswith(".csv"))
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class ParquetTypes(unittest.TestCase):
+    """Column types are promoted over the whole result, not taken from the first chunk."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "mixed.db")
+        conn = sqlite3.connect(self.db_path)
+        # Untyped columns store whatever each row holds, as CSV imports and expressions can
+        conn.execute("CREATE TABLE readings (late_value, late_float, late_text, always_null)")
+        conn.executemany("INSERT INTO readings VALUES (?, ?, ?, ?)", [(None, 1, 2, None)] * 3 + [(4, 2.5, "n/a", None)])
+        conn.commit()
+        conn.close()
+        self.output = os.path.join(self.tmp.name, "out.parquet")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_types_are_promoted_across_chunks(self):
+        rows = export_query(self.db_path, "SELECT * FROM readings ORDER BY rowid", self.output, "parquet", chunk_size=2)
+        self.assertEqual(rows, 4)
+        table = pq.read_table(self.output)
+        self.assertEqual([str(field.type) for field in table.schema], ["int64", "double", "string", "string"])
+        self.assertEqual(table.column("late_value").to_pylist(), [None, None, None, 4])
+        self.assertEqual(table.column("late_float").to_pylist(), [1.0, 1.0, 1.0, 2.5])
+        self.assertEqual(table.column("late_text").to_pylist(), ["2", "2", "2", "n/a"])
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["mixed.db", "out.parquet"])
+
+    def test_empty_result(self):
+        rows = export_query(self.db_path, "SELECT * FROM readings WHERE 0", self.output, "parquet")
+        self.assertEqual(rows, 0)
+        self.assertEqual(pq.read_table(self.output).num_rows, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
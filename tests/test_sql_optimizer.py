@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import sqlglot
+
+from databse_manager import DatabaseManager
+from sql_optimizer import RULES, QueryOptimizer
+
+
+# Imported from CSV, so every column is TEXT and numbers compare as text ('9' > '100')
+ROWS = [
+    ("India", "Delhi", "9"), ("India", "Mumbai", "100"), ("India", "Pune", "55"),
+    ("France", "Paris", "75"), ("France", "Lyon", "7"), ("France", "Nice", None),
+    ("Chile", "Santiago", "120"), ("Chile", "Arica", "60"), ("Chile", "Arica", "60"),
+]
+
+QUERIES = [
+    'SELECT COUNT(*) AS n FROM readings WHERE "AQI Value" > 100 AND "AQI Value" > 50',
+    'SELECT COUNT(*) AS n FROM readings WHERE "AQI Value" > 50 AND "AQI Value" > 100',
+    'SELECT City FROM readings WHERE "AQI Value" >= 10 OR "AQI Value" > 9 ORDER BY City',
+    'SELECT City FROM readings WHERE "AQI Value" < 100 AND NOT "AQI Value" >= 100 ORDER BY City',
+    "SELECT City FROM readings WHERE Country = 'India' AND Country = 'India' AND 1 = 1 ORDER BY City",
+    "SELECT City FROM readings WHERE (City = 'Lyon' OR City = 'Lyon') AND 2 > 1 + 0 ORDER BY City",
+    'SELECT Country, COUNT(*) AS n FROM readings GROUP BY Country HAVING COUNT(*) > 2 AND COUNT(*) > 2',
+    'SELECT r.City FROM readings r JOIN readings s ON r.City = s.City AND r."AQI Value" > 50 '
+    'AND r."AQI Value" > 100 ORDER BY r.City',
+    'SELECT * FROM (SELECT Country, City, CAST("AQI Value" AS INT) AS aqi FROM readings ORDER BY aqi DESC) LIMIT 3',
+    'SELECT * FROM (SELECT City, "AQI Value" FROM readings ORDER BY "AQI Value") LIMIT 2 OFFSET 1',
+    'SELECT City FROM (SELECT City, "AQI Value" FROM readings ORDER BY City DESC)',
+    'WITH ranked AS (SELECT City FROM readings ORDER BY "AQI Value" DESC) SELECT City FROM ranked LIMIT 2',
+    "SELECT City FROM readings WHERE City IN (SELECT City FROM readings WHERE Country = 'Chile' ORDER BY City) "
+    "ORDER BY City",
+    'SELECT * FROM (SELECT City, "AQI Value" FROM readings ORDER BY City) ORDER BY City DESC',
+    'SELECT DISTINCT Country, COUNT(*) AS n FROM readings GROUP BY Country ORDER BY Country',
+    'SELECT City FROM (SELECT * FROM readings) AS r WHERE r."AQI Value" > 50 ORDER BY City',
+    "SELECT City FROM readings WHERE LOWER(Country) = 'india' ORDER BY City",
+    "SELECT City FROM readings WHERE SUBSTR(City, 1, 2) = 'Pa' ORDER BY City",
+]
+
+
+class OptimizerRulesOnTextColumns(unittest.TestCase):
+    """Every rewrite must return exactly the rows of the query it replaces."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.tmp.name, "text.db")
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE readings ("Country" TEXT, "City" TEXT, "AQI Value" TEXT)')
+        conn.executemany("INSERT INTO readings VALUES (?, ?, ?)", ROWS)
+        conn.commit()
+        conn.close()
+        cls.db_manager = DatabaseManager(path)
+        cls.optimizer = QueryOptimizer(cls.db_manager)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_manager.close()
+        cls.tmp.cleanup()
+
+    def rows(self, sql):
+        return self.db_manager.execute_query(sql)
+
+    def test_each_rule_preserves_rows(self):
+        for sql in QUERIES:
+            for name, rule, _ in RULES:
+                tree = sqlglot.parse_one(sql, dialect="sqlite")
+                if not rule(tree, self.optimizer):
+                    continue
+                rewritten = tree.sql(dialect="sqlite")
+                with self.subTest(rule=name, sql=sql, rewritten=rewritten):
+                    self.assertEqual(self.rows(sql), self.rows(rewritten))
+
+    def test_optimize_preserves_rows(self):
+        for sql in QUERIES:
+            optimized = self.optimizer.optimize(sql)
+            with self.subTest(sql=sql, optimized=optimized.sql):
+                self.assertEqual(self.rows(sql), self.rows(optimized.sql))
+
+    def test_text_comparisons_are_not_merged(self):
+        sql = 'SELECT COUNT(*) AS n FROM readings WHERE "AQI Value" > 100 AND "AQI Value" > 50'
+        self.assertEqual(self.optimizer.optimize(sql).sql, sql)
+
+    def test_duplicate_conditions_and_constants_are_dropped(self):
+        sql = "SELECT City FROM readings WHERE Country = 'India' AND Country = 'India' AND 1 = 1 ORDER BY City"
+        self.assertEqual(
+            self.optimizer.optimize(sql).sql,
+            "SELECT City FROM readings WHERE Country = 'India' ORDER BY City"
+        )
+
+    def test_inner_order_is_kept_under_limit(self):
+        sql = 'SELECT * FROM (SELECT City, "AQI Value" FROM readings ORDER BY City) LIMIT 2'
+        self.assertIn("ORDER BY", self.optimizer.optimize(sql).sql)
+
+    def test_limit_is_never_added(self):
+        sql = 'SELECT Country, City FROM readings ORDER BY "AQI Value" DESC'
+        self.assertNotIn("LIMIT", self.optimizer.optimize(sql).sql)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from sql_validation import SQLValidator
+
+
+class RejectedStatementsNeverRun(unittest.TestCase):
+    """The execution check must not run a statement an earlier check rejected."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cities.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE readings (City TEXT)")
+        conn.executemany("INSERT INTO readings VALUES (?)", [("Delhi",), ("Lyon",)])
+        conn.commit()
+        conn.close()
+        self.validator = SQLValidator(db_path=self.path)
+
+    def tearDown(self):
+        self.validator.engine.dispose()
+        self.tmp.cleanup()
+
+    def count(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_unsafe_statements_are_rejected_without_running(self):
+        for sql in ("DELETE FROM readings", "UPDATE readings SET City = 'Paris'",
+                    "INSERT INTO readings VALUES ('Paris')"):
+            with self.subTest(sql=sql):
+                ok, message = self.validator.validate(sql)
+                self.assertFalse(ok)
+                self.assertTrue(message.startswith("Safety failed"))
+                self.assertEqual(self.count(), 2)
+        conn = sqlite3.connect(self.path)
+        cities = [city for (city,) in conn.execute("SELECT City FROM readings ORDER BY City")]
+        conn.close()
+        self.assertEqual(cities, ["Delhi", "Lyon"])
+
+    def test_select_passes(self):
+        self.assertEqual(self.validator.validate("SELECT City FROM readings"), (True, "All validations passed"))
+
+
+class ExecutionCheckCompilesOnly(unittest.TestCase):
+    """The execution check compiles a query against the schema instead of running it."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.tmp.name, "cities.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE readings (City TEXT)")
+        conn.execute("INSERT INTO readings VALUES ('Delhi')")
+        conn.commit()
+        conn.close()
+        cls.validator = SQLValidator(db_path=path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.validator.engine.dispose()
+        cls.tmp.cleanup()
+
+    def test_query_is_not_run(self):
+        # Compiles, but fails as soon as a row is read: 'Delhi' is not JSON
+        ok, _ = self.validator.execution_check("SELECT json(City) FROM readings")
+        self.assertTrue(ok)
+
+    def test_compile_errors_are_reported(self):
+        ok, message = self.validator.execution_check("SELECT Country FROM readings")
+        self.assertFalse(ok)
+        self.assertIn("no such column", message)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from query_errors import UploadError
+from upload_pipeline import register_database
+
+
+class RegisterDatabase(unittest.TestCase):
+    """An upload never silently replaces a database that is already registered."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_dir = self.tmp.name
+        self.existing = os.path.join(self.db_dir, "sales.db")
+        with open(self.existing, "wb") as f:
+            f.write(b"original")
+        self.staged = os.path.join(self.db_dir, "staged.db")
+        with open(self.staged, "wb") as f:
+            f.write(b"upload")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_existing_name_is_refused(self):
+        with self.assertRaises(UploadError):
+            register_database(self.staged, self.db_dir, "sales.db")
+        self.assertEqual(self.read(self.existing), b"original")
+
+    def test_overwrite_replaces(self):
+        register_database(self.staged, self.db_dir, "sales.db", overwrite=True)
+        self.assertEqual(self.read(self.existing), b"upload")
+        self.assertFalse(os.path.exists(self.staged))
+
+    def test_new_name_is_registered(self):
+        path = register_database(self.staged, self.db_dir, "new.db")
+        self.assertEqual(self.read(path), b"upload")
+        self.assertFalse(os.path.exists(self.staged))
+
+
+if __name__ == "__main__":
+    unittest.main()
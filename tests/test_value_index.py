@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from value_index import ValueIndex
+
+
+class PerDatabaseLocking(unittest.TestCase):
+    """Indexing one database must not hold up value matching on another."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_dir = os.path.join(self.tmp.name, "db")
+        self.index_dir = os.path.join(self.tmp.name, "cache")
+        os.makedirs(self.db_dir)
+        for name, city in (("slow.db", "Lyon"), ("fast.db", "Delhi")):
+            conn = sqlite3.connect(os.path.join(self.db_dir, name))
+            conn.execute("CREATE TABLE readings (City TEXT)")
+            conn.execute("INSERT INTO readings VALUES (?)", (city,))
+            conn.commit()
+            conn.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_slow_build_does_not_block_other_databases(self):
+        build = ValueIndex.build
+        slow_started = threading.Event()
+
+        def slow_build(db_path, *args, **kwargs):
+            if db_path.endswith("slow.db"):
+                slow_started.set()
+                time.sleep(1)
+            return build(db_path, *args, **kwargs)
+
+        with mock.patch.object(ValueIndex, "build", side_effect=slow_build):
+            slow = threading.Thread(target=ValueIndex.for_database, args=("slow.db", self.db_dir, self.index_dir))
+            slow.start()
+            self.assertTrue(slow_started.wait(5))
+            started = time.perf_counter()
+            fast = ValueIndex.for_database("fast.db", self.db_dir, self.index_dir)
+            elapsed = time.perf_counter() - started
+            slow.join()
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(fast.column_values("readings", "City").values, ["Delhi"])
+
+    def test_concurrent_callers_build_once(self):
+        with mock.patch.object(ValueIndex, "build", wraps=ValueIndex.build) as build:
+            threads = [
+                threading.Thread(target=ValueIndex.for_database, args=("fast.db", self.db_dir, self.index_dir))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(build.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
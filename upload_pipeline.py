@@ -0,0 +1,337 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from aggregate_cache import AggregateCache
+from databse_manager import DatabaseManager, is_internal_table
+from memory_management import MemoryManager
+from query_engines import ENGINE_MODE, ColumnarMirror
+from query_errors import ExecutionError, QueryPipelineError, UploadError
+from sample_cache import SampleCache
+from value_index import ValueIndex
+
+
+DATABASE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+# Rewrite uploads with VACUUM (optionally into UPLOAD_PAGE_SIZE pages) before registering them
+UPLOAD_VACUUM = os.getenv("UPLOAD_VACUUM", "0") == "1"
+UPLOAD_PAGE_SIZE = int(os.getenv("UPLOAD_PAGE_SIZE", "0"))
+# Staged uploads live inside the database directory so registering them is a same-filesystem rename
+STAGING_DIR_NAME = ".staging"
+
+
+def check_integrity(db_path: str) -> Dict:
+    """
+    Verify that a file is a readable SQLite database.
+
+    Returns:
+        Table count and page size of the database
+
+    Raises:
+        UploadError: If the file is not SQLite, fails PRAGMA quick_check or has no tables.
+    """
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.Error as e:
+        raise UploadError(f"Cannot open uploaded database: {e}") from e
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check").fetchall()]
+        if problems != ["ok"]:
+            raise UploadError(f"Uploaded database failed integrity check: {'; '.join(problems[:5])}")
+        tables = [
+            name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            if not name.startswith("sqlite_") and not is_internal_table(name)
+        ]
+        if not tables:
+            raise UploadError("Uploaded database has no tables")
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {"tables": len(tables), "page_size": page_size}
+    except sqlite3.DatabaseError as e:
+        # Raised on the first read when the file is not a database at all
+        raise UploadError(f"Uploaded file is not a valid SQLite database: {e}") from e
+    finally:
+        conn.close()
+
+
+def optimize_database(db_path: str, vacuum: bool = UPLOAD_VACUUM, page_size: int = UPLOAD_PAGE_SIZE) -> Dict:
+    """
+    Gather planner statistics and optionally rewrite the file compactly.
+
+    Args:
+        db_path: Database to optimize (modified in place)
+        vacuum: Rebuild the file with VACUUM
+        page_size: Page size to VACUUM into (0 keeps the current one); must be a power of two from 512 to 65536
+
+    Returns:
+        Page size and file size after optimizing
+    """
+    if page_size and (page_size < 512 or page_size > 65536 or page_size & (page_size - 1)):
+        raise UploadError(f"Invalid page size {page_size}: must be a power of two from 512 to 65536")
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # Statistics let the query planner choose indexes for the very first question
+        conn.execute("ANALYZE")
+        if vacuum or page_size:
+            # The page size of a WAL database cannot change, so switch back to a rollback journal
+            conn.execute("PRAGMA journal_mode=DELETE")
+            if page_size:
+                conn.execute(f"PRAGMA page_size={page_size}")
+            conn.execute("VACUUM")
+        return {
+            "page_size": conn.execute("PRAGMA page_size").fetchone()[0],
+            "size_bytes": os.path.getsize(db_path)
+        }
+    finally:
+        conn.close()
+
+
+def prepare_database(
+    db_path: str,
+    db_name: str,
+    vacuum: bool = UPLOAD_VACUUM,
+    page_size: int = UPLOAD_PAGE_SIZE,
+    on_stage: Optional[Callable[[str], None]] = None
+) -> Dict:
+    """
+    Check, optimize and pre-build the caches of a staged database.
+
+    Everything a first question would otherwise pay for inline happens here:
+    summary tables are rebuilt for the database's remembered questions,
+    ANALYZE statistics are gathered, large tables are sampled for approximate
+    answers, the column value index is written and, when a columnar engine is
+    enabled, the DuckDB mirror is built.
+
+    Args:
+        db_path: Staged database file (modified in place)
+        db_name: Name it will be registered under (e.g., 'sales.db')
+        vacuum: Rebuild the file with VACUUM
+        page_size: Page size to VACUUM into (0 keeps the current one)
+        on_stage: Optional callback invoked with each stage name as it starts
+
+    Returns:
+        Report with the database's table count, page and file sizes and per-stage timings
+
+    Raises:
+        UploadError: If the database is corrupt or cannot be prepared.
+    """
+    report: Dict = {"database": db_name, "uploaded_bytes": os.path.getsize(db_path), "timings_ms": {}}
+
+    def build_mirror() -> Dict:
+        try:
+            return {"mirrored_tables": len(ColumnarMirror(db_path, db_name).build())}
+        except ExecutionError as e:
+            # The mirror is only an accelerator; queries run on SQLite until it is rebuilt
+            return {"columnar_error": e.message}
+
+    def run(stage: str, step: Callable[[], Optional[Dict]]) -> None:
+        if on_stage:
+            on_stage(stage)
+        started = time.perf_counter()
+        report.update(step() or {})
+        report["timings_ms"][stage] = round((time.perf_counter() - started) * 1000, 2)
+
+    run("integrity", lambda: check_integrity(db_path))
+    try:
+        # Summary tables shipped inside the file (or left from an older copy) cannot be trusted
+        run("aggregates", lambda: {"summary_tables": len(AggregateCache(DatabaseManager(db_path)).refresh(
+            MemoryManager.get_memory_file_for_db(db_name)
+        ))})
+        run("optimize", lambda: optimize_database(db_path, vacuum, page_size))
+        # After VACUUM, which may renumber the rowids samples are checked against
+        run("samples", lambda: {"sampled_tables": len(SampleCache(DatabaseManager(db_path)).refresh())})
+        # Last, because VACUUM may renumber rowids the index fingerprint depends on
+        run("value_index", lambda: {"indexed_columns": sum(
+            len(columns) for columns in ValueIndex.build_and_save(db_path, db_name).columns.values()
+        )})
+        if ENGINE_MODE != "sqlite":
+            run("columnar", build_mirror)
+    except QueryPipelineError:
+        raise
+    except (sqlite3.Error, OSError) as e:
+        raise UploadError(f"Error preparing uploaded database: {e}") from e
+    return report
+
+
+def register_database(staged_path: str, db_dir: str, db_name: str, overwrite: bool = False) -> str:
+    """
+    Atomically move a prepared database into db_dir under its final name.
+
+    Readers see either the previous file or the complete new one, never a
+    partially written upload.
+
+    Args:
+        staged_path: Prepared database file
+        db_dir: Directory holding the SQLite databases
+        db_name: Name to register it under
+        overwrite: Replace an existing database of the same name
+
+    Returns:
+        Path of the registered database
+
+    Raises:
+        UploadError: If a database of that name exists and overwrite is False.
+    """
+    final_path = os.path.join(db_dir, db_name)
+    if overwrite:
+        os.replace(staged_path, final_path)
+        return final_path
+    try:
+        # Unlike a rename, a link fails if the name is taken, even by a concurrent upload
+        os.link(staged_path, final_path)
+    except FileExistsError:
+        raise UploadError(f"Database {db_name} already exists; upload it with overwrite to replace it") from None
+    except OSError:
+        # Filesystems without hard links: check, then rename
+        if os.path.exists(final_path):
+            raise UploadError(f"Database {db_name} already exists; upload it with overwrite to replace it") from None
+        os.replace(staged_path, final_path)
+        return final_path
+    os.remove(staged_path)
+    return final_path
+
+
+class UploadJob:
+    """Tracks one uploaded database through the preparation pipeline."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    def __init__(self, db_name: str, staged_path: str, overwrite: bool = False):
+        self.job_id = uuid.uuid4().hex
+        self.db_name = db_name
+        self.staged_path = staged_path
+        self.overwrite = overwrite
+        self.status = self.PENDING
+        self.stage: Optional[str] = None
+        self.report: Dict = {}
+        self.error: Optional[QueryPipelineError] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the job has finished, successfully or not."""
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class UploadManager:
+    """
+    Prepares uploaded databases in the background and registers them when ready.
+
+    An upload is written to a staging directory inside db_dir, checked,
+    analyzed and pre-indexed on a worker thread, and only then renamed into
+    db_dir, so it never appears in the database list half-prepared.
+    """
+
+    def __init__(
+        self,
+        db_dir: str = "db",
+        on_registered: Optional[Callable[[str], None]] = None,
+        max_workers: int = 1,
+        vacuum: bool = UPLOAD_VACUUM,
+        page_size: int = UPLOAD_PAGE_SIZE
+    ):
+        """
+        Args:
+            db_dir: Directory holding the SQLite databases
+            on_registered: Called with the database name after it is registered (e.g., to warm caches)
+            max_workers: Uploads prepared concurrently
+            vacuum: Rebuild uploads with VACUUM
+            page_size: Page size to VACUUM uploads into (0 keeps theirs)
+        """
+        self.db_dir = db_dir
+        self.on_registered = on_registered
+        self.vacuum = vacuum
+        self.page_size = page_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nlsql-upload")
+        self._jobs: Dict[str, UploadJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, file_name: str, data: bytes, overwrite: bool = False) -> UploadJob:
+        """
+        Stage an uploaded database file and queue it for preparation.
+
+        Args:
+            file_name: Uploaded file name, used as the database name
+            data: File contents
+            overwrite: Replace an existing database of the same name
+
+        Returns:
+            The queued UploadJob, whose status can be polled via get()
+
+        Raises:
+            UploadError: If the file name is not a database name, or names an
+                existing database and overwrite is False.
+        """
+        job = self._stage(file_name, data, overwrite)
+        self._executor.submit(self._run, job)
+        return job
+
+    def prepare(self, file_name: str, data: bytes, overwrite: bool = False) -> UploadJob:
+        """Stage, prepare and register a database file on the calling thread (e.g., from the CLI)."""
+        job = self._stage(file_name, data, overwrite)
+        self._run(job)
+        return job
+
+    def _stage(self, file_name: str, data: bytes, overwrite: bool) -> UploadJob:
+        """Write an upload into its own staging directory and track it."""
+        db_name = os.path.basename(file_name)
+        if not db_name.endswith(DATABASE_EXTENSIONS) or db_name.startswith("."):
+            raise UploadError(f"Not a database file name: {file_name}")
+        # Checked again when registering, in case another upload takes the name meanwhile
+        if not overwrite and os.path.exists(os.path.join(self.db_dir, db_name)):
+            raise UploadError(f"Database {db_name} already exists; upload it with overwrite to replace it")
+
+        staging_dir = os.path.join(self.db_dir, STAGING_DIR_NAME, uuid.uuid4().hex)
+        os.makedirs(staging_dir, exist_ok=True)
+        staged_path = os.path.join(staging_dir, db_name)
+        with open(staged_path, "wb") as f:
+            f.write(data)
+
+        job = UploadJob(db_name, staged_path, overwrite)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[UploadJob]:
+        """Look up a job by id, returning None if it is unknown."""
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: UploadJob) -> None:
+        """Prepare and register one upload, always cleaning up its staging directory."""
+        job.status = UploadJob.RUNNING
+
+        def on_stage(stage: str) -> None:
+            job.stage = stage
+
+        try:
+            job.report = prepare_database(job.staged_path, job.db_name, self.vacuum, self.page_size, on_stage)
+            on_stage("register")
+            register_database(job.staged_path, self.db_dir, job.db_name, job.overwrite)
+            if self.on_registered:
+                on_stage("warm")
+                try:
+                    self.on_registered(job.db_name)
+                except Exception as e:
+                    # The database is registered; it will simply be warmed by its first question
+                    job.report["warm_error"] = str(e)
+            job.status = UploadJob.SUCCEEDED
+        except QueryPipelineError as e:
+            job.error = e
+            job.status = UploadJob.FAILED
+        except Exception as e:
+            job.error = UploadError(f"Unexpected error during {job.stage or 'upload'}: {e}")
+            job.status = UploadJob.FAILED
+        finally:
+            job.finished_at = time.time()
+            shutil.rmtree(os.path.dirname(job.staged_path), ignore_errors=True)
@@ -0,0 +1,350 @@
+import bisect
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from databse_manager import data_fingerprint, database_alias, federation_members, is_federation, is_internal_table
+
+
+VALUE_INDEX_DIR = "cache"
+# Columns with more distinct values than this are not indexed
+MAX_DISTINCT_VALUES = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", "1000"))
+# Minimum difflib similarity for a fuzzy literal rewrite
+FUZZY_CUTOFF = 0.8
+# Words ignored when matching acronyms (e.g., 'USA' -> 'United States of America')
+ACRONYM_STOPWORDS = {"of", "the", "and", "&"}
+
+_NUMBER = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+
+
+def _acronym(value: str) -> str:
+    words = re.findall(r"[A-Za-z0-9]+", value)
+    return "".join(word[0] for word in words if word.lower() not in ACRONYM_STOPWORDS).lower()
+
+
+class ColumnValues:
+    """Distinct values of one column with exact, prefix, fuzzy and acronym lookup."""
+
+    def __init__(self, values: List[str]):
+        self.values = sorted(set(values))
+        # Lowercased values, sorted for prefix search
+        self._lowered = sorted((value.lower(), value) for value in self.values)
+        self._keys = [key for key, _ in self._lowered]
+        self._by_lower: Dict[str, str] = {}
+        for key, value in self._lowered:
+            self._by_lower.setdefault(key, value)
+
+    def exact(self, value: str, case_sensitive: bool = True) -> Optional[str]:
+        """Return the stored value equal to value (ignoring case if requested)."""
+        if case_sensitive:
+            index = bisect.bisect_left(self.values, value)
+            if index < len(self.values) and self.values[index] == value:
+                return value
+            return None
+        return self._by_lower.get(value.lower())
+
+    def prefix(self, prefix: str, limit: int = 10) -> List[str]:
+        """Stored values starting with prefix (case-insensitive)."""
+        key = prefix.lower()
+        start = bisect.bisect_left(self._keys, key)
+        matches = []
+        for lowered, value in self._lowered[start:]:
+            if not lowered.startswith(key) or len(matches) >= limit:
+                break
+            matches.append(value)
+        return matches
+
+    def contains(self, fragment: str) -> bool:
+        """Whether any stored value contains fragment (case-insensitive, like SQLite LIKE)."""
+        fragment = fragment.lower()
+        return any(fragment in key for key in self._keys)
+
+    def closest(self, value: str) -> Optional[Tuple[str, str]]:
+        """
+        Best stored match for a literal that is not present verbatim.
+
+        Returns:
+            (stored value, match kind) with kind 'case', 'acronym', 'prefix' or 'fuzzy', or None
+        """
+        key = value.strip().lower()
+        if key in self._by_lower:
+            return self._by_lower[key], "case"
+        if 1 < len(key) <= 6 and key.isalnum():
+            acronyms = [stored for stored in self.values if _acronym(stored) == key]
+            if len(acronyms) == 1:
+                return acronyms[0], "acronym"
+        prefixed = self.prefix(key, limit=2)
+        if len(prefixed) == 1:
+            return prefixed[0], "prefix"
+        fuzzy = difflib.get_close_matches(key, self._keys, n=1, cutoff=FUZZY_CUTOFF)
+        if fuzzy:
+            return self._by_lower[fuzzy[0]], "fuzzy"
+        return None
+
+
+class ValueIndex:
+    """
+    Per-database index of distinct values for low/medium-cardinality TEXT columns.
+
+    Used to ground string literals in generated SQL (e.g., 'usa' -> 'USA') before
+    the query runs, instead of returning zero rows and prompting a retry.
+    """
+
+    def __init__(self, columns: Dict[str, Dict[str, List[str]]], source: Optional[Dict] = None):
+        """
+        Args:
+            columns: table -> column -> distinct values
+            source: Fingerprint of the database the index was built from
+        """
+        self.source = source or {}
+        self.columns: Dict[str, Dict[str, ColumnValues]] = {
+            table: {column: ColumnValues(values) for column, values in table_columns.items()}
+            for table, table_columns in columns.items()
+        }
+
+    @staticmethod
+    def fingerprint(db_path: str) -> Dict:
+        """Identify a database's current data cheaply (see data_fingerprint)."""
+        return data_fingerprint(db_path)
+
+    @classmethod
+    def build(cls, db_path: str, max_distinct: int = MAX_DISTINCT_VALUES, tables: Optional[List[str]] = None) -> "ValueIndex":
+        """Scan a database (or only some of its tables) and index every TEXT column with at most max_distinct values."""
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            columns: Dict[str, Dict[str, List[str]]] = {}
+            for (table_name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+                if table_name.startswith("sqlite_") or is_internal_table(table_name):
+                    continue
+                if tables is not None and table_name not in tables:
+                    continue
+                for col in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall():
+                    column_name, datatype = col[1], (col[2] or "").upper()
+                    if datatype and "CHAR" not in datatype and "TEXT" not in datatype and "CLOB" not in datatype:
+                        continue
+                    # LIMIT stops the scan as soon as the column is known to be too diverse
+                    rows = conn.execute(
+                        f'SELECT DISTINCT "{column_name}" FROM "{table_name}" '
+                        f'WHERE "{column_name}" IS NOT NULL LIMIT ?',
+                        (max_distinct + 1,)
+                    ).fetchall()
+                    values = [row[0] for row in rows if isinstance(row[0], str) and row[0].strip()]
+                    if not values or len(rows) > max_distinct:
+                        continue
+                    # CSV imports store numbers as TEXT; those columns have nothing to ground
+                    if all(_NUMBER.match(value.strip()) for value in values):
+                        continue
+                    columns.setdefault(table_name, {})[column_name] = values
+        finally:
+            conn.close()
+        return cls(columns, cls.fingerprint(db_path))
+
+    @staticmethod
+    def index_path(db_name: str, index_dir: str = VALUE_INDEX_DIR) -> str:
+        """Cache file for a database's value index (e.g., 'cache/soil_pollution_values.json')."""
+        base_name = db_name.replace('.db', '').replace('.sqlite', '').replace('.sqlite3', '')
+        return os.path.join(index_dir, f"{base_name}_values.json")
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = {
+            "source": self.source,
+            "columns": {
+                table: {column: values.values for column, values in table_columns.items()}
+                for table, table_columns in self.columns.items()
+            }
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ValueIndex"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (IOError, json.JSONDecodeError):
+            return None
+        return cls(payload.get("columns", {}), payload.get("source"))
+
+    @classmethod
+    def build_and_save(
+        cls,
+        db_path: str,
+        db_name: Optional[str] = None,
+        index_dir: str = VALUE_INDEX_DIR,
+        tables: Optional[List[str]] = None
+    ) -> "ValueIndex":
+        """
+        Rebuild a database's index and persist it (e.g., right after an import).
+
+        Args:
+            tables: Only rescan these tables, keeping the saved index's other columns
+                (everything is rescanned if there is no saved index)
+        """
+        path = cls.index_path(db_name or os.path.basename(db_path), index_dir)
+        previous = cls.load(path) if tables is not None else None
+        index = cls.build(db_path, tables=tables if previous is not None else None)
+        if previous is not None:
+            for table, table_columns in previous.columns.items():
+                if table not in tables:
+                    index.columns.setdefault(table, table_columns)
+        index.save(path)
+        with _loaded_lock:
+            _loaded.pop((index_dir, db_path), None)
+        return index
+
+    @classmethod
+    def for_database(cls, db_name: str, db_dir: str = "db", index_dir: str = VALUE_INDEX_DIR) -> "ValueIndex":
+        """
+        Load a database's index, building it lazily if missing or stale.
+
+        Federations merge their members' indexes under alias.table names.
+        """
+        if is_federation(db_name):
+            merged = cls({})
+            for member in federation_members(db_name):
+                alias = database_alias(member)
+                for table, table_columns in cls.for_database(member, db_dir, index_dir).columns.items():
+                    merged.columns[f"{alias}.{table}"] = table_columns
+            return merged
+
+        db_path = os.path.join(db_dir, db_name)
+        key = (index_dir, db_path)
+        fingerprint = cls.fingerprint(db_path)
+        with _loaded_lock:
+            index = _loaded.get(key)
+            build_lock = _build_locks.setdefault(key, threading.Lock())
+        if index is not None and index.source == fingerprint:
+            return index
+
+        # Only callers of the same database wait while it is indexed
+        with build_lock:
+            with _loaded_lock:
+                index = _loaded.get(key)
+            if index is not None and index.source == fingerprint:
+                return index
+            path = cls.index_path(db_name, index_dir)
+            index = cls.load(path)
+            if index is None or index.source != fingerprint:
+                index = cls.build(db_path)
+                index.save(path)
+            with _loaded_lock:
+                _loaded[key] = index
+            return index
+
+    def column_values(self, table: str, column: str) -> Optional[ColumnValues]:
+        return self.columns.get(table, {}).get(column)
+
+    def ground_sql(self, sql: str) -> Tuple[str, List[Dict]]:
+        """
+        Rewrite string literals compared against indexed columns to values that exist.
+
+        Handles =, <>, IN and LIKE comparisons, including columns wrapped in
+        LOWER/UPPER/TRIM. Literals that already match are left untouched.
+
+        Returns:
+            (possibly rewritten SQL, list of {"table", "column", "from", "to", "match"})
+        """
+        try:
+            tree = sqlglot.parse_one(sql, dialect="sqlite")
+        except Exception:
+            return sql, []
+
+        tables = self._tables_in(tree)
+        rewrites: List[Dict] = []
+        for node in tree.find_all(exp.EQ, exp.NEQ, exp.In, exp.Like):
+            column, transforms = self._unwrap_column(node.this)
+            if column is None:
+                continue
+            resolved = self._resolve_column(column, tables)
+            if resolved is None:
+                continue
+            table, values = resolved
+
+            literals = node.expressions if isinstance(node, exp.In) else [node.expression]
+            for literal in literals:
+                if not isinstance(literal, exp.Literal) or not literal.is_string:
+                    continue
+                grounded = self._ground_literal(literal.this, values, transforms, isinstance(node, exp.Like))
+                if grounded is not None and grounded[0] != literal.this:
+                    rewrites.append({
+                        "table": table, "column": column.name,
+                        "from": literal.this, "to": grounded[0], "match": grounded[1]
+                    })
+                    literal.replace(exp.Literal.string(grounded[0]))
+
+        if not rewrites:
+            return sql, []
+        return tree.sql(dialect="sqlite"), rewrites
+
+    def _tables_in(self, tree: exp.Expression) -> Dict[str, str]:
+        """Map each table alias (and name) in a query to its indexed table name."""
+        tables = {}
+        for table in tree.find_all(exp.Table):
+            name = f"{table.db}.{table.name}" if table.db else table.name
+            if name not in self.columns and table.name in self.columns:
+                name = table.name
+            tables[table.alias_or_name] = name
+        return tables
+
+    @staticmethod
+    def _unwrap_column(node: exp.Expression) -> Tuple[Optional[exp.Column], List[str]]:
+        """Strip LOWER/UPPER/TRIM wrappers, returning the column and the wrappers applied."""
+        transforms = []
+        while isinstance(node, (exp.Lower, exp.Upper, exp.Trim)):
+            transforms.append(type(node).__name__.lower())
+            node = node.this
+        return (node, transforms) if isinstance(node, exp.Column) else (None, transforms)
+
+    def _resolve_column(self, column: exp.Column, tables: Dict[str, str]) -> Optional[Tuple[str, ColumnValues]]:
+        """Find the indexed values for a column reference."""
+        candidates = [tables[column.table]] if column.table in tables else list(tables.values())
+        for table in candidates:
+            values = self.column_values(table, column.name)
+            if values is not None:
+                return table, values
+        return None
+
+    @staticmethod
+    def _ground_literal(literal: str, values: ColumnValues, transforms: List[str], is_like: bool) -> Optional[Tuple[str, str]]:
+        """Return (grounded literal, match kind), or None if it cannot or need not be grounded."""
+        def apply_transforms(value: str) -> str:
+            if "lower" in transforms:
+                return value.lower()
+            if "upper" in transforms:
+                return value.upper()
+            return value
+
+        if is_like:
+            core = literal.strip("%")
+            if not core or "%" in core or "_" in core or values.contains(core):
+                return None
+            match = values.closest(core)
+            if match is None:
+                return None
+            return literal.replace(core, apply_transforms(match[0])), match[1]
+
+        if "lower" in transforms or "upper" in transforms:
+            # LOWER(col) = 'x' only matches if the literal is already in the transformed case
+            stored = values.exact(literal.strip(), case_sensitive=False)
+            if stored is not None and apply_transforms(stored) == literal.strip():
+                return None
+        elif values.exact(literal.strip() if "trim" in transforms else literal):
+            return None
+        match = values.closest(literal)
+        if match is None:
+            return None
+        return apply_transforms(match[0]), match[1]
+
+
+_loaded: Dict[Tuple[str, str], ValueIndex] = {}
+# Guards the two dicts; building an index only holds that database's own lock
+_loaded_lock = threading.Lock()
+_build_locks: Dict[Tuple[str, str], threading.Lock] = {}
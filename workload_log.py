@@ -0,0 +1,364 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+
+from latency_stats import percentile
+from sql_optimizer import QueryOptimizer
+
+
+# Set WORKLOAD_LOG=0 to stop recording executed queries
+WORKLOAD_LOG_ENABLED = os.getenv("WORKLOAD_LOG", "1") != "0"
+WORKLOAD_LOG_DIR = "logs"
+# Executions at least this slow are flagged
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "1000"))
+# The log is rotated to <file>.1 (replacing the previous one) once it grows past this size
+WORKLOAD_LOG_MAX_BYTES = int(os.getenv("WORKLOAD_LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Clauses whose columns an index (or a summary table) could serve
+COLUMN_ROLES = (("filter", exp.Where), ("join", exp.Join), ("group", exp.Group), ("order", exp.Order))
+
+
+def _table_name(table: exp.Table) -> str:
+    """Name of a table as the schema lists it (alias.table for federated tables)."""
+    return f"{table.db}.{table.name}" if table.db else table.name
+
+
+def query_pattern(tree: exp.Expression) -> str:
+    """A query with its literals replaced by '?', so questions that differ only in values group together."""
+    shape = tree.copy().transform(lambda node: exp.Placeholder() if isinstance(node, exp.Literal) else node)
+    return shape.sql(dialect="sqlite")
+
+
+def referenced_columns(tree: exp.Expression, schema: Dict[str, List[Dict]]) -> Dict[str, List[str]]:
+    """
+    Schema columns a query filters, joins, groups or orders on.
+
+    Args:
+        tree: Parsed query
+        schema: Database schema (table -> column descriptions)
+
+    Returns:
+        Role ('filter', 'join', 'group', 'order') -> sorted 'table.column' names; columns that
+        cannot be resolved to a single schema table (aliases of expressions, ambiguous names) are left out
+    """
+    ctes = {cte.alias for cte in tree.find_all(exp.CTE)}
+    aliases = {
+        table.alias_or_name: _table_name(table)
+        for table in tree.find_all(exp.Table)
+        if table.name not in ctes and _table_name(table) in schema
+    }
+    table_columns = {
+        table: {column["name"].lower(): column["name"] for column in schema[table]}
+        for table in set(aliases.values())
+    }
+
+    def resolve(column: exp.Column) -> Optional[str]:
+        if column.table:
+            owners = [aliases[column.table]] if column.table in aliases else []
+        else:
+            owners = [table for table, columns in table_columns.items() if column.name.lower() in columns]
+        if len(owners) != 1 or column.name.lower() not in table_columns[owners[0]]:
+            return None
+        return f"{owners[0]}.{table_columns[owners[0]][column.name.lower()]}"
+
+    columns = {}
+    for role, clause in COLUMN_ROLES:
+        names = set()
+        for node in tree.find_all(clause):
+            # A join's own table is not one of its columns; only its ON condition is
+            scope = node.args.get("on") if clause is exp.Join else node
+            for column in scope.find_all(exp.Column) if scope is not None else []:
+                name = resolve(column)
+                if name:
+                    names.add(name)
+        if names:
+            columns[role] = sorted(names)
+    return columns
+
+
+def describe_plan(plan: List[Dict], aliases: Dict[str, str]) -> Dict:
+    """
+    Summarize an EXPLAIN QUERY PLAN.
+
+    Args:
+        plan: Plan rows (id, parent, detail)
+        aliases: Name or alias a plan step refers to a table by -> schema table name
+
+    Returns:
+        The plan as indented text lines, tables read by a full table scan, indexes used and
+        tables SQLite had to build a temporary (automatic) index on
+    """
+    depth = {0: -1}
+    lines, full_scans, indexes, automatic = [], [], [], []
+    for step in plan:
+        depth[step["id"]] = depth.get(step["parent"], -1) + 1
+        detail = step["detail"]
+        lines.append("  " * depth[step["id"]] + detail)
+        words = detail.split()
+        if words[0] not in ("SCAN", "SEARCH") or len(words) < 2 or words[1] not in aliases:
+            continue
+        table = aliases[words[1]]
+        if "AUTOMATIC" in detail:
+            automatic.append(table)
+        elif " INDEX " in detail:
+            indexes.append(detail.split(" INDEX ", 1)[1].split()[0])
+        elif words[0] == "SCAN":
+            full_scans.append(table)
+    return {
+        "plan": lines,
+        "full_scans": sorted(set(full_scans)),
+        "indexes": sorted(set(indexes)),
+        "automatic_indexes": sorted(set(automatic)),
+    }
+
+
+class WorkloadLog:
+    """
+    Persistent per-database log of executed queries, with their plans and timings.
+
+    Every generated query that reaches execution is appended to
+    logs/<database>_workload.jsonl with its execution time, rows returned,
+    rows scanned (estimated from the plan by the optimizer's cost model),
+    its EXPLAIN QUERY PLAN, the tables it fully scanned and the columns it
+    filters, joins, groups and orders on. stats() aggregates the log into
+    per-table latency percentiles, full-scan frequency, most-used columns
+    and the query patterns that cost the most.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        optimizer: Optional[QueryOptimizer] = None,
+        log_dir: str = WORKLOAD_LOG_DIR,
+        slow_ms: float = SLOW_QUERY_MS
+    ):
+        """
+        Args:
+            db_name: Database (or federation) whose queries are logged
+            optimizer: The database's optimizer, used to plan and cost queries (only needed to record)
+            log_dir: Directory holding the logs
+            slow_ms: Execution time at which a query is flagged as slow
+        """
+        self.db_name = db_name
+        self.optimizer = optimizer
+        self.path = self.get_log_file_for_db(db_name, log_dir)
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_log_file_for_db(db_name: str, log_dir: str = WORKLOAD_LOG_DIR) -> str:
+        """Workload log path for a given database name."""
+        base_name = db_name.replace('.db', '').replace('.sqlite', '').replace('.sqlite3', '')
+        return os.path.join(log_dir, f"{base_name}_workload.jsonl")
+
+    def describe(self, sql: str, execution_sql: str, schema: Dict[str, List[Dict]]) -> Dict:
+        """
+        Plan-derived details of a query: tables, columns, pattern, plan, full scans and rows scanned.
+
+        Args:
+            sql: The validated query, which tables, columns and pattern are taken from
+            execution_sql: The query actually run (e.g., rewritten to read a summary table), which is planned
+            schema: Database schema
+        """
+        tree = sqlglot.parse_one(sql, dialect="sqlite")
+        details = {
+            "tables": sorted({_table_name(table) for table in tree.find_all(exp.Table)} & set(schema)),
+            "columns": referenced_columns(tree, schema),
+            "pattern": query_pattern(tree),
+        }
+        if self.optimizer is None:
+            return details
+
+        executed = tree if execution_sql == sql else sqlglot.parse_one(execution_sql, dialect="sqlite")
+        plan = self.optimizer.plan(execution_sql)
+        aliases = {table.alias_or_name: _table_name(table) for table in executed.find_all(exp.Table)}
+        details.update(describe_plan(plan, {alias: name for alias, name in aliases.items() if name in schema}))
+        details["rows_scanned"] = round(self.optimizer.cost(execution_sql, executed, plan, sorts=False)) \
+            if isinstance(executed, exp.Select) else None
+        return details
+
+    def record(self, outcome, schema: Dict[str, List[Dict]]) -> Optional[Dict]:
+        """
+        Append a query that reached execution to the log.
+
+        Args:
+            outcome: QueryOutcome of the question
+            schema: Database schema
+
+        Returns:
+            The logged entry, or None if the outcome never ran a query
+        """
+        failed_in_execution = outcome.error is not None and outcome.error.stage == "execution"
+        if outcome.sql is None or ("execution" not in outcome.timings and not failed_in_execution):
+            return None
+
+        execution_ms = round(outcome.timings["execution"] * 1000, 2) if "execution" in outcome.timings else None
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "question": outcome.question,
+            "sql": outcome.sql,
+            "execution_sql": outcome.execution_sql,
+            "rewrite": "sample" if outcome.approximation else "aggregate" if outcome.execution_sql else None,
+            "engine": outcome.engine,
+            "execution_ms": execution_ms,
+            "rows_returned": len(outcome.result) if outcome.result is not None else None,
+            "truncated": outcome.truncated,
+            "slow": execution_ms is not None and execution_ms >= self.slow_ms,
+        }
+        if outcome.error is not None:
+            entry["error"] = outcome.error.message
+        try:
+            entry.update(self.describe(outcome.sql, outcome.execution_sql or outcome.sql, schema))
+        except Exception as e:
+            # A query the log cannot parse or plan is still worth its timing
+            entry["plan_error"] = str(e)
+        self.append(entry)
+        return entry
+
+    def append(self, entry: Dict) -> None:
+        """Write one entry, rotating the log when it has grown past WORKLOAD_LOG_MAX_BYTES."""
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= WORKLOAD_LOG_MAX_BYTES:
+                os.replace(self.path, f"{self.path}.1")
+            # One write per line, so processes sharing the log do not interleave entries
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def entries(
+        self,
+        since: Optional[str] = None,
+        table: Optional[str] = None,
+        slow_only: bool = False,
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Logged entries, oldest first (including the last rotated file).
+
+        Args:
+            since: Only entries logged at or after this ISO date or timestamp
+            table: Only entries reading this table
+            slow_only: Only entries flagged as slow
+            limit: Only the most recent entries
+        """
+        entries = []
+        for path in (f"{self.path}.1", self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash
+                        continue
+                    if since and entry["timestamp"] < since:
+                        continue
+                    if table and table not in entry.get("tables", []):
+                        continue
+                    if slow_only and not entry.get("slow"):
+                        continue
+                    entries.append(entry)
+        return entries[-limit:] if limit else entries
+
+    def clear(self) -> None:
+        """Delete the log and its rotated file."""
+        with self._lock:
+            for path in (self.path, f"{self.path}.1"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def stats(self, entries: Optional[List[Dict]] = None, top: int = 10) -> Dict:
+        """
+        Aggregate workload statistics.
+
+        Args:
+            entries: Entries to aggregate (the whole log if None)
+            top: Columns, patterns and slow queries listed
+
+        Returns:
+            Query, error, slow and full-scan counts; p50/p95 execution time overall and per table;
+            the most used columns (and how often their table was fully scanned); the patterns
+            with the most total execution time; and the slowest queries
+        """
+
+        entries = self.entries() if entries is None else entries
+        timed = [entry for entry in entries if entry.get("execution_ms") is not None]
+        times = [entry["execution_ms"] for entry in timed]
+
+        tables: Dict[str, Dict] = {}
+        for entry in entries:
+            for table in entry.get("tables", []):
+                summary = tables.setdefault(table, {
+                    "queries": 0, "times": [], "slow": 0, "full_scans": 0, "automatic_indexes": 0, "rewritten": 0
+                })
+                summary["queries"] += 1
+                if entry.get("execution_ms") is not None:
+                    summary["times"].append(entry["execution_ms"])
+                summary["slow"] += bool(entry.get("slow"))
+                summary["full_scans"] += table in entry.get("full_scans", [])
+                summary["automatic_indexes"] += table in entry.get("automatic_indexes", [])
+                summary["rewritten"] += bool(entry.get("rewrite"))
+        for summary in tables.values():
+            times_ms = summary.pop("times")
+            summary.update({
+                "p50_ms": percentile(times_ms, 50),
+                "p95_ms": percentile(times_ms, 95),
+                "full_scan_rate": round(summary["full_scans"] / summary["queries"], 3),
+            })
+
+        columns: Dict[str, Dict] = {}
+        for entry in entries:
+            for role, names in entry.get("columns", {}).items():
+                for name in names:
+                    usage = columns.setdefault(name, {"column": name, "queries": 0, "full_scans": 0})
+                    usage[role] = usage.get(role, 0) + 1
+            for name in {name for names in entry.get("columns", {}).values() for name in names}:
+                columns[name]["queries"] += 1
+                # Columns of a fully scanned table are the index candidates
+                if name.rsplit(".", 1)[0] in entry.get("full_scans", []):
+                    columns[name]["full_scans"] += 1
+
+        patterns: Dict[str, Dict] = {}
+        for entry in timed:
+            if "pattern" not in entry:
+                continue
+            pattern = patterns.setdefault(entry["pattern"], {
+                "pattern": entry["pattern"], "queries": 0, "times": [], "full_scans": 0, "example": entry["question"]
+            })
+            pattern["queries"] += 1
+            pattern["times"].append(entry["execution_ms"])
+            pattern["full_scans"] += bool(entry.get("full_scans"))
+        for pattern in patterns.values():
+            times_ms = pattern.pop("times")
+            pattern.update({
+                "total_ms": round(sum(times_ms), 2),
+                "p50_ms": percentile(times_ms, 50),
+                "p95_ms": percentile(times_ms, 95),
+            })
+
+        full_scan_queries = sum(1 for entry in entries if entry.get("full_scans"))
+        return {
+            "database": self.db_name,
+            "queries": len(entries),
+            "errors": sum(1 for entry in entries if entry.get("error")),
+            "slow": sum(1 for entry in entries if entry.get("slow")),
+            "slow_ms": self.slow_ms,
+            "full_scan_queries": full_scan_queries,
+            "full_scan_rate": round(full_scan_queries / len(entries), 3) if entries else None,
+            "p50_ms": percentile(times, 50),
+            "p95_ms": percentile(times, 95),
+            "tables": dict(sorted(tables.items(), key=lambda item: -item[1]["queries"])),
+            "columns": sorted(columns.values(), key=lambda usage: (-usage["queries"], usage["column"]))[:top],
+            "patterns": sorted(patterns.values(), key=lambda pattern: -pattern["total_ms"])[:top],
+            "slowest": [
+                {key: entry.get(key) for key in ("timestamp", "question", "sql", "execution_ms", "full_scans", "plan")}
+                for entry in sorted(timed, key=lambda entry: -entry["execution_ms"])[:top]
+            ],
+        }